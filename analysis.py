@@ -0,0 +1,292 @@
+"""analysis.py: 
+
+Reaction network of a YACML model as sparse matrices, without MOOSE.
+
+Species and reactions of all compartments and chemical subnetworks are
+numbered once. Species i is named by its path below the model e.g.
+dend/recipeA/a and reaction j likewise e.g. dend/recipeA/a<-->b.
+
+    import analysis
+    net = analysis.from_file( 'model.yacml' )
+    net.N                   # stoichiometry, species x reactions (CSR)
+    net.reactant_order      # stoichiometric numbers of substrates (CSR)
+    net.product_order       # stoichiometric numbers of products (CSR)
+    net.kf, net.kb          # rate parameters, one per reaction
+    net.species_index[ 'dend/recipeA/a' ]
+
+Every reaction is reversible: the forward direction consumes substrates with
+rate kf, the backward direction consumes products with rate kb. A rate which
+is an expression of species or time is nan; num_rate tells which reactions
+are given in numbers (numKf, numKb) instead of concentrations.
+
+Conservation laws (moieties e.g. free + bound kinase) are the left null space
+of N, computed exactly in integers:
+
+    L = net.conservation_laws( )    # laws x species, L * N = 0
+    net.moieties( L )               # [ 'dend/recipeA/E + dend/recipeA/ES', ... ]
+
+    python analysis.py model.yacml
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import numpy as np
+import scipy.sparse as sparse
+try:
+    from math import gcd
+except ImportError:
+    from fractions import gcd
+
+import compartment as ir
+import yparser.yparser as yp
+import yparser.ast_processor as astp
+from yparser import propagation
+
+class ReactionNetwork( object ):
+    """Stoichiometry and rate parameters of a compartment.Model.
+    """
+
+    def __init__( self, model ):
+        self.model = model
+        self.species, self.reactions = [ ], [ ]
+        # Volume of compartment of each species.
+        volumes, buffered = [ ], [ ]
+        subN, prdN = [ ], [ ]
+        # Rows and columns of substrates and products, kept apart.
+        subRows, subCols, prdRows, prdCols = [ ], [ ], [ ], [ ]
+        kf, kb, numRate = [ ], [ ], [ ]
+        for compt, net in model.networks( ):
+            prefix = '%s/%s/' % ( compt.name, net.name )
+            offset = len( self.species )
+            self.species += [ prefix + s.name for s in net.species ]
+            volumes += [ compt.volume ] * len( net.species )
+            buffered += [ s.buffered for s in net.species ]
+            for r in net.reactions:
+                j = len( self.reactions )
+                self.reactions.append( prefix + r.name )
+                subRows.append( r.substrates + offset )
+                subCols.append( np.repeat( j, r.substrates.size ) )
+                subN.append( r.substrate_stoich )
+                prdRows.append( r.products + offset )
+                prdCols.append( np.repeat( j, r.products.size ) )
+                prdN.append( r.product_stoich )
+                f, b, num = rate_parameters( r )
+                kf.append( f )
+                kb.append( b )
+                numRate.append( num )
+
+        self.species_index = dict( [ ( s, i ) for i, s in enumerate( self.species ) ] )
+        self.reaction_index = dict( [ ( r, j ) for j, r in enumerate( self.reactions ) ] )
+        self.volume = np.array( volumes, dtype = float )
+        self.buffered = np.array( buffered, dtype = bool )
+        shape = ( len( self.species ), len( self.reactions ) )
+        self.reactant_order = coo_to_csr( subRows, subCols, subN, shape )
+        self.product_order = coo_to_csr( prdRows, prdCols, prdN, shape )
+        self.N = ( self.product_order - self.reactant_order ).tocsr( )
+        self.N.eliminate_zeros( )
+        self.kf = np.array( kf, dtype = float )
+        self.kb = np.array( kb, dtype = float )
+        self.num_rate = np.array( numRate, dtype = bool )
+
+    @property
+    def shape( self ):
+        """(number of species, number of reactions).
+        """
+        return self.N.shape
+
+    def rate_vector( self ):
+        """Rate parameters of the forward and then the backward directions,
+        2 x number of reactions values. Column j + R of irreversible( ) has
+        rate k[ j + R ].
+        """
+        return np.concatenate( [ self.kf, self.kb ] )
+
+    def irreversible( self ):
+        """Each reaction split in forward and backward reactions: return
+        stoichiometry, reactant order and rate vector of these 2R reactions.
+        """
+        N = sparse.hstack( [ self.N, -self.N ] ).tocsr( )
+        order = sparse.hstack( [ self.reactant_order, self.product_order ] ).tocsr( )
+        return N, order, self.rate_vector( )
+
+    def conservation_laws( self, order = None ):
+        """Integer basis of conservation laws: a matrix L (laws x species,
+        CSR) with L * N = 0. Buffered species are left out. Among equivalent
+        bases the one whose free species come first in order (default: order
+        of species) is returned; e.g. E + ES and S + ES + P for E + S <-> ES
+        -> E + P.
+        """
+        nS = self.shape[ 0 ]
+        if order is None:
+            order = range( nS )
+        keep = [ i for i in order if not self.buffered[ i ] ]
+        # Later species become pivots; the first ones stay free.
+        laws = left_null_space( self.N, list( reversed( keep ) ) )
+        rows, cols, data = [ ], [ ], [ ]
+        for k, law in enumerate( laws ):
+            for i, v in law.items( ):
+                rows.append( k )
+                cols.append( i )
+                data.append( v )
+        L = sparse.coo_matrix( ( np.array( data, dtype = np.int64 ), ( rows, cols ) )
+                , shape = ( len( laws ), nS ) )
+        return L.tocsr( )
+
+    def moieties( self, L ):
+        """Conserved moieties of laws L as text e.g. 'a + 2 b'.
+        """
+        res = [ ]
+        for k in range( L.shape[ 0 ] ):
+            row = L.getrow( k )
+            terms = [ ( '%s' % self.species[ i ] ) if v == 1 else
+                    '%d %s' % ( v, self.species[ i ] )
+                    for i, v in sorted( zip( row.indices, row.data ) ) ]
+            res.append( ' + '.join( terms ).replace( '+ -', '- ' ) )
+        return res
+
+    def __repr__( self ):
+        return 'ReactionNetwork(%d species, %d reactions)' % self.shape
+
+def coo_to_csr( rows, cols, data, shape ):
+    """CSR matrix of lists of index and value arrays. Repeated entries (a
+    species which appears twice on one side) are summed.
+    """
+    if rows:
+        rows, cols = np.concatenate( rows ), np.concatenate( cols )
+        data = np.concatenate( data )
+    m = sparse.coo_matrix( ( np.asarray( data, dtype = np.int32 )
+        , ( np.asarray( rows, dtype = np.int32 ), np.asarray( cols, dtype = np.int32 ) ) )
+        , shape = shape
+        )
+    return m.tocsr( )
+
+def integer_rref( rows, order ):
+    """Reduced row echelon form of integer rows (dictionaries column : int)
+    in exact integer arithmetic. Pivots are taken in column order order.
+    Return list of ( pivot column, row ); every row is divided by the gcd of
+    its entries, its pivot is positive and pivot columns are zero in all other
+    rows.
+    """
+    rows = dict( [ ( k, dict( r ) ) for k, r in enumerate( rows ) if r ] )
+    free = set( rows )
+    # Column : keys of rows which have it.
+    where = { }
+    for k, r in rows.items( ):
+        for c in r:
+            where.setdefault( c, set( ) ).add( k )
+    pivots = [ ]
+    for col in order:
+        candidates = [ k for k in where.get( col, ( ) ) if k in free ]
+        if not candidates:
+            continue
+        # Sparsest row as pivot keeps fill-in small.
+        k = min( candidates, key = lambda x : ( len( rows[ x ] ), x ) )
+        free.discard( k )
+        prow = rows[ k ]
+        if prow[ col ] < 0:
+            prow = rows[ k ] = dict( [ ( c, -v ) for c, v in prow.items( ) ] )
+        p = prow[ col ]
+        for x in [ x for x in where[ col ] if x != k ]:
+            r, f = rows[ x ], rows[ x ][ col ]
+            new = { }
+            for c in set( r ) | set( prow ):
+                v = r.get( c, 0 ) * p - prow.get( c, 0 ) * f
+                if v:
+                    new[ c ] = v
+            g = 0
+            for v in new.values( ):
+                g = gcd( g, v )
+            g = abs( g ) or 1
+            rows[ x ] = dict( [ ( c, v // g ) for c, v in new.items( ) ] )
+            for c in r:
+                if c not in new:
+                    where[ c ].discard( x )
+            for c in new:
+                where.setdefault( c, set( ) ).add( x )
+        pivots.append( ( col, k ) )
+    return [ ( col, rows[ k ] ) for col, k in pivots ]
+
+def left_null_space( N, columns ):
+    """Integer basis of { x : x N = 0, x zero outside columns } of a sparse
+    integer matrix N (rows x cols), as dictionaries row : int. Rows which come
+    first in columns are eliminated first; each vector of the basis has one
+    of the remaining (free) rows.
+    """
+    Nt = N.T.tocsr( )
+    keep = set( columns )
+    rows = [ ]
+    for j in range( Nt.shape[ 0 ] ):
+        lo, hi = Nt.indptr[ j ], Nt.indptr[ j + 1 ]
+        r = dict( [ ( int( i ), int( v ) ) for i, v in zip( Nt.indices[ lo:hi ], Nt.data[ lo:hi ] )
+            if v and int( i ) in keep ] )
+        rows.append( r )
+    rref = integer_rref( rows, columns )
+    pivotCols = set( [ col for col, r in rref ] )
+    basis = [ ]
+    for f in reversed( columns ):
+        if f in pivotCols:
+            continue
+        # x_f = m; x_pivot = - r[ f ] m / r[ pivot ] for each row with f.
+        uses = [ ( col, r ) for col, r in rref if f in r ]
+        m = 1
+        for col, r in uses:
+            m = m * r[ col ] // gcd( m, r[ col ] )
+        x = { f : m }
+        for col, r in uses:
+            x[ col ] = - r[ f ] * m // r[ col ]
+        g = 0
+        for v in x.values( ):
+            g = gcd( g, v )
+        basis.append( dict( [ ( i, v // abs( g ) ) for i, v in x.items( ) ] ) )
+    return basis
+
+def rate_parameters( reaction ):
+    """(kf, kb, num) of a compartment.Reaction. num is True when rates are
+    numKf and numKb. A rate which is not a constant is nan.
+    """
+    rates = dict( [ ( p.name.lower( ), p.value ) for p in reaction.params ] )
+    num = 'kf' not in rates and 'numkf' in rates
+    prefix = 'num' if num else ''
+    kf = rates.get( prefix + 'kf' )
+    kb = rates.get( prefix + 'kb' )
+    return ( np.nan if kf is None else kf ), ( np.nan if kb is None else kb ), num
+
+def from_ast( tree ):
+    """ReactionNetwork of a propagated AST.
+    """
+    return ReactionNetwork( ir.build_model( tree ) )
+
+def from_text( text, filename = None, backend = None ):
+    """Parse, flatten and propagate YACML text and return its
+    ReactionNetwork. Unlike yacml.compile_model, no intermediate files are
+    written. backend is the parser backend (see yparser.set_backend); use
+    'fast' for large models.
+    """
+    tree = yp.parse_text( text, yp.ParserContext( filename ), backend )
+    tree = astp.flatten( tree )
+    propagation.propagate( tree )
+    return from_ast( tree )
+
+def from_file( filename, backend = None ):
+    with open( filename ) as f:
+        return from_text( f.read( ), filename, backend )
+
+if __name__ == '__main__':
+    import argparse
+    argp = argparse.ArgumentParser( description = 'Reaction network of a YACML model' )
+    argp.add_argument( 'model', help = 'YACML model file' )
+    argp.add_argument( '--backend', default = 'fast', help = 'Parser backend' )
+    args = argp.parse_args( )
+    net = from_file( args.model, args.backend )
+    L = net.conservation_laws( )
+    print( '%s, %d conservation laws' % ( net, L.shape[ 0 ] ) )
+    for m in net.moieties( L ):
+        print( '    %s' % m )
@@ -0,0 +1,66 @@
+"""bench_expression.py: 
+
+Evaluate the same expressions against many parameter sets, once by
+substituting values into text and calling eval (the old way) and once with
+compiled yparser.expression.Expression.
+
+Run from top-level directory:
+
+    python -m benchmarks.bench_expression --sets 10000
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import time
+import random
+import argparse
+from math import *
+
+from yparser.expression import Expression, substitute
+
+exprs_ = [ 'kf * volume / 6.022e23'
+        , 'kb / (1 + k_inh)'
+        , '2 * pi * radius * radius * length'
+        , 'exp( -E / T ) * kf'
+        , 'kf if conc > 1e-3 else kb'
+        ]
+
+def parameter_sets( n ):
+    rng = random.Random( 0 )
+    names = [ 'kf', 'kb', 'k_inh', 'volume', 'radius', 'length', 'E', 'T', 'conc' ]
+    return [ dict( [ ( x, rng.uniform( 0.5, 2.0 ) ) for x in names ] ) for i in range( n ) ]
+
+def with_eval( sets ):
+    for values in sets:
+        texts = dict( [ ( k, repr( v ) ) for k, v in values.items( ) ] )
+        [ eval( substitute( e, texts ) ) for e in exprs_ ]
+
+def with_expression( sets ):
+    compiled = [ Expression( e ) for e in exprs_ ]
+    for values in sets:
+        [ e( values ) for e in compiled ]
+
+def main( args ):
+    sets = parameter_sets( args.sets )
+    print( '%10s %12s %12s' % ( 'sets', 'eval (s)', 'compiled (s)' ) )
+    t0 = time.time( )
+    with_eval( sets )
+    t1 = time.time( )
+    with_expression( sets )
+    t2 = time.time( )
+    print( '%10d %12.3f %12.3f' % ( args.sets, t1 - t0, t2 - t1 ) )
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser( description = 'Benchmark expression evaluation' )
+    argp.add_argument( '--sets', default = 10000, type = int
+            , help = 'Number of parameter sets'
+            )
+    main( argp.parse_args( ) )
@@ -0,0 +1,80 @@
+"""bench_flatten.py: 
+
+Time resolving declarations of recipe and reaction instances on models with
+many recipes. The xpath lookups used before utils.xml.DeclarationIndex are
+kept here as reference; they scan the document once per instance.
+
+Run from top-level directory:
+
+    python -m benchmarks.bench_flatten --max 10000
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import time
+import argparse
+
+import utils.xml as xml
+import yparser.yparser as yp
+import yparser.ast_processor as astp
+from benchmarks.generator import declaration_model
+
+def legacy_lookups( ast, flat ):
+    for inst in ast.iter( 'recipe_instance' ):
+        ast.xpath( '/yacml/recipe[@id="%s"]' % inst.attrib[ 'instance_of' ] )
+    for net in flat.iter( 'chemical_reaction_subnetwork' ):
+        for r in net.iter( 'reaction' ):
+            net.xpath( 'reaction_declaration[@id="%s"]' % r.attrib[ 'instance_of' ] )
+
+def indexed_lookups( ast, flat ):
+    index = xml.DeclarationIndex( ast )
+    for inst in ast.iter( 'recipe_instance' ):
+        index.find( 'recipe', inst.attrib[ 'instance_of' ] )
+    for net in flat.iter( 'chemical_reaction_subnetwork' ):
+        netIndex = xml.DeclarationIndex( net )
+        for r in net.iter( 'reaction' ):
+            netIndex.find( 'reaction_declaration', r.attrib[ 'instance_of' ], net )
+
+def time_it( func, *args ):
+    t0 = time.time( )
+    func( *args )
+    return time.time( ) - t0
+
+def main( args ):
+    sizes, n = [ ], 100
+    while n <= args.max:
+        sizes.append( n )
+        n *= 10
+    print( '%10s %12s %12s %12s %14s' % ( 
+        'recipes', 'legacy (s)', 'indexed (s)', 'flatten (s)', 'flatten/recipe (us)' ) 
+        )
+    for n in sizes:
+        ast = yp.parse_text( declaration_model( n, args.reactions ), backend = 'fast' )
+        flat = time_it( astp.flatten, ast )
+        flatAST = astp.flatten( ast )
+        legacy = '%12s' % '-'
+        if n <= args.legacy_max:
+            legacy = '%12.3f' % time_it( legacy_lookups, ast, flatAST )
+        indexed = time_it( indexed_lookups, ast, flatAST )
+        print( '%10d %s %12.3f %12.3f %14.1f' % ( n, legacy, indexed, flat, 1e6 * flat / n ) )
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser( description = 'Benchmark declaration lookups' )
+    argp.add_argument( '--max', default = 10000, type = int
+            , help = 'Largest number of recipes'
+            )
+    argp.add_argument( '--reactions', default = 10, type = int
+            , help = 'Reactions per recipe'
+            )
+    argp.add_argument( '--legacy_max', default = 10000, type = int
+            , help = 'Largest model on which legacy lookups are run'
+            )
+    main( argp.parse_args( ) )
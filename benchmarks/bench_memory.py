@@ -0,0 +1,90 @@
+"""bench_memory.py: 
+
+Peak memory and time of flattening and propagating a model in which one recipe
+is instantiated many times. 'copy' materializes every instance right after
+flattening, which gives the same tree as copying the recipe into each
+instance (as flatten did before utils.xml.materialize); 'template' keeps the
+instances copy-on-write. 'sweep' is 'template' followed by what a worker of
+sweep_runner does for a point: sweep.assign sets one parameter of one
+instance, which materializes only that element.
+
+Each variant runs in its own process so that peak RSS is not shared.
+
+Run from top-level directory:
+
+    python -m benchmarks.bench_memory --instances 2000
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import time
+import resource
+import argparse
+import multiprocessing
+
+import utils.xml as xml
+import yparser.yparser as yp
+import yparser.ast_processor as astp
+import yparser.propagation as propagation
+from benchmarks.generator import instance_model
+
+variants_ = [ 'copy', 'template', 'sweep' ]
+
+def max_rss( ):
+    # ru_maxrss is in kB on linux.
+    return resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss / 1024.0
+
+def run( variant, text, conn ):
+    ast = yp.parse_text( text, backend = 'fast' )
+    rss0 = max_rss( )
+    t0 = time.time( )
+    flat = astp.flatten( ast )
+    if variant == 'copy':
+        xml.materialize_all( flat )
+    propagation.propagate( flat )
+    if variant == 'sweep':
+        import sweep
+        net = next( flat.iter( 'chemical_reaction_subnetwork' ) )
+        elem = next( xml.template_of( net ).iter( 'parameter' ) )
+        names = [ ]
+        while elem.tag != 'recipe':
+            names.append( elem.attrib.get( 'name', elem.attrib.get( 'id', elem.tag ) ) )
+            elem = elem.getparent( )
+        field = '/'.join( [ net.getparent( ).attrib[ 'name' ], net.attrib[ 'name' ] ]
+                + list( reversed( names ) ) )
+        sweep.assign( flat, { field : 1.0 } )
+    conn.send( ( time.time( ) - t0, max_rss( ) - rss0 ) )
+    conn.close( )
+
+def measure( variant, text ):
+    recv, send = multiprocessing.Pipe( False )
+    p = multiprocessing.Process( target = run, args = ( variant, text, send ) )
+    p.start( )
+    res = recv.recv( )
+    p.join( )
+    return res
+
+def main( args ):
+    text = instance_model( args.instances, args.statements )
+    print( '%10s %10s %10s %12s' % ( 'instances', 'variant', 'time (s)', 'peak (MB)' ) )
+    for v in variants_:
+        t, mem = measure( v, text )
+        print( '%10d %10s %10.3f %12.1f' % ( args.instances, v, t, mem ) )
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser( description = 'Benchmark memory of recipe instances' )
+    argp.add_argument( '--instances', default = 2000, type = int
+            , help = 'Number of instances of recipe'
+            )
+    argp.add_argument( '--statements', default = 300, type = int
+            , help = 'Statements in recipe'
+            )
+    main( argp.parse_args( ) )
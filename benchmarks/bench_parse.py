@@ -0,0 +1,70 @@
+"""bench_parse.py: 
+
+Parse time of generated models with and without packrat memoization, and
+with the hand-written (fast) parser backend.
+
+Run from top-level directory:
+
+    python -m benchmarks.bench_parse --max 10000
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import os
+import time
+import tempfile
+import argparse
+
+import yparser.yparser as yp
+from benchmarks.generator import generate_model
+
+def time_parse( filename, memoize, cache_size, backend = 'pyparsing' ):
+    if memoize:
+        yp.enable_memoization( cache_size )
+    else:
+        yp.disable_memoization( )
+    t0 = time.time( )
+    yp.parse( filename, backend )
+    return time.time( ) - t0
+
+def main( args ):
+    sizes, n = [ ], 100
+    while n <= args.max:
+        sizes.append( n )
+        n *= 10
+
+    print( '%10s %12s %12s %8s %12s' % ( 
+        'statements', 'plain (s)', 'packrat (s)', 'ratio', 'fast (s)' ) 
+        )
+    for n in sizes:
+        fd, filename = tempfile.mkstemp( suffix = '.yacml' )
+        with os.fdopen( fd, 'w' ) as f:
+            f.write( generate_model( n ) )
+        try:
+            plain = time_parse( filename, False, args.cache_size )
+            memo = time_parse( filename, True, args.cache_size )
+            fast = time_parse( filename, False, args.cache_size, 'fast' )
+        finally:
+            os.remove( filename )
+        print( '%10d %12.3f %12.3f %8.2f %12.3f' % ( 
+            n, plain, memo, plain / memo, fast ) 
+            )
+    yp.disable_memoization( )
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser( description = 'Benchmark YACML parser' )
+    argp.add_argument( '--max', default = 100000, type = int
+            , help = 'Largest model size (number of statements)'
+            )
+    argp.add_argument( '--cache_size', default = yp.packrat_cache_size_
+            , type = int, help = 'Size of packrat cache'
+            )
+    main( argp.parse_args( ) )
@@ -0,0 +1,102 @@
+"""bench_propagation.py: 
+
+Time constant propagation on models with many parameterised species. The
+previous implementation (bottom-up pass with xpath lookups of ancestors and
+repeated str.replace) is kept here as reference.
+
+Run from top-level directory:
+
+    python -m benchmarks.bench_propagation --max 10000
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import time
+import argparse
+from collections import deque
+
+import utils.helper as helper
+import yparser.yparser as yp
+import yparser.ast_processor as astp
+import yparser.propagation as propagation
+from benchmarks.generator import parameterised_model
+
+def legacy_replace( elem, local_vars, global_vars ):
+    t = elem.text
+    for i in helper.get_ids( elem.text ):
+        for varDict in local_vars + global_vars:
+            if i in varDict:
+                elem.text = elem.text.replace( i, varDict[i] )
+                elem.text, elem.attrib['is_reduced'] = helper.reduce_expr( elem.text )
+                break
+    if t != elem.text:
+        legacy_replace( elem, local_vars, global_vars )
+
+def legacy_local_variables( elem ):
+    reduced, unreduced = {}, {}
+    for v in  elem.xpath( 'variable[@is_reduced="true"]' ):
+        reduced[v.attrib['name'] ] = v.text
+    for v in  elem.xpath( 'variable[@is_reduced="false"]' ):
+        unreduced[v.attrib['name'] ] = v.text
+    return (unreduced, reduced) 
+
+def legacy_propagate( tree ):
+    listOfElems, queue = [ ], deque( [ tree ] )
+    while queue:
+        el = queue.popleft( ) 
+        listOfElems.append( el )
+        queue.extend( el )
+    while listOfElems:
+        elem = listOfElems.pop( )
+        if elem.attrib.get('is_reduced', 'false') == 'true':
+            continue
+        if elem.tag not in [ 'variable', 'parameter' ]:
+            continue
+        reduced, unreduced, e = {}, {}, elem
+        while e.getparent( ) is not None:
+            e = e.getparent( )
+            ur, r = legacy_local_variables( e )
+            reduced.update( r )
+            unreduced.update( ur )
+        legacy_replace( elem, legacy_local_variables( elem )
+                , ( unreduced, reduced ) 
+                )
+
+def flattened( num_species ):
+    return astp.flatten( yp.parse_text( parameterised_model( num_species ), backend = 'fast' ) )
+
+def time_it( func, xml ):
+    t0 = time.time( )
+    func( xml )
+    return time.time( ) - t0
+
+def main( args ):
+    sizes, n = [ ], 100
+    while n <= args.max:
+        sizes.append( n )
+        n *= 10
+    print( '%10s %12s %12s %14s' % ( 'species', 'legacy (s)', 'new (s)', 'new/species (us)' ) )
+    for n in sizes:
+        legacy = '%12s' % '-'
+        if n <= args.legacy_max:
+            legacy = '%12.3f' % time_it( legacy_propagate, flattened( n ) )
+        new = time_it( propagation.propagate, flattened( n ) )
+        print( '%10d %s %12.3f %14.1f' % ( n, legacy, new, 1e6 * new / n ) )
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser( description = 'Benchmark constant propagation' )
+    argp.add_argument( '--max', default = 10000, type = int
+            , help = 'Largest number of species'
+            )
+    argp.add_argument( '--legacy_max', default = 10000, type = int
+            , help = 'Largest model on which legacy implementation is run'
+            )
+    main( argp.parse_args( ) )
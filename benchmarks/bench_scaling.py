@@ -0,0 +1,232 @@
+"""bench_scaling.py: 
+
+Time every stage of yacml.loadModel (see profiling.py) on generated models of
+growing size, and keep results in JSON history: one file per commit in
+benchmarks/history. Each load runs in a process of its own; the fastest of
+--repeat runs is recorded for every stage.
+
+Sizes are numbers of recipes; other dimensions of model are options, see
+generator.scaling_model.
+
+Run from top-level directory:
+
+    python -m benchmarks.bench_scaling run --sizes 1,4,16,64 --solver scipy
+    python -m benchmarks.bench_scaling run --simulator memory
+    python -m benchmarks.bench_scaling compare <old commit> <new commit>
+
+compare exits with status 1 when a stage of some size got slower than
+--threshold (relative) and --min-seconds (absolute).
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+import multiprocessing
+from collections import OrderedDict
+
+from benchmarks.generator import scaling_model
+
+history_dir_ = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), 'history' )
+
+# Under python -m the sources are on sys.path as '', which is wrong once a load
+# leaves for its working directory; modules which yacml imports lazily (parser
+# grammar, backends) are then not found.
+top_ = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+if top_ not in sys.path:
+    sys.path.insert( 0, top_ )
+
+def git_commit( ):
+    """Commit of working tree and whether it has uncommitted changes.
+    """
+    try:
+        sha = subprocess.check_output( [ 'git', 'rev-parse', 'HEAD' ], cwd = top_ ).strip( )
+        dirty = subprocess.call( [ 'git', 'diff', '--quiet', 'HEAD' ], cwd = top_ ) != 0
+    except ( OSError, subprocess.CalledProcessError ):
+        return 'unknown', False
+    return sha.decode( ) if isinstance( sha, bytes ) else sha, dirty
+
+def load_once( text, solver, sim, conn ):
+    """Load model text in this process and send the performance report.
+    """
+    import yacml
+    import simulator
+    # Import simulator before leaving directory of sources: a simulator given
+    # as a module on PYTHONPATH relative to it is not found afterwards.
+    if solver == 'moose':
+        simulator.get( sim )
+    workdir = tempfile.mkdtemp( prefix = 'yacml_bench_' )
+    try:
+        # Output files of loader (xml, dot etc.) go to workdir.
+        os.chdir( workdir )
+        filename = os.path.join( workdir, 'bench.yacml' )
+        with open( filename, 'w' ) as f:
+            f.write( text )
+        report = os.path.join( workdir, 'bench.perf.json' )
+        yacml.loadModel( filename, solver = solver, simulator = sim, profile = report
+                , save_output = False )
+        with open( report ) as f:
+            conn.send( json.load( f ) )
+    except Exception as e:
+        conn.send( { 'error' : repr( e ) } )
+    finally:
+        shutil.rmtree( workdir, ignore_errors = True )
+        conn.close( )
+
+def measure( text, solver, sim ):
+    recv, send = multiprocessing.Pipe( False )
+    p = multiprocessing.Process( target = load_once, args = ( text, solver, sim, send ) )
+    p.start( )
+    rep = recv.recv( )
+    p.join( )
+    if 'error' in rep:
+        raise RuntimeError( 'Benchmark load failed: %s' % rep[ 'error' ] )
+    return rep
+
+def run_size( size, args ):
+    text = scaling_model( size, args.species, args.reactions, args.instances
+            , args.depth, args.stochastic, args.solver, args.seed )
+    stages, total, rep = { }, None, None
+    for i in range( args.repeat ):
+        rep = measure( text, args.solver, args.simulator )
+        for name, st in rep[ 'stages' ].items( ):
+            stages[ name ] = min( stages.get( name, float( 'inf' ) ), st[ 'seconds' ] )
+        total = min( total or float( 'inf' ), rep[ 'total_seconds' ] )
+    return OrderedDict( [ ( 'size', size )
+        , ( 'species', rep[ 'info' ].get( 'species' ) )
+        , ( 'reactions', rep[ 'info' ].get( 'reactions' ) )
+        , ( 'total_seconds', total )
+        , ( 'stages', stages )
+        , ( 'counters', rep[ 'counters' ] )
+        ] )
+
+def history_file( commit ):
+    return os.path.join( history_dir_, '%s.json' % commit )
+
+def find_history( name ):
+    """History of commit name (a prefix is enough) or a JSON file.
+    """
+    if os.path.isfile( name ):
+        return name
+    found = [ f for f in os.listdir( history_dir_ ) if f.startswith( name ) ] \
+            if os.path.isdir( history_dir_ ) else [ ]
+    if len( found ) != 1:
+        raise ValueError( 'No unique benchmark history for %s in %s' % ( name, history_dir_ ) )
+    return os.path.join( history_dir_, found[ 0 ] )
+
+def run( args ):
+    commit, dirty = git_commit( )
+    params = OrderedDict( [ ( k, getattr( args, k ) ) for k in [ 'solver', 'simulator', 'species'
+        , 'reactions', 'instances', 'depth', 'stochastic', 'seed' ] ] )
+    results = [ ]
+    print( '%8s %8s %10s %10s  %s' % ( 'recipes', 'species', 'reactions', 'total (s)', 'stages (s)' ) )
+    for size in [ int( x ) for x in args.sizes.split( ',' ) ]:
+        res = run_size( size, args )
+        results.append( res )
+        print( '%8d %8s %10s %10.3f  %s' % ( size, res[ 'species' ], res[ 'reactions' ]
+            , res[ 'total_seconds' ], ', '.join( [ '%s %.3f' % x for x in
+                sorted( res[ 'stages' ].items( ), key = lambda x : -x[ 1 ] ) ] ) )
+            )
+    record = OrderedDict( [ ( 'commit', commit ), ( 'dirty', dirty )
+        , ( 'date', time.strftime( '%Y-%m-%d %H:%M:%S' ) )
+        , ( 'python', sys.version.split( )[ 0 ] )
+        , ( 'params', params ), ( 'results', results ) ] )
+    outfile = args.output or history_file( commit )
+    if not os.path.isdir( os.path.dirname( os.path.abspath( outfile ) ) ):
+        os.makedirs( os.path.dirname( os.path.abspath( outfile ) ) )
+    with open( outfile, 'w' ) as f:
+        json.dump( record, f, indent = 1 )
+    print( 'Wrote %s' % outfile )
+
+def regressions( old, new, threshold, min_seconds ):
+    """(size, stage, old seconds, new seconds) of stages of new which are
+    slower than in old.
+    """
+    found = [ ]
+    oldResults = dict( [ ( r[ 'size' ], r ) for r in old[ 'results' ] ] )
+    for res in new[ 'results' ]:
+        prev = oldResults.get( res[ 'size' ] )
+        if prev is None:
+            continue
+        times = dict( res[ 'stages' ], total = res[ 'total_seconds' ] )
+        prevTimes = dict( prev[ 'stages' ], total = prev[ 'total_seconds' ] )
+        for name in sorted( times ):
+            if name not in prevTimes:
+                continue
+            t0, t1 = prevTimes[ name ], times[ name ]
+            if t1 > t0 * ( 1 + threshold ) and t1 - t0 > min_seconds:
+                found.append( ( res[ 'size' ], name, t0, t1 ) )
+    return found
+
+def compare( args ):
+    with open( find_history( args.old ) ) as f:
+        old = json.load( f )
+    with open( find_history( args.new ) ) as f:
+        new = json.load( f )
+    if old[ 'params' ] != new[ 'params' ]:
+        print( 'Warning: benchmarks were run with different parameters\n  %s\n  %s' % (
+            old[ 'params' ], new[ 'params' ] ) )
+    found = regressions( old, new, args.threshold, args.min_seconds )
+    print( 'Comparing %s with %s' % ( old[ 'commit' ][ :12 ], new[ 'commit' ][ :12 ] ) )
+    for size, name, t0, t1 in found:
+        print( 'REGRESSION %8d recipes %-14s %10.3f s -> %10.3f s (%+.0f%%)' % (
+            size, name, t0, t1, 100.0 * ( t1 / t0 - 1 ) ) )
+    if not found:
+        print( 'No regressions' )
+    return 1 if found else 0
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser( description = 'Scaling benchmark of loadModel' )
+    sub = argp.add_subparsers( dest = 'command' )
+    runp = sub.add_parser( 'run', help = 'Run benchmark and save it in history' )
+    runp.add_argument( '--sizes', default = '1,4,16,64'
+            , help = 'Comma separated numbers of recipes'
+            )
+    runp.add_argument( '--species', default = 10, type = int, help = 'Species per recipe' )
+    runp.add_argument( '--reactions', default = 15, type = int, help = 'Reactions per recipe' )
+    runp.add_argument( '--instances', default = 2, type = int
+            , help = 'Instances of compartment'
+            )
+    runp.add_argument( '--depth', default = 2, type = int, help = 'Depth of expressions' )
+    runp.add_argument( '--stochastic', default = 0.5, type = float
+            , help = 'Fraction of stochastic compartments'
+            )
+    runp.add_argument( '--solver', default = 'moose', help = 'moose | scipy | ssa' )
+    runp.add_argument( '--simulator', default = None
+            , help = 'Simulator of moose solver: moose | memory (see simulator.py)'
+            )
+    runp.add_argument( '--seed', default = 0, type = int, help = 'Seed of generator' )
+    runp.add_argument( '--repeat', default = 3, type = int
+            , help = 'Runs of each size; fastest is recorded'
+            )
+    runp.add_argument( '--output', '-o', default = None
+            , help = 'History file (default: benchmarks/history/<commit>.json)'
+            )
+    cmpp = sub.add_parser( 'compare', help = 'Flag regressions between two commits' )
+    cmpp.add_argument( 'old', help = 'Commit (or history file) of baseline' )
+    cmpp.add_argument( 'new', help = 'Commit (or history file) to check' )
+    cmpp.add_argument( '--threshold', default = 0.2, type = float
+            , help = 'Relative slowdown which is a regression'
+            )
+    cmpp.add_argument( '--min-seconds', default = 0.01, type = float
+            , help = 'Slowdowns smaller than this are noise'
+            )
+    args = argp.parse_args( )
+    if args.command == 'run':
+        run( args )
+    else:
+        sys.exit( compare( args ) )
@@ -0,0 +1,74 @@
+"""bench_startup.py: 
+
+Wall time of starting a fresh python process which imports yacml, and of
+'yacml.py check' on a model, against a bare interpreter. Also lists the heavy
+modules which 'import yacml' pulls in; there should be none.
+
+Run from top-level directory:
+
+    python -m benchmarks.bench_startup --runs 20
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+top_ = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+
+# Modules which a check does not need.
+heavy_ = [ 'moose', 'numpy', 'scipy', 'networkx', 'pylab', 'matplotlib'
+        , 'yparser.pyparsing', 'yparser.grammar' ]
+
+def time_command( cmd, runs ):
+    """Median and minimum wall time of runs of cmd.
+    """
+    times = [ ]
+    with open( os.devnull, 'w' ) as null:
+        for i in range( runs ):
+            t0 = time.time( )
+            subprocess.check_call( cmd, cwd = top_, stdout = null, stderr = null )
+            times.append( time.time( ) - t0 )
+    times.sort( )
+    return times[ len( times ) // 2 ], times[ 0 ]
+
+def heavy_imports( ):
+    code = 'import sys, yacml; print( " ".join( [ m for m in %r if m in sys.modules ] ) )' % heavy_
+    out = subprocess.check_output( [ sys.executable, '-c', code ], cwd = top_
+            , stderr = open( os.devnull, 'w' ) )
+    return out.decode( ).split( )
+
+def main( args ):
+    model = os.path.join( 'test', 'small_reaction.yacml' )
+    commands = [ ( 'python', [ sys.executable, '-c', 'pass' ] )
+            , ( 'import yacml', [ sys.executable, '-c', 'import yacml' ] )
+            , ( 'yacml check', [ sys.executable, 'yacml.py', 'check', model ] )
+            , ( 'check --stage propagate', [ sys.executable, 'yacml.py', 'check'
+                , '--stage', 'propagate', model ] )
+            ]
+    print( '%24s %12s %12s' % ( 'command', 'median (ms)', 'min (ms)' ) )
+    for name, cmd in commands:
+        median, best = time_command( cmd, args.runs )
+        print( '%24s %12.1f %12.1f' % ( name, 1e3 * median, 1e3 * best ) )
+    heavy = heavy_imports( )
+    print( 'Heavy modules imported by yacml: %s' % ( ', '.join( heavy ) or 'none' ) )
+    if heavy:
+        sys.exit( 1 )
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser( description = 'Benchmark startup of yacml' )
+    argp.add_argument( '--runs', default = 10, type = int
+            , help = 'Runs of each command'
+            )
+    main( argp.parse_args( ) )
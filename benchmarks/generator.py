@@ -0,0 +1,196 @@
+"""generator.py: 
+
+Generate synthetic YACML models for benchmarks.
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+def recipe_text( name, num_statements ):
+    """A recipe with num_statements statements. Statements cycle through
+    species declaration, reaction declaration and reaction instantiation.
+    """
+    lines = [ 'recipe %s has' % name ]
+    nSpecies = 0
+    for i in range( num_statements ):
+        kind = i % 3
+        if kind == 0 or nSpecies < 2:
+            lines.append( '    species s%d [ conc = 1e-3, record = N ];' % nSpecies )
+            nSpecies += 1
+        elif kind == 1:
+            lines.append( '    reaction r%d [ kf = 1.5, kb = 1e-2 ];' % i )
+        else:
+            lines.append( '    s%d + s%d <- r%d -> 2s%d;' % ( 
+                nSpecies - 1, nSpecies - 2, i - 1, nSpecies - 1 ) 
+                )
+    lines.append( 'end' )
+    return '\n'.join( lines )
+
+def generate_model( num_statements, statements_per_recipe = 1000 ):
+    """Return text of a valid YACML model with (roughly) num_statements
+    statements, spread over recipes of statements_per_recipe each.
+    """
+    recipes, compts, insts = [ ], [ ], [ ]
+    i = 0
+    while num_statements > 0:
+        n = min( num_statements, statements_per_recipe )
+        recipes.append( recipe_text( 'R%d' % i, n ) )
+        compts.append( '\n'.join( [ 
+            'compartment C%d is' % i
+            , '    cylinder [ length = 1e-6, radius = 1e-7 ]'
+            , 'has'
+            , '    R%d net%d;' % ( i, i )
+            , 'end' ] ) 
+            )
+        insts.append( '    c%d is C%d;' % ( i, i ) )
+        num_statements -= n
+        i += 1
+
+    model = [ 'pathway BENCH has' ] + insts 
+    model += [ '    simulator moose [ sim_time = 1 ];', 'end' ]
+    return '\n\n'.join( recipes + compts + [ '\n'.join( model ) ] )
+
+def parameterised_model( num_species ):
+    """A model with num_species species whose concentrations are expressions
+    of recipe and species level variables.
+    """
+    lines = [ 'recipe PARAM has'
+            , '    const base = 1e-3;'
+            , '    variable scale = "base*2";'
+            ]
+    for i in range( num_species ):
+        lines.append( '    species s%d [ f = "scale*%d", conc = "f/2", record = N ];' % ( i, i + 1 ) )
+        if i > 0:
+            lines.append( '    s%d <- [ kf = "f_kf*%d", kb = "scale" ] -> s%d;' % ( i - 1, i, i ) )
+    lines.append( '    f_kf = 0.5;' )
+    lines.append( 'end' )
+    lines += [ 'compartment C is'
+            , '    cylinder [ length = 1e-6, radius = 1e-7 ]'
+            , 'has'
+            , '    PARAM net;'
+            , 'end'
+            , 'pathway BENCH has'
+            , '    c is C;'
+            , '    simulator moose [ sim_time = 1 ];'
+            , 'end' 
+            ]
+    return '\n'.join( lines )
+
+def declaration_model( num_recipes, reactions_per_recipe = 10 ):
+    """A model with num_recipes recipes, each instantiated once in a single
+    compartment. Every recipe declares reactions_per_recipe reactions and
+    instantiates each of them.
+    """
+    lines = [ ]
+    for r in range( num_recipes ):
+        lines.append( 'recipe R%d has' % r )
+        lines.append( '    species a [ conc = 1e-3 ];' )
+        lines.append( '    species b [ conc = 0 ];' )
+        for i in range( reactions_per_recipe ):
+            lines.append( '    reaction r%d [ kf = 1, kb = 0.1 ];' % i )
+            lines.append( '    a <- r%d -> b;' % i )
+        lines.append( 'end' )
+    lines += [ 'compartment C is', '    cube [ length = 1e-6, width = 1e-6, height = 1e-6 ]', 'has' ]
+    lines += [ '    R%d net%d;' % ( r, r ) for r in range( num_recipes ) ]
+    lines += [ 'end'
+            , 'pathway BENCH has'
+            , '    c is C;'
+            , '    simulator moose [ sim_time = 1 ];'
+            , 'end' 
+            ]
+    return '\n'.join( lines )
+
+def instance_model( num_instances, num_statements = 300 ):
+    """A model with one recipe of num_statements statements which is
+    instantiated num_instances times, spread over compartments of 100
+    instances each.
+    """
+    parts = [ recipe_text( 'R', num_statements ) ]
+    insts, i = [ ], 0
+    while num_instances > 0:
+        n = min( num_instances, 100 )
+        lines = [ 'compartment C%d is' % i
+                , '    cylinder [ length = 1e-6, radius = 1e-7 ]'
+                , 'has' ]
+        lines += [ '    R net%d;' % j for j in range( n ) ]
+        lines.append( 'end' )
+        parts.append( '\n'.join( lines ) )
+        insts.append( '    c%d is C%d;' % ( i, i ) )
+        num_instances -= n
+        i += 1
+    model = [ 'pathway BENCH has' ] + insts
+    model += [ '    simulator moose [ sim_time = 1 ];', 'end' ]
+    return '\n\n'.join( parts + [ '\n'.join( model ) ] )
+
+def nested_expression( name, depth ):
+    """An expression of variable name nested depth times. Its value stays
+    close to the value of name.
+    """
+    expr = name
+    for i in range( depth ):
+        expr = '(%s*1.5+%s)/2.5' % ( expr, name )
+    return expr
+
+def scaling_model( num_recipes, species_per_recipe = 10, reactions_per_recipe = 10
+        , num_instances = 1, expression_depth = 0, stochastic = 0.0
+        , simulator = 'moose', seed = 0 ):
+    """A valid model for scaling benchmarks. Every recipe has
+    species_per_recipe species and reactions_per_recipe reactions (at most
+    as many as there are distinct pairs of species) between randomly chosen
+    species; a third of them are bimolecular. One compartment has all the
+    recipes and is instantiated num_instances times; a fraction stochastic of
+    the instances is stochastic, the rest deterministic. With expression_depth
+    > 0 concentrations and rate constants are nested expressions of recipe
+    variables.
+    """
+    import random
+    rng = random.Random( seed )
+    lines = [ ]
+    n = species_per_recipe
+    for r in range( num_recipes ):
+        lines.append( 'recipe R%d has' % r )
+        if expression_depth > 0:
+            lines.append( '    const base = 1e-3;' )
+            lines.append( '    variable rate = "base*1e3";' )
+        for i in range( n ):
+            conc = '"%s"' % nested_expression( 'base', expression_depth ) \
+                    if expression_depth > 0 else '1e-3'
+            lines.append( '    species s%d [ conc = %s, record = N ];' % ( i, conc ) )
+        # Reactions are named by their species; no two may have the same.
+        names = set( )
+        for j in range( min( reactions_per_recipe, n * ( n - 1 ) ) ):
+            while True:
+                subs = rng.sample( range( n ), 2 if j % 3 == 2 and n > 2 else 1 )
+                prd = rng.choice( [ x for x in range( n ) if x not in subs ] )
+                key = ( tuple( sorted( subs ) ), prd )
+                if key not in names:
+                    names.add( key )
+                    break
+            if expression_depth > 0:
+                kf = '"%s"' % nested_expression( 'rate', expression_depth )
+                kb = '"rate/10"'
+            else:
+                kf, kb = '1.0', '0.1'
+            lines.append( '    reaction r%d [ kf = %s, kb = %s ];' % ( j, kf, kb ) )
+            lines.append( '    %s <- r%d -> s%d;' % ( 
+                ' + '.join( [ 's%d' % x for x in sorted( subs ) ] ), j, prd ) 
+                )
+        lines.append( 'end' )
+    lines += [ 'compartment C is'
+            , '    cylinder [ length = 1e-6, radius = 1e-7 ]'
+            , 'has' ]
+    lines += [ '    R%d net%d;' % ( r, r ) for r in range( num_recipes ) ]
+    lines += [ 'end', 'pathway BENCH has' ]
+    numStochastic = int( round( stochastic * num_instances ) )
+    for i in range( num_instances ):
+        kind = 'stochastic' if i < numStochastic else 'deterministic'
+        lines.append( '    %s c%d is C;' % ( kind, i ) )
+    lines += [ '    simulator %s [ sim_time = 1 ];' % simulator, 'end' ]
+    return '\n'.join( lines )
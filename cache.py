@@ -0,0 +1,184 @@
+"""cache.py: 
+
+Content addressed on-disk cache of compiled YACML models.
+
+Parsing, flattening and constant propagation are pure functions of the source
+text. The output of each stage is stored as XML under a key computed from the
+source, the version of YACML and the code of these stages (code_version), so
+that entries written by another version of the parser are not used. A model
+which is loaded again skips these stages.
+
+Entries are evicted in least recently used order once the cache grows beyond
+its size limit.
+
+Usage:
+
+    python cache.py info
+    python cache.py list
+    python cache.py purge
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import os
+import glob
+import time
+import hashlib
+import tempfile
+
+import config
+import lxml.etree as etree
+
+logger_ = config.logger_
+
+# Bump it whenever the XML produced by any stage changes. Changes of the code
+# of stages also change the key, see code_version.
+cache_format_ = 2
+
+stages_ = [ 'parse', 'flatten', 'propagate' ]
+
+# Sources (relative to this directory) of the code of stages.
+stage_sources_ = [ 'yparser/*.py', 'utils/xml.py', 'utils/helper.py' ]
+
+# Computed once by code_version( ).
+code_version_ = None
+
+def code_version( ):
+    """SHA1 of the sources of stages.
+    """
+    global code_version_
+    if code_version_ is None:
+        top = os.path.dirname( os.path.abspath( __file__ ) )
+        h = hashlib.sha1( )
+        for pattern in stage_sources_:
+            for filename in sorted( glob.glob( os.path.join( top, pattern ) ) ):
+                with open( filename, 'rb' ) as f:
+                    h.update( f.read( ) )
+        code_version_ = h.hexdigest( )
+    return code_version_
+
+class CompileCache( object ):
+    """A directory of XML files, one file per (source key, stage).
+    """
+
+    def __init__( self, cache_dir = None, size_limit = None ):
+        self.cache_dir = cache_dir or config.cache_dir_
+        if size_limit is None:
+            size_limit = config.cache_size_limit_
+        self.size_limit = size_limit
+        if not os.path.isdir( self.cache_dir ):
+            os.makedirs( self.cache_dir )
+
+    def key( self, text ):
+        """Key of a YACML source text.
+        """
+        h = hashlib.sha1( )
+        h.update( ( '%s:%s:%s:' % ( config.yacml_version_, cache_format_
+            , code_version( ) ) ).encode( ) )
+        if not isinstance( text, bytes ):
+            text = text.encode( 'utf-8' )
+        h.update( text )
+        return h.hexdigest( )
+
+    def path( self, key, stage ):
+        assert stage in stages_, 'Unknown stage %s' % stage
+        return os.path.join( self.cache_dir, '%s.%s.xml' % ( key, stage ) )
+
+    def get( self, key, stage ):
+        """Return cached AST of stage or None.
+        """
+        path = self.path( key, stage )
+        try:
+            xml = etree.parse( path ).getroot( )
+        except (IOError, OSError, etree.XMLSyntaxError):
+            return None
+        # Mark the entry as recently used.
+        os.utime( path, None )
+        logger_.info( 'Using cached %s stage from %s' % ( stage, path ) )
+        return xml
+
+    def put( self, key, stage, xml ):
+        """Store AST of stage. The file is written to a temporary file first
+        and renamed so that concurrent readers never see a partial entry.
+        """
+        path = self.path( key, stage )
+        fd, tmp = tempfile.mkstemp( dir = self.cache_dir, suffix = '.tmp' )
+        with os.fdopen( fd, 'wb' ) as f:
+            f.write( etree.tostring( xml ) )
+        os.rename( tmp, path )
+        logger_.debug( 'Cached %s stage to %s' % ( stage, path ) )
+        self.evict( )
+
+    def entries( self ):
+        """List of (path, size, last used) of all entries, oldest first.
+        """
+        entries = [ ]
+        for name in os.listdir( self.cache_dir ):
+            if not name.endswith( '.xml' ):
+                continue
+            path = os.path.join( self.cache_dir, name )
+            try:
+                st = os.stat( path )
+            except OSError:
+                continue
+            entries.append( ( path, st.st_size, st.st_mtime ) )
+        return sorted( entries, key = lambda x: x[2] )
+
+    def size( self ):
+        return sum( [ x[1] for x in self.entries( ) ] )
+
+    def evict( self ):
+        """Remove least recently used entries till total size is within limit.
+        """
+        entries = self.entries( )
+        total = sum( [ x[1] for x in entries ] )
+        while entries and total > self.size_limit:
+            path, size, _ = entries.pop( 0 )
+            try:
+                os.remove( path )
+            except OSError:
+                pass
+            total -= size
+            logger_.debug( 'Evicted %s from cache' % path )
+
+    def purge( self ):
+        """Remove all entries. Return number of removed entries.
+        """
+        entries = self.entries( )
+        for path, _, _ in entries:
+            os.remove( path )
+        return len( entries )
+
+def main( args ):
+    cache = CompileCache( args.dir )
+    if args.command == 'info':
+        entries = cache.entries( )
+        print( 'Cache directory : %s' % cache.cache_dir )
+        print( 'Entries         : %d' % len( entries ) )
+        print( 'Size            : %d bytes' % sum( [ x[1] for x in entries ] ) )
+        print( 'Size limit      : %d bytes' % cache.size_limit )
+    elif args.command == 'list':
+        for path, size, used in cache.entries( ):
+            print( '%s %10d  %s' % (
+                time.strftime( '%Y-%m-%d %H:%M:%S', time.localtime( used ) )
+                , size, os.path.basename( path ) )
+                )
+    elif args.command == 'purge':
+        print( 'Removed %d entries' % cache.purge( ) )
+
+if __name__ == '__main__':
+    import argparse
+    argp = argparse.ArgumentParser( description = 'YACML compile cache' )
+    argp.add_argument( 'command', choices = [ 'info', 'list', 'purge' ] )
+    argp.add_argument( '--dir', '-d', default = None
+            , help = 'Cache directory (default %s)' % config.cache_dir_
+            )
+    main( argp.parse_args( ) )
@@ -1,8 +1,17 @@
 """compartment.py: 
 
-Compartment class representing geometry where DOT model is loaded.
+Compact intermediate representation (IR) of a propagated YACML model.
 
-NOTE: currently not being used.
+A Model has Compartments, a Compartment has chemical Networks (instances of
+recipes) and a Network has Species and Reactions. Values are floats;
+parameters which are expressions of species or time keep their expression
+text. Substrates and products of a reaction are integer arrays of indices into
+species of its network with their stoichiometric numbers.
+
+The IR is built once from the propagated AST by build_model and does not refer
+to the AST, so the AST can be freed afterwards. Species and reactions which an
+instance of recipe takes unchanged from its template (see utils.xml.materialize)
+are shared between instances.
 
 """
     
@@ -16,14 +25,239 @@ __email__            = "dilawars@ncbs.res.in"
 __status__           = "Development"
 
 
-class Compartment(object):
+import numpy as np
+
+import utils.xml
+from utils import helper
+
+class Parameter( object ):
+    """A named value. value is None when parameter is an expression (expr)
+    which can only be computed while simulating.
+    """
+    __slots__ = [ 'name', 'value', 'expr' ]
+
+    def __init__( self, name, value = None, expr = None ):
+        self.name = name
+        self.value = value
+        self.expr = expr
+
+    def __repr__( self ):
+        return 'Parameter(%s=%s)' % ( self.name, self.expr if self.value is None else self.value )
+
+class Species( object ):
+    """A chemical species. params are its N and conc parameters; record is the
+    field to record in a table, None if not recorded.
+    """
+    __slots__ = [ 'name', 'buffered', 'diffusion_constant', 'params', 'record' ]
+
+    def __init__( self, name, buffered = False, diffusion_constant = None
+            , params = None, record = None ):
+        self.name = name
+        self.buffered = buffered
+        self.diffusion_constant = diffusion_constant
+        self.params = params or [ ]
+        self.record = record
+
+    def __repr__( self ):
+        return 'Species(%s)' % self.name
+
+class Reaction( object ):
+    """A reaction of a network. Substrates and products are indices into
+    species of the network, each with its stoichiometric number.
+    """
+    __slots__ = [ 'name', 'substrates', 'substrate_stoich', 'products'
+            , 'product_stoich', 'params' ]
+
+    def __init__( self, name, substrates, substrate_stoich, products, product_stoich
+            , params = None ):
+        self.name = name
+        self.substrates = np.asarray( substrates, dtype = np.int32 )
+        self.substrate_stoich = np.asarray( substrate_stoich, dtype = np.int32 )
+        self.products = np.asarray( products, dtype = np.int32 )
+        self.product_stoich = np.asarray( product_stoich, dtype = np.int32 )
+        self.params = params or [ ]
+
+    def __repr__( self ):
+        return 'Reaction(%s)' % self.name
+
+class Network( object ):
+    """A chemical reaction subnetwork i.e. an instance of a recipe.
+    """
+    __slots__ = [ 'name', 'recipe', 'species', 'reactions', 'species_index' ]
+
+    def __init__( self, name, recipe = None ):
+        self.name = name
+        self.recipe = recipe
+        self.species = [ ]
+        self.reactions = [ ]
+        # Name of species : index in species.
+        self.species_index = { }
+
+    def add_species( self, species ):
+        self.species_index[ species.name ] = len( self.species )
+        self.species.append( species )
+
+    def __repr__( self ):
+        return 'Network(%s, %d species, %d reactions)' % ( 
+                self.name, len( self.species ), len( self.reactions ) )
+
+class Compartment( object ):
     """Compartment where reaction happens"""
+    __slots__ = [ 'id', 'name', 'type', 'shape', 'geometry', 'volume'
+            , 'diffusion_length', 'networks' ]
 
-    def __init__(self, id):
-        super(Compartment, self).__init__()
+    def __init__( self, id, name = None, type = 'deterministic', shape = 'cube' ):
         self.id = id 
-        self.name = None
-        self.geometry = None 
-        self.mooseObject = None
-        
-        
+        self.name = name
+        self.type = type
+        self.shape = shape
+        # Geometry parameters e.g. length, radius, volume : float.
+        self.geometry = { }
+        self.volume = None
+        self.diffusion_length = None
+        self.networks = [ ]
+
+    def __repr__( self ):
+        return 'Compartment(%s, %s)' % ( self.name, self.shape )
+
+class Model( object ):
+    """A model: its compartments, the simulator engine which runs it (e.g.
+    moose or scipy) and the attributes of simulator.
+    """
+    __slots__ = [ 'name', 'compartments', 'engine', 'simulator' ]
+
+    def __init__( self, name ):
+        self.name = name
+        self.compartments = [ ]
+        self.engine = None
+        self.simulator = None
+
+    def networks( self ):
+        """(compartment, network) of all networks in model.
+        """
+        return [ ( c, n ) for c in self.compartments for n in c.networks ]
+
+    def __repr__( self ):
+        return 'Model(%s, %d compartments)' % ( self.name, len( self.compartments ) )
+
+def build_parameter( param_xml, reduce = False ):
+    """Parameter of a parameter element. Reaction parameters are used as given
+    by constant propagation; conc and N of species are reduced once more
+    (reduce = True).
+    """
+    name, text = param_xml.attrib[ 'name' ], param_xml.text
+    if reduce:
+        text, isReduced = helper.reduce_expr( text )
+    else:
+        isReduced = param_xml.attrib.get( 'is_reduced', 'false' )
+    if isReduced == 'true':
+        return Parameter( name, helper.to_float( text ) )
+    return Parameter( name, expr = text )
+
+def build_species( species_xml ):
+    species = Species( species_xml.attrib[ 'name' ]
+            , species_xml.attrib.get( 'is_buffered', 'false' ) == 'true'
+            )
+    if 'diffusion_constant' in species_xml.attrib:
+        species.diffusion_constant = helper.to_float( species_xml.attrib[ 'diffusion_constant' ] )
+    for c in species_xml:
+        if c.tag == 'parameter' and c.attrib[ 'name' ].lower( ) in [ 'n', 'conc' ]:
+            species.params.append( build_parameter( c, reduce = True ) )
+        elif c.tag == 'variable' and c.attrib.get( 'name' ) == 'record' and species.record is None:
+            species.record = c.text
+    assert species.params, 'Need at least N or conc field in %s' % species.name
+    return species
+
+def build_reaction( reac_xml, net, net_xml, index = None ):
+    """Reaction of reac_xml in net. Parameters of an instance of a reaction
+    declaration come from the declaration.
+    """
+    subs, subN, prds, prdN, params = [ ], [ ], [ ], [ ], [ ]
+    for c in reac_xml:
+        if c.tag == 'substrate':
+            subs.append( net.species_index[ c.text ] )
+            subN.append( int( c.attrib[ 'stoichiometric_number' ] ) )
+        elif c.tag == 'product':
+            prds.append( net.species_index[ c.text ] )
+            prdN.append( int( c.attrib[ 'stoichiometric_number' ] ) )
+        elif c.tag == 'parameter':
+            params.append( c )
+    instOf = reac_xml.attrib.get( 'instance_of', None )
+    if instOf:
+        decl = utils.xml.find_reaction_instance( net_xml, instOf, index )
+        params = [ p for p in decl if p.tag == 'parameter' ]
+    assert len( params ) > 1, "Need at least kf/kb, numKf/numKb"
+    return Reaction( reac_xml.attrib[ 'name' ], subs, subN, prds, prdN
+            , [ build_parameter( p ) for p in params ]
+            )
+
+def build_network( net_xml, index = None, shared = None ):
+    """Network of a chemical_reaction_subnetwork element.
+
+    :param shared: Dictionary of template element : IR object, filled and used
+        to share species and reactions which instances take from template.
+    """
+    net = Network( net_xml.attrib[ 'name' ], net_xml.attrib.get( 'type' ) )
+    template = utils.xml.template_of( net_xml, index )
+    if shared is None:
+        shared = { }
+    for c in utils.xml.subnetwork_children( net_xml, index ):
+        # Elements owned by template are shared. Reaction parameters may come
+        # from a declaration materialized in net; those are not shared.
+        fromTemplate = template is not None and c.getparent( ) is template
+        if c.tag == 'species':
+            sp = shared.get( c ) if fromTemplate else None
+            if sp is None:
+                sp = build_species( c )
+                if fromTemplate:
+                    shared[ c ] = sp
+            net.add_species( sp )
+        elif c.tag == 'reaction':
+            decl = c.attrib.get( 'instance_of' )
+            if fromTemplate and decl is not None:
+                declXML = utils.xml.find_reaction_instance( net_xml, decl, index )
+                fromTemplate = declXML.getparent( ) is template
+            r = shared.get( c ) if fromTemplate else None
+            if r is None:
+                r = build_reaction( c, net, net_xml, index )
+                if fromTemplate:
+                    shared[ c ] = r
+            net.reactions.append( r )
+    return net
+
+def build_compartment( compt_xml ):
+    compt = Compartment( compt_xml.attrib.get( 'id' ), compt_xml.attrib[ 'name' ]
+            , compt_xml.attrib.get( 'type', 'deterministic' )
+            )
+    geometry = compt_xml.find( 'geometry' )
+    assert geometry is not None, "Need geometry information"
+    compt.shape = geometry.attrib[ 'shape' ]
+    for p in geometry:
+        if p.tag == 'parameter':
+            val = helper.literal_value( p.text )
+            if val is not None:
+                compt.geometry[ p.attrib[ 'name' ] ] = float( val )
+    compt.volume = compt.geometry.get( 'volume' )
+    if compt_xml.attrib.get( 'diffusion_length' ):
+        compt.diffusion_length = helper.to_float( compt_xml.attrib[ 'diffusion_length' ] )
+
+    index = utils.xml.DeclarationIndex( compt_xml )
+    shared = { }
+    for c in compt_xml:
+        if c.tag == 'chemical_reaction_subnetwork':
+            compt.networks.append( build_network( c, index, shared ) )
+    return compt
+
+def build_model( tree ):
+    """IR of a propagated YACML AST.
+    """
+    modelXML = tree.find( 'model' )
+    assert modelXML is not None, 'AST has no model'
+    model = Model( modelXML.attrib[ 'name' ] )
+    for c in modelXML:
+        if c.tag == 'compartment':
+            model.compartments.append( build_compartment( c ) )
+        elif c.tag == 'simulator' and model.simulator is None:
+            model.engine = ( c.text or 'moose' ).strip( )
+            model.simulator = dict( c.attrib )
+    return model
@@ -13,10 +13,32 @@ __maintainer__       = "Dilawar Singh"
 __email__            = "dilawars@ncbs.res.in"
 __status__           = "Development"
 
+import os
 import logging
 
 args_ = {}
 
+# Version of YACML language and toolchain. Used to key the compile cache.
+yacml_version_ = '0.1.0'
+
+# On-disk compile cache, see cache.py. The cache is used by yacml.loadModel
+# when cache = True is passed or YACML_CACHE_DIR is set in environment.
+cache_dir_ = os.environ.get( 'YACML_CACHE_DIR'
+        , os.path.join( os.path.expanduser( '~' ), '.cache', 'yacml' )
+        )
+cache_size_limit_ = 512 * 1024 * 1024
+
+# Write performance report of every yacml.loadModel to this file, see
+# profiling.py.
+profile_report_ = os.environ.get( 'YACML_PROFILE' )
+
+# Simulator of yacml2moose: moose or memory, see simulator.py.
+simulator_ = os.environ.get( 'YACML_SIMULATOR', 'moose' )
+
+# Abort yacml.loadModel when resident memory exceeds this many MB.
+memory_budget_ = float( os.environ[ 'YACML_MEMORY_BUDGET' ] ) \
+        if os.environ.get( 'YACML_MEMORY_BUDGET' ) else None
+
 log_levels_ = { 
         'debug' : logging.DEBUG
         , 'info' : logging.INFO
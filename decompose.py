@@ -0,0 +1,253 @@
+"""decompose.py: 
+
+Split a model into independent connected components of its species-reaction
+graph.
+
+Species and reactions are nodes of the graph. A reaction is joined to its
+substrates and products and to the species named in its rate expressions; a
+species is joined to the species named in its N or conc expression. Species of
+different components never affect each other, therefore each component can be
+integrated with its own step size: by its own solver (one MOOSE compartment
+with its own Stoich per component, see yacml2moose.load) or in its own process
+(run_components). Results of components are merged into the usual result file
+with the columns of the whole model.
+
+    import decompose
+    n, speciesLabels, reactionLabels = decompose.component_labels( model )
+    parts = decompose.split_model( model )
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import multiprocessing
+from collections import OrderedDict
+
+import numpy as np
+import scipy.sparse as sparse
+from scipy.sparse.csgraph import connected_components
+
+import config
+import compartment as ir
+from utils import helper
+from yparser import propagation
+from yacml2scipy import Table, sample_times, write_output
+
+logger_ = config.logger_
+
+def expression_species( params, net ):
+    """Indices in net of species named in expressions of params.
+    """
+    ids = [ ]
+    for p in params:
+        if p.value is None and p.expr:
+            ids += [ net.species_index[ x ] for x in helper.get_ids( p.expr )
+                    if x in net.species_index ]
+    return ids
+
+def component_labels( model ):
+    """Connected components of model. Return number of components and the
+    component of each species and each reaction, numbered as in
+    analysis.ReactionNetwork. Components are numbered in order of their first
+    species.
+    """
+    rows, cols = [ ], [ ]
+    nS = sum( [ len( net.species ) for c, net in model.networks( ) ] )
+    offset, j = 0, nS
+    for compt, net in model.networks( ):
+        for i, sp in enumerate( net.species ):
+            for k in expression_species( sp.params, net ):
+                rows.append( offset + i )
+                cols.append( offset + k )
+        for r in net.reactions:
+            for k in list( r.substrates ) + list( r.products ) \
+                    + expression_species( r.params, net ):
+                rows.append( j )
+                cols.append( offset + k )
+            j += 1
+        offset += len( net.species )
+    graph = sparse.coo_matrix( ( np.ones( len( rows ) ), ( rows, cols ) ), shape = ( j, j ) )
+    n, labels = connected_components( graph, directed = False )
+    return n, labels[ :nS ], labels[ nS: ]
+
+def copy_compartment( compt, name = None ):
+    """Compartment like compt (geometry etc.) without networks.
+    """
+    c = ir.Compartment( compt.id, name or compt.name, compt.type, compt.shape )
+    c.geometry = compt.geometry
+    c.volume = compt.volume
+    c.diffusion_length = compt.diffusion_length
+    return c
+
+def subnetwork( net, species, reactions ):
+    """Network with some species and reactions (indices) of net. Species and
+    parameters are shared with net; reactions are renumbered.
+    """
+    sub = ir.Network( net.name, net.recipe )
+    index = { }
+    for i in species:
+        index[ i ] = len( sub.species )
+        sub.add_species( net.species[ i ] )
+    for j in reactions:
+        r = net.reactions[ j ]
+        sub.reactions.append( ir.Reaction( r.name
+            , [ index[ i ] for i in r.substrates ], r.substrate_stoich
+            , [ index[ i ] for i in r.products ], r.product_stoich
+            , r.params )
+            )
+    return sub
+
+def split_model( model ):
+    """Model of each connected component of model, in order of components.
+    A component keeps the names of its compartments and networks.
+    """
+    n, speciesLabels, reactionLabels = component_labels( model )
+    parts = [ ]
+    for k in range( n ):
+        part = ir.Model( model.name )
+        part.engine = model.engine
+        part.simulator = dict( model.simulator ) if model.simulator else model.simulator
+        parts.append( part )
+    offset, j = 0, 0
+    for compt in model.compartments:
+        copies = { }
+        for net in compt.networks:
+            sp = speciesLabels[ offset : offset + len( net.species ) ]
+            rs = reactionLabels[ j : j + len( net.reactions ) ]
+            for k in np.unique( np.concatenate( [ sp, rs ] ) ):
+                if k not in copies:
+                    copies[ k ] = copy_compartment( compt )
+                    parts[ k ].compartments.append( copies[ k ] )
+                copies[ k ].networks.append( subnetwork( net
+                    , np.nonzero( sp == k )[ 0 ], np.nonzero( rs == k )[ 0 ] )
+                    )
+            offset += len( net.species )
+            j += len( net.reactions )
+    logger_.info( 'Model %s has %d independent components' % ( model.name, n ) )
+    return parts
+
+def component_model( model ):
+    """One model in which every component of a compartment is a compartment
+    of its own, named <compartment>_<k> when compartment has more than one
+    component.
+    """
+    parts = split_model( model )
+    whole = ir.Model( model.name )
+    whole.engine, whole.simulator = model.engine, model.simulator
+    counts = { }
+    for part in parts:
+        for c in part.compartments:
+            counts[ c.name ] = counts.get( c.name, 0 ) + 1
+    seen = { }
+    for part in parts:
+        for c in part.compartments:
+            # Compartments of parts are copies; rename them in place.
+            if counts[ c.name ] > 1:
+                k = seen[ c.name ] = seen.get( c.name, -1 ) + 1
+                c.name = '%s_%d' % ( c.name, k )
+            whole.compartments.append( c )
+    return whole
+
+def record_columns( model ):
+    """Names of recorded columns of model in order.
+    """
+    return [ '%s.%s.%s' % ( net.name, sp.name, sp.record )
+            for c, net in model.networks( ) for sp in net.species if sp.record ]
+
+# Parts of model and backend used by run_part, set by run_components.
+parts_ = None
+backend_ = None
+
+def run_part( k ):
+    """Simulate component k. Return times (None when backend does not give
+    them) and (column, vector) of its tables.
+    """
+    context = backend_.LoadContext( )
+    context.save_output = False
+    context.model = parts_[ k ]
+    context.modelname = parts_[ k ].name
+    backend_.simulate( parts_[ k ], context )
+    times = getattr( context, 'time', None )
+    return times, [ ( t.columnName, np.asarray( t.vector, dtype = float ) )
+            for t in context.tables ]
+
+def run_components( model, backend, context, jobs = None ):
+    """Simulate each component of model with backend (e.g. yacml2scipy) and
+    merge their tables into context. Components run one after the other when
+    jobs is 1, otherwise in a pool of jobs processes (default: number of
+    cpus). MOOSE components always run in processes of their own; use
+    split_components of yacml2moose.load to run them in one. Return tables of
+    context.
+    """
+    isMoose = backend.__name__ == 'yacml2moose'
+    global parts_, backend_
+    parts_, backend_ = split_model( model ), backend
+    seed = ( model.simulator or { } ).get( 'seed' )
+    if seed:
+        # Components of a stochastic model need streams of their own.
+        for k, part in enumerate( parts_ ):
+            part.simulator[ 'seed' ] = str( int( helper.to_float( seed ) ) + k )
+    try:
+        if len( parts_ ) == 1 or ( jobs == 1 and not isMoose ):
+            results = [ run_part( k ) for k in range( len( parts_ ) ) ]
+        else:
+            # MOOSE can load only one model in a process.
+            pool = multiprocessing.Pool( jobs, maxtasksperchild = 1 if isMoose else None )
+            try:
+                results = pool.map( run_part, range( len( parts_ ) ) )
+                pool.close( )
+            except:
+                pool.terminate( )
+                raise
+            finally:
+                pool.join( )
+    finally:
+        parts_, backend_ = None, None
+
+    vectors, times = { }, None
+    for t, tables in results:
+        if t is not None:
+            times = t
+        vectors.update( dict( tables ) )
+    tables = OrderedDict( [ ( c, vectors[ c ] ) for c in record_columns( model )
+        if c in vectors ] )
+    sim = model.simulator or { }
+    if times is None:
+        n = max( [ len( v ) for v in tables.values( ) ] + [ 0 ] )
+        times = sample_times( helper.to_float( sim.get( 'sim_time', '1' ) )
+                , helper.to_float( sim.get( 'record_dt', '1' ) ) )[ :n ]
+    context.model, context.modelname = model, model.name
+    context.time = times
+    context.tables = [ Table( n, v ) for n, v in tables.items( ) ]
+    format_ = sim.get( 'format', 'csv' ).strip( '"\'' )
+    if getattr( context, 'save_output', True ):
+        write_output( '%s.%s' % ( model.name, format_ ), times, tables, format_ )
+    return context.tables
+
+##
+# @brief Simulate yacml XML model component by component.
+#
+# @param xml Input model AST in XML.
+# @param backend Simulator module e.g. yacml2scipy, yacml2ssa or yacml2moose.
+# @param context LoadContext of backend which collects results. A new one is
+#   used by default.
+# @param jobs Number of processes; 1 runs components one after the other.
+# @param kwargs propagate = False skips constant propagation when xml is
+#   already propagated, save_output = False does not write results to a file.
+#
+# @return  The loaded AST.
+def load( xml, backend, context = None, jobs = None, **kwargs ):
+    if context is None:
+        context = backend.LoadContext( )
+    context.save_output = kwargs.get( 'save_output', getattr( context, 'save_output', True ) )
+    if kwargs.get( 'propagate', True ):
+        propagation.propagate( xml )
+    run_components( ir.build_model( xml ), backend, context, jobs )
+    return xml
@@ -0,0 +1,328 @@
+"""ensemble.py: 
+
+Run many replicates of a stochastic YACML model and keep only their summary
+statistics.
+
+The model is compiled once. Replicates are run in chunks by a pool of worker
+processes; every recorded column is reduced online, replicate by replicate, to
+its mean, variance, minimum, maximum and optional quantiles (P-square
+estimates). Trajectories are never stored, therefore memory does not grow with
+the number of replicates. Only the aggregated time series are written:
+
+    time  <column>.mean  <column>.std  <column>.min  <column>.max  <column>.q<p> ...
+
+Replicate i is seeded with replicate_seed( seed, i ), so an ensemble is
+reproducible with the same seed and chunk size whatever the number of
+processes. With simulator ssa a chunk is advanced as one batch
+(yacml2ssa.StochasticModel.batch) seeded by its first replicate; with moose
+every replicate is loaded on its own after moose.seed.
+
+Usage:
+
+    python ensemble.py model.yacml --replicates 1000 --jobs 8 --seed 1
+    python ensemble.py model.yacml -n 1000 --quantile 0.05 --quantile 0.95 -o stats.csv
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import os
+import shutil
+import hashlib
+import tempfile
+import multiprocessing
+from collections import OrderedDict
+
+import numpy as np
+import lxml.etree as etree
+
+import yacml
+import compartment as ir
+import yacml2ssa
+from utils import helper
+from yacml2scipy import sample_times, write_output
+from config import logger_
+
+class Welford( object ):
+    """Online mean, variance, minimum and maximum of arrays of one shape.
+    """
+
+    def __init__( self, shape ):
+        self.count = 0
+        self.mean = np.zeros( shape )
+        self.m2 = np.zeros( shape )
+        self.min = np.full( shape, np.inf )
+        self.max = np.full( shape, -np.inf )
+
+    def update( self, x ):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * ( x - self.mean )
+        np.minimum( self.min, x, out = self.min )
+        np.maximum( self.max, x, out = self.max )
+
+    def merge( self, other ):
+        """Add the statistics of other (Chan et al.) e.g. of another process.
+        """
+        n = self.count + other.count
+        if other.count == 0:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / n
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / n
+        self.count = n
+        np.minimum( self.min, other.min, out = self.min )
+        np.maximum( self.max, other.max, out = self.max )
+
+    @property
+    def variance( self ):
+        """Sample variance (n - 1 degrees of freedom).
+        """
+        if self.count < 2:
+            return np.zeros_like( self.m2 )
+        return self.m2 / ( self.count - 1 )
+
+    @property
+    def std( self ):
+        return np.sqrt( self.variance )
+
+class P2Quantile( object ):
+    """Online estimate of quantile p of arrays of one shape with the
+    P-square algorithm (Jain and Chlamtac 1985): five markers per element.
+    """
+
+    def __init__( self, p, shape ):
+        self.p = p
+        self.count = 0
+        self.q = np.zeros( ( 5, ) + tuple( shape ) )
+        self.n = np.zeros( ( 5, ) + tuple( shape ) )
+        self.desired = np.array( [ 0, 2 * p, 4 * p, 2 + 2 * p, 4 ] )
+        self.increment = np.array( [ 0, p / 2.0, p, ( 1 + p ) / 2.0, 1 ] )
+        self.ns = None
+
+    def update( self, x ):
+        if self.count < 5:
+            self.q[ self.count ] = x
+            self.count += 1
+            if self.count == 5:
+                self.q.sort( axis = 0 )
+                column = ( 5, ) + ( 1, ) * x.ndim
+                self.n[ ... ] = np.arange( 5 ).reshape( column )
+                # Desired positions of markers.
+                self.ns = self.desired.reshape( column ) + np.zeros_like( self.n )
+            return
+        self.count += 1
+        q, n = self.q, self.n
+        np.minimum( q[ 0 ], x, out = q[ 0 ] )
+        np.maximum( q[ 4 ], x, out = q[ 4 ] )
+        # Markers above x move up by one.
+        for i in range( 1, 5 ):
+            n[ i ] += x < q[ i ]
+        n[ 4 ] += x >= q[ 4 ]
+        self.ns += self.increment.reshape( ( 5, ) + ( 1, ) * x.ndim )
+        for i in range( 1, 4 ):
+            d = self.ns[ i ] - n[ i ]
+            move = ( ( d >= 1 ) & ( n[ i + 1 ] - n[ i ] > 1 ) ) \
+                    | ( ( d <= -1 ) & ( n[ i - 1 ] - n[ i ] < -1 ) )
+            if not move.any( ):
+                continue
+            d = np.sign( d ) * move
+            qp = self.parabolic( i, d )
+            ok = ( q[ i - 1 ] < qp ) & ( qp < q[ i + 1 ] )
+            q[ i ] = np.where( move, np.where( ok, qp, self.linear( i, d ) ), q[ i ] )
+            n[ i ] += d
+
+    def parabolic( self, i, d ):
+        q, n = self.q, self.n
+        with np.errstate( divide = 'ignore', invalid = 'ignore' ):
+            return q[ i ] + d / ( n[ i + 1 ] - n[ i - 1 ] ) * (
+                    ( n[ i ] - n[ i - 1 ] + d ) * ( q[ i + 1 ] - q[ i ] ) / ( n[ i + 1 ] - n[ i ] )
+                    + ( n[ i + 1 ] - n[ i ] - d ) * ( q[ i ] - q[ i - 1 ] ) / ( n[ i ] - n[ i - 1 ] )
+                    )
+
+    def linear( self, i, d ):
+        q, n = self.q, self.n
+        j = np.where( d > 0, i + 1, i - 1 ).astype( int )
+        qj = np.choose( j - ( i - 1 ), [ q[ i - 1 ], q[ i ], q[ i + 1 ] ] )
+        nj = np.choose( j - ( i - 1 ), [ n[ i - 1 ], n[ i ], n[ i + 1 ] ] )
+        with np.errstate( divide = 'ignore', invalid = 'ignore' ):
+            return np.where( d == 0, q[ i ], q[ i ] + d * ( qj - q[ i ] ) / ( nj - n[ i ] ) )
+
+    @property
+    def value( self ):
+        if self.count >= 5:
+            return self.q[ 2 ].copy( )
+        if self.count == 0:
+            return np.full( self.q.shape[ 1: ], np.nan )
+        return np.percentile( self.q[ :self.count ], 100 * self.p, axis = 0 )
+
+def replicate_seed( seed, index ):
+    """Seed of replicate index of an ensemble seeded by seed: independent of
+    the process which runs it.
+    """
+    h = hashlib.sha1( ( '%s:%d' % ( seed, index ) ).encode( 'utf-8' ) ).hexdigest( )
+    return int( h[ :8 ], 16 ) & 0x7fffffff
+
+# State of a worker process, set by init_worker.
+worker_ = None
+
+def init_worker( xml_text, solver, workdir ):
+    global worker_
+    # Backends write their files (graphviz etc.) in current directory.
+    os.chdir( tempfile.mkdtemp( dir = workdir ) )
+    worker_ = { 'xml' : etree.fromstring( xml_text ), 'solver' : solver }
+    if solver == 'ssa':
+        model = ir.build_model( worker_[ 'xml' ] )
+        worker_[ 'model' ] = yacml2ssa.StochasticModel( model )
+        worker_[ 'settings' ] = yacml2ssa.settings( model )
+
+def run_chunk( task ):
+    """Run replicates start ... start + count - 1. Return column names and
+    recorded values (count x columns x times).
+    """
+    start, count, seed = task
+    if worker_[ 'solver' ] == 'ssa':
+        sm, opts = worker_[ 'model' ], worker_[ 'settings' ]
+        sm.rng = np.random.RandomState( replicate_seed( seed, start ) )
+        times, x = sm.batch( count, opts[ 'sim_time' ], opts[ 'record_dt' ]
+                , opts[ 'method' ], opts[ 'epsilon' ] )
+        tables = sm.tables( x )
+        return list( tables.keys( ) ), np.stack( list( tables.values( ) ), axis = 1 )
+
+    backend = yacml.get_backend( worker_[ 'solver' ] )
+    names, values = None, [ ]
+    for i in range( start, start + count ):
+        if worker_[ 'solver' ] == 'moose':
+            moose = backend.use_simulator( )
+            backend.delete_model( )
+            moose.seed( replicate_seed( seed, i ) )
+        context = backend.LoadContext( )
+        backend.load( worker_[ 'xml' ], context, propagate = False, save_output = False )
+        names = [ t.columnName for t in context.tables ]
+        values.append( [ np.asarray( t.vector, dtype = float ) for t in context.tables ] )
+    return names, np.array( values )
+
+class Ensemble( object ):
+    """Replicates of model file reduced to summary statistics.
+    """
+
+    def __init__( self, model_file, replicates, seed = 0, jobs = None
+            , quantiles = ( ), chunk = 32 ):
+        self.model_file = model_file
+        self.replicates = replicates
+        self.seed = seed
+        self.jobs = jobs or multiprocessing.cpu_count( )
+        self.quantiles = list( quantiles )
+        self.chunk = chunk
+        self.columns = None
+        self.stats = None
+        self.sketches = None
+        self.times = None
+
+    def tasks( self ):
+        for start in range( 0, self.replicates, self.chunk ):
+            yield start, min( self.chunk, self.replicates - start ), self.seed
+
+    def reduce( self, names, values ):
+        """Add replicates (replicates x columns x times) to statistics.
+        """
+        if self.stats is None:
+            self.columns = names
+            shape = values.shape[ 1: ]
+            self.stats = Welford( shape )
+            self.sketches = [ P2Quantile( p, shape ) for p in self.quantiles ]
+        for x in values:
+            self.stats.update( x )
+            for s in self.sketches:
+                s.update( x )
+
+    def run( self ):
+        """Run all replicates. Return the aggregated time series, an
+        OrderedDict of name : vector.
+        """
+        with open( self.model_file ) as f:
+            xml = yacml.compile_model( self.model_file, f.read( ) )
+        solver = yacml.simulator_name( xml )
+        if solver not in yacml.backends_:
+            raise ValueError( 'Unknown simulator %s' % solver )
+        if solver == 'ssa':
+            # Reject models the workers can not simulate before starting them.
+            yacml2ssa.settings( ir.build_model( xml ) )
+        sim = xml.find( 'model/simulator' )
+        sim = dict( sim.attrib ) if sim is not None else { }
+        workdir = tempfile.mkdtemp( prefix = 'ensemble_' )
+        logger_.info( 'Running %d replicates of %s (%s) in %d processes' % (
+            self.replicates, self.model_file, solver, self.jobs ) )
+        # A moose process runs one chunk; MOOSE does not release everything
+        # it allocates.
+        pool = multiprocessing.Pool( self.jobs, init_worker
+                , ( etree.tostring( xml ), solver, workdir )
+                , maxtasksperchild = 1 if solver == 'moose' else None
+                )
+        try:
+            # Results come in order of replicates, so statistics do not
+            # depend on the number of processes.
+            for names, values in pool.imap( run_chunk, self.tasks( ) ):
+                self.reduce( names, values )
+            pool.close( )
+        except:
+            pool.terminate( )
+            raise
+        finally:
+            pool.join( )
+            shutil.rmtree( workdir, ignore_errors = True )
+        simTime = helper.to_float( sim.get( 'sim_time', '1' ) )
+        dt = helper.to_float( sim.get( 'record_dt', '1' ) )
+        self.times = sample_times( simTime, dt )[ :self.stats.mean.shape[ 1 ] ]
+        return self.summary( )
+
+    def summary( self ):
+        res = OrderedDict( )
+        for i, name in enumerate( self.columns ):
+            res[ '%s.mean' % name ] = self.stats.mean[ i ]
+            res[ '%s.std' % name ] = self.stats.std[ i ]
+            res[ '%s.min' % name ] = self.stats.min[ i ]
+            res[ '%s.max' % name ] = self.stats.max[ i ]
+            for s in self.sketches:
+                res[ '%s.q%g' % ( name, s.p ) ] = s.value[ i ]
+        return res
+
+    def save( self, filename ):
+        format_ = 'npy' if filename.endswith( '.npy' ) else 'csv'
+        write_output( filename, self.times, self.summary( ), format_ )
+
+def main( args ):
+    ens = Ensemble( args.model, args.replicates, args.seed, args.jobs
+            , args.quantile or [ ], args.chunk )
+    ens.run( )
+    outfile = args.outfile or '%s_ensemble.csv' % os.path.splitext( args.model )[0]
+    ens.save( outfile )
+    print( 'Done %d replicates. Statistics are in %s' % ( args.replicates, outfile ) )
+
+if __name__ == '__main__':
+    import argparse
+    argp = argparse.ArgumentParser( description = 'Replicate ensemble of a YACML model' )
+    argp.add_argument( 'model', help = 'YACML model file' )
+    argp.add_argument( '--replicates', '-n', required = True, type = int )
+    argp.add_argument( '--seed', default = 0, type = int )
+    argp.add_argument( '--jobs', '-j', default = None, type = int
+            , help = 'Number of worker processes (default: number of cpus)'
+            )
+    argp.add_argument( '--quantile', '-q', action = 'append', type = float
+            , help = 'Quantile to estimate e.g. 0.05; may be repeated'
+            )
+    argp.add_argument( '--chunk', default = 32, type = int
+            , help = 'Replicates per task'
+            )
+    argp.add_argument( '--outfile', '-o', default = None
+            , help = 'Output file (.csv or .npy)'
+            )
+    main( argp.parse_args( ) )
@@ -0,0 +1,262 @@
+"""memsim.py: 
+
+In-memory simulator with the MOOSE API used by yacml2moose (see
+simulator.py). It records the elements created by the loader, their fields and
+the messages between them, and simulates nothing: reinit copies initial
+values (nInit etc.) to current values and start only advances time. Tables
+stay empty.
+
+    import yacml, memsim
+    yacml.loadModel( 'model.yacml', simulator = 'memory' )
+    print( memsim.summary( ) )
+
+summary( ) counts elements by class and messages; it can be compared
+between versions of the loader.
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import re
+from collections import OrderedDict, namedtuple
+
+# Path : Neutral, in order of creation.
+elements_ = OrderedDict( )
+
+# All messages, in order of connect calls.
+Message = namedtuple( 'Message', [ 'src', 'src_field', 'dest', 'dest_field' ] )
+messages_ = [ ]
+
+# Clock tick : dt, set by setClock.
+clocks_ = { }
+
+# Simulated time, advanced by start.
+time_ = 0.0
+
+class Neutral( object ):
+    """An element. Creating an element at the path of an existing one
+    returns the existing one, as in MOOSE.
+    """
+
+    # Field : value of fields which are not set.
+    defaults_ = { }
+
+    def __new__( cls, path ):
+        path = path.rstrip( '/' ) or '/'
+        elem = elements_.get( path )
+        if elem is not None:
+            return elem
+        elem = object.__new__( cls )
+        object.__setattr__( elem, 'path', path )
+        object.__setattr__( elem, 'name', path.split( '/' )[ -1 ] )
+        object.__setattr__( elem, 'className', cls.__name__ )
+        object.__setattr__( elem, 'fields', { } )
+        elements_[ path ] = elem
+        return elem
+
+    def __init__( self, path ):
+        pass
+
+    def __getattr__( self, name ):
+        # Only called for names which are not attributes.
+        fields = self.__dict__[ 'fields' ]
+        if name in fields:
+            return fields[ name ]
+        for cls in type( self ).__mro__:
+            if name in getattr( cls, 'defaults_', { } ):
+                return cls.defaults_[ name ]
+        raise AttributeError( '%s has no field %s' % ( self.className, name ) )
+
+    def __setattr__( self, name, value ):
+        self.fields[ name ] = value
+
+    def setField( self, name, value ):
+        self.fields[ name ] = value
+
+    def getField( self, name ):
+        return getattr( self, name )
+
+    @property
+    def parent( self ):
+        return elements_.get( self.path.rsplit( '/', 1 )[ 0 ] or '/' )
+
+    @property
+    def neighbors( self ):
+        """Field : elements connected to field of this element.
+        """
+        result = { }
+        for m in messages_:
+            if m.src == self.path:
+                result.setdefault( m.src_field, [ ] ).append( element( m.dest ) )
+            elif m.dest == self.path:
+                result.setdefault( m.dest_field, [ ] ).append( element( m.src ) )
+        return result
+
+    def __repr__( self ):
+        return '<%s: %s>' % ( self.className, self.path )
+
+class Field( object ):
+    """Entry i of a field element e.g. x[i] of a Function.
+    """
+
+    def __init__( self, path ):
+        self.path = path
+
+class FieldElement( object ):
+
+    def __init__( self, path ):
+        self.path = path
+        self.num = 0
+
+    def __getitem__( self, i ):
+        if not 0 <= i < self.num:
+            raise IndexError( '%s has %d entries' % ( self.path, self.num ) )
+        return Field( '%s[%d]' % ( self.path, i ) )
+
+class ChemCompt( Neutral ):
+    defaults_ = { 'volume' : 1e-15, 'diffLength' : 0.0 }
+
+class CubeMesh( ChemCompt ):
+    defaults_ = { 'x0' : 0.0, 'y0' : 0.0, 'z0' : 0.0, 'x1' : 1e-5, 'y1' : 1e-5, 'z1' : 1e-5 }
+
+class CylMesh( ChemCompt ):
+    defaults_ = { 'x0' : 0.0, 'y0' : 0.0, 'z0' : 0.0, 'x1' : 1e-5, 'y1' : 0.0, 'z1' : 0.0
+            , 'r0' : 1e-6, 'r1' : 1e-6 }
+
+class PoolBase( Neutral ):
+    defaults_ = { 'n' : 0.0, 'nInit' : 0.0, 'conc' : 0.0, 'concInit' : 0.0
+            , 'diffConst' : 0.0 }
+
+class Pool( PoolBase ):
+    pass
+
+class BufPool( Pool ):
+    pass
+
+class Reac( Neutral ):
+    defaults_ = { 'Kf' : 0.0, 'Kb' : 0.0, 'numKf' : 0.0, 'numKb' : 0.0 }
+
+class Function( Neutral ):
+    defaults_ = { 'expr' : '', 'value' : 0.0 }
+
+    @property
+    def x( self ):
+        if 'x' not in self.fields:
+            self.fields[ 'x' ] = FieldElement( '%s/x' % self.path )
+        return self.fields[ 'x' ]
+
+class Table2( Neutral ):
+    defaults_ = { 'columnName' : '' }
+
+    @property
+    def vector( self ):
+        return self.fields.setdefault( 'vector', [ ] )
+
+class Stoich( Neutral ):
+    pass
+
+class Ksolve( Neutral ):
+    pass
+
+class Gsolve( Ksolve ):
+    defaults_ = { 'useClockedUpdate' : False }
+
+class Dsolve( Neutral ):
+    pass
+
+class Streamer( Neutral ):
+    defaults_ = { 'outfile' : '' }
+
+    def addTables( self, tables ):
+        self.fields.setdefault( 'tables', [ ] ).extend( tables )
+
+def path_of( elem ):
+    return elem if isinstance( elem, str ) else elem.path
+
+def element( path ):
+    if isinstance( path, Neutral ):
+        return path
+    try:
+        return elements_[ path.rstrip( '/' ) or '/' ]
+    except KeyError:
+        raise ValueError( '%s: element does not exist' % path )
+
+def exists( path ):
+    return ( path.rstrip( '/' ) or '/' ) in elements_
+
+def connect( src, src_field, dest, dest_field ):
+    for e in [ src, dest ]:
+        if isinstance( e, str ) and not exists( e ):
+            raise ValueError( '%s: element does not exist' % e )
+    msg = Message( path_of( src ), src_field, path_of( dest ), dest_field )
+    messages_.append( msg )
+    return msg
+
+def delete( path ):
+    """Delete element at path, its children and their messages.
+    """
+    global messages_
+    path = path_of( path )
+    if not exists( path ):
+        raise ValueError( '%s: element does not exist' % path )
+    prefix = path + '/'
+    for p in [ p for p in elements_ if p == path or p.startswith( prefix ) ]:
+        del elements_[ p ]
+    messages_ = [ m for m in messages_ if not (
+        m.src == path or m.src.startswith( prefix )
+        or m.dest == path or m.dest.startswith( prefix ) ) ]
+
+def wildcardFind( pattern ):
+    """Elements below path of pattern path/##[TYPE=Class] which are Class.
+    Only this form of pattern is supported.
+    """
+    m = re.match( r'(.*)/##\[TYPE=(\w+)\]$', pattern )
+    if m is None:
+        raise ValueError( 'Unsupported pattern %s' % pattern )
+    root, className = m.groups( )
+    cls = globals( ).get( className )
+    if not ( isinstance( cls, type ) and issubclass( cls, Neutral ) ):
+        return [ ]
+    return [ e for p, e in elements_.items( ) if p.startswith( root + '/' )
+            and isinstance( e, cls ) ]
+
+def setClock( tick, dt ):
+    clocks_[ tick ] = dt
+
+def reinit( ):
+    global time_
+    time_ = 0.0
+    for e in wildcardFind( '/##[TYPE=PoolBase]' ):
+        e.n, e.conc = e.nInit, e.concInit
+
+def start( runtime, *args ):
+    global time_
+    time_ += runtime
+
+def seed( value ):
+    pass
+
+def summary( ):
+    """Number of elements of each class and number of messages.
+    """
+    counts = OrderedDict( )
+    for e in elements_.values( ):
+        counts[ e.className ] = counts.get( e.className, 0 ) + 1
+    counts[ 'messages' ] = len( messages_ )
+    return counts
+
+def reset( ):
+    """Forget all elements and messages.
+    """
+    global messages_, time_
+    elements_.clear( )
+    messages_ = [ ]
+    clocks_.clear( )
+    time_ = 0.0
@@ -0,0 +1,296 @@
+"""profiling.py: 
+
+Timers and counters of the stages of loading a model.
+
+Stages are timed with
+
+    with profiling.stage( 'parse' ):
+        ...
+
+and events are counted with profiling.count( 'moose.connect' ). Both cost
+almost nothing unless profiling is enabled, by
+
+    yacml.loadModel( 'model.yacml', profile = 'report.json' )
+
+or by setting YACML_PROFILE to the name of the report in environment. The
+report is a JSON file with the wall time and number of calls of every stage
+and all counters. A stage enclosing another includes its time. With cprofile
+= True (or a list of stage names) every stage also runs under cProfile and its
+statistics are written to <report>.<stage>.prof; a stage inside a profiled
+stage is part of the profile of the outer one.
+
+With memory = True resident memory (RSS) is read at the start and the end of
+every stage, and the report has growth of RSS and peak RSS of each stage.
+When tracemalloc is available (python 3, or pytracemalloc on python 2) it also
+has the top allocation sites of each stage. Memory allocated by lxml and MOOSE
+is not traced by tracemalloc; only RSS shows it. With memory_budget (in MB, or
+YACML_MEMORY_BUDGET in environment) a load is aborted with MemoryBudgetError
+at the first stage boundary where RSS exceeds the budget.
+
+Stages of yacml: parse, flatten, propagate, dump (writing of xml files), ir,
+compartments, species, reactions, solver, recorder, reinit and run.
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import sys
+import json
+import time
+import resource
+import cProfile
+import platform
+from collections import OrderedDict
+
+import config
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+logger_ = config.logger_
+
+class MemoryBudgetError( MemoryError ):
+    """Resident memory exceeded the memory budget of a load.
+    """
+    pass
+
+def rss_mb( ):
+    """Current resident memory in MB (peak on systems without /proc).
+    """
+    try:
+        with open( '/proc/self/statm' ) as f:
+            pages = int( f.read( ).split( )[1] )
+        return pages * resource.getpagesize( ) / 1024.0 / 1024.0
+    except IOError:
+        return resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss / 1024.0
+
+class NullStage( object ):
+    """Stage used when profiling is disabled.
+    """
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        return False
+
+null_stage_ = NullStage( )
+
+class Stage( object ):
+
+    def __init__( self, profiler, name ):
+        self.profiler = profiler
+        self.name = name
+        self.profile = None
+        self.start = None
+        self.rss = None
+        self.snapshot = None
+
+    def __enter__( self ):
+        p = self.profiler
+        if p.memory:
+            self.rss = p.check_budget( self.name, rss_mb( ) )
+            if p.tracing:
+                self.snapshot = tracemalloc.take_snapshot( )
+        if p.profiling is None and p.cprofile_stage( self.name ):
+            self.profile = p.profiles.get( self.name )
+            if self.profile is None:
+                self.profile = p.profiles[ self.name ] = cProfile.Profile( )
+            p.profiling = self.name
+            self.profile.enable( )
+        self.start = time.time( )
+        return self
+
+    def __exit__( self, *args ):
+        elapsed = time.time( ) - self.start
+        p = self.profiler
+        if self.profile is not None:
+            self.profile.disable( )
+            p.profiling = None
+        entry = p.stages.get( self.name )
+        if entry is None:
+            entry = p.stages[ self.name ] = [ 0.0, 0 ]
+        entry[ 0 ] += elapsed
+        entry[ 1 ] += 1
+        if p.memory:
+            self.account_memory( args[ 0 ] is None )
+        return False
+
+    def account_memory( self, check ):
+        p = self.profiler
+        rss = rss_mb( )
+        mem = p.memory_stages.get( self.name )
+        if mem is None:
+            mem = p.memory_stages[ self.name ] = OrderedDict( [ 
+                ( 'rss_before_mb', self.rss ), ( 'rss_after_mb', rss )
+                , ( 'growth_mb', 0.0 ), ( 'peak_rss_mb', rss ), ( 'sites', { } )
+                ] )
+        mem[ 'rss_after_mb' ] = rss
+        mem[ 'growth_mb' ] += rss - self.rss
+        mem[ 'peak_rss_mb' ] = max( mem[ 'peak_rss_mb' ], rss )
+        if self.snapshot is not None:
+            # Allocations of tracemalloc and of this file are not interesting.
+            ignore = [ tracemalloc.Filter( False, tracemalloc.__file__ )
+                    , tracemalloc.Filter( False, __file__.replace( '.pyc', '.py' ) ) ]
+            stats = tracemalloc.take_snapshot( ).filter_traces( ignore ).compare_to( 
+                    self.snapshot.filter_traces( ignore ), 'lineno' )
+            sites = mem[ 'sites' ]
+            for st in stats[ : 4 * p.top ]:
+                site = '%s:%s' % ( st.traceback[ 0 ].filename, st.traceback[ 0 ].lineno )
+                size, count = sites.get( site, ( 0, 0 ) )
+                sites[ site ] = ( size + st.size_diff, count + st.count_diff )
+            self.snapshot = None
+        if check:
+            p.check_budget( self.name, rss, rss - self.rss )
+
+class Profiler( object ):
+    """Wall time of stages and counters of one run.
+    """
+
+    def __init__( self ):
+        self.enabled = False
+        # Stages to run under cProfile: None, 'all' or a set of names.
+        self.cprofile = None
+        # Account memory of stages, and abort when RSS exceeds budget (MB).
+        self.memory = False
+        self.budget = None
+        # Number of allocation sites of a stage in report.
+        self.top = 10
+        # True when tracemalloc was started by this profiler.
+        self.tracing = False
+        self.reset( )
+
+    def reset( self ):
+        # Name : [ seconds, calls ], in order of first use.
+        self.stages = OrderedDict( )
+        self.counters = OrderedDict( )
+        self.profiles = OrderedDict( )
+        self.memory_stages = OrderedDict( )
+        # Name of stage which is under cProfile now.
+        self.profiling = None
+        self.info = OrderedDict( )
+        self.started = time.time( )
+
+    def cprofile_stage( self, name ):
+        return self.cprofile == 'all' or ( self.cprofile and name in self.cprofile )
+
+    def check_budget( self, name, rss, growth = None ):
+        """Raise MemoryBudgetError when rss (MB) at a boundary of stage name
+        exceeds budget. Return rss.
+        """
+        if self.budget and rss > self.budget:
+            msg = 'Resident memory %.0f MB exceeds memory budget of %.0f MB' % (
+                    rss, self.budget )
+            if growth is None:
+                msg += ' before stage %s' % name
+            else:
+                msg += ' after stage %s, which added %.0f MB' % ( name, growth )
+            logger_.error( msg )
+            raise MemoryBudgetError( msg )
+        return rss
+
+    def stage( self, name ):
+        if not self.enabled:
+            return null_stage_
+        return Stage( self, name )
+
+    def count( self, name, n = 1 ):
+        if self.enabled:
+            self.counters[ name ] = self.counters.get( name, 0 ) + n
+
+    def report( self ):
+        """Report as a dictionary which can be written as JSON.
+        """
+        return OrderedDict( [
+            ( 'info', self.info )
+            , ( 'python', sys.version.split( )[ 0 ] )
+            , ( 'platform', platform.platform( ) )
+            , ( 'started', self.started )
+            , ( 'total_seconds', time.time( ) - self.started )
+            , ( 'stages', OrderedDict( [ ( n, { 'seconds' : s, 'calls' : c } )
+                for n, ( s, c ) in self.stages.items( ) ] ) )
+            , ( 'counters', self.counters )
+            , ( 'memory', self.memory_report( ) )
+            ] )
+
+    def memory_report( self ):
+        if not self.memory:
+            return None
+        stages = OrderedDict( )
+        for name, mem in self.memory_stages.items( ):
+            m = OrderedDict( [ ( k, v ) for k, v in mem.items( ) if k != 'sites' ] )
+            sites = sorted( mem[ 'sites' ].items( ), key = lambda x : -x[ 1 ][ 0 ] )
+            m[ 'top_allocations' ] = [ { 'site' : site, 'size_kb' : size / 1024.0
+                , 'count' : count } for site, ( size, count ) in sites[ : self.top ] ]
+            stages[ name ] = m
+        return OrderedDict( [ ( 'budget_mb', self.budget )
+            , ( 'tracemalloc', self.tracing )
+            , ( 'rss_mb', rss_mb( ) )
+            , ( 'max_rss_mb', resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss / 1024.0 )
+            , ( 'stages', stages )
+            ] )
+
+    def write_report( self, filename ):
+        """Write JSON report to filename and cProfile statistics of stages to
+        filename.<stage>.prof.
+        """
+        rep = self.report( )
+        rep[ 'cprofile' ] = { }
+        for name, prof in self.profiles.items( ):
+            statsFile = '%s.%s.prof' % ( filename, name )
+            prof.dump_stats( statsFile )
+            rep[ 'cprofile' ][ name ] = statsFile
+        with open( filename, 'w' ) as f:
+            json.dump( rep, f, indent = 1 )
+        logger_.info( 'Wrote performance report to %s' % filename )
+        return rep
+
+# Profiler of this process.
+profiler_ = Profiler( )
+
+def stage( name ):
+    return profiler_.stage( name )
+
+def count( name, n = 1 ):
+    if profiler_.enabled:
+        profiler_.count( name, n )
+
+def enable( cprofile = None, memory = False, budget = None ):
+    """Start a new run: forget previous timers and counters.
+
+    :param cprofile: True (all stages) or names of stages to run under
+        cProfile.
+    :param memory: Account memory of stages.
+    :param budget: Abort with MemoryBudgetError when RSS exceeds budget MB at
+        a stage boundary. Implies memory.
+    """
+    profiler_.reset( )
+    profiler_.enabled = True
+    if cprofile is True:
+        profiler_.cprofile = 'all'
+    elif cprofile:
+        profiler_.cprofile = set( cprofile )
+    else:
+        profiler_.cprofile = None
+    profiler_.memory = bool( memory or budget )
+    profiler_.budget = budget
+    if memory and tracemalloc is not None and not tracemalloc.is_tracing( ):
+        tracemalloc.start( )
+        profiler_.tracing = True
+    elif memory and tracemalloc is None:
+        logger_.info( 'tracemalloc is not available; memory report has only RSS' )
+
+def disable( ):
+    profiler_.enabled = False
+    if profiler_.tracing:
+        tracemalloc.stop( )
+        profiler_.tracing = False
@@ -0,0 +1,377 @@
+"""reduction.py: 
+
+Eliminate fast reactions of a model.
+
+The time scale of every reaction is estimated at the initial concentrations:
+its relaxation rate is the sum of derivatives of its forward and backward
+velocities by its reactants e.g. kf + kb for a <-> b and kf ( [a] + [b] ) + kb
+for a + b <-> c. A reaction whose rate is more than separation times the
+median rate of model is fast. Two substitutions are offered for a fast
+reaction:
+
+    qssa        E + S <-> ES -> E + P where E and ES take part in nothing
+                else: ES is in quasi steady state and both reactions become
+                S -> P with the Michaelis-Menten rate
+                kf = "kcat Et / ( Km + S )", Km = ( kb1 + kcat ) / kf1.
+    equilibrium Any other fast reaction with constant rates: kf and kb are
+                scaled down by the same factor until its rate is separation
+                times the median. Its equilibrium constant is unchanged, so it
+                stays in rapid equilibrium relative to the slow reactions.
+
+Substitutions are applied only to reactions approved by the user. The reduced
+model is written as YACML and as XML (flattened and propagated AST), and is
+compared with the original in a short reference run with scipy:
+
+    python reduction.py model.yacml                     # list fast reactions
+    python reduction.py model.yacml --approve all -t 1  # reduce and compare
+    python reduction.py model.yacml --approve 'c/net/E,S<-->ES' ...
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import time
+
+import numpy as np
+import lxml.etree as etree
+
+import config
+import compartment as ir
+import decompose
+import yparser.yparser as yp
+import yparser.ast_processor as astp
+from yparser import propagation
+from yacml2scipy import OdeModel
+
+logger_ = config.logger_
+
+class FastReaction( object ):
+    """A fast reaction of a model and the substitution which removes it.
+    """
+    __slots__ = [ 'name', 'compartment', 'network', 'index', 'rate', 'kind'
+            , 'partner', 'enzyme', 'complex' ]
+
+    def __init__( self, name, compartment, network, index, rate, kind = 'equilibrium' ):
+        # Path of reaction e.g. c/net/a<-->b, as in analysis.ReactionNetwork.
+        self.name = name
+        self.compartment = compartment
+        self.network = network
+        # Index of reaction in network.
+        self.index = index
+        # Relaxation rate, 1/s.
+        self.rate = rate
+        self.kind = kind
+        # For qssa: index of reaction ES -> E + P, of E and of ES in network.
+        self.partner = None
+        self.enzyme = None
+        self.complex = None
+
+    def __repr__( self ):
+        return 'FastReaction(%s, %s, %.3g/s)' % ( self.name, self.kind, self.rate )
+
+def relaxation_rates( ode, y = None ):
+    """Relaxation rate of every (reversible) reaction of OdeModel ode at
+    concentrations y (default: initial ones).
+    """
+    if y is None:
+        y = ode.y0
+    dvdy = abs( ode.velocity_jacobian( 0.0, y ) )
+    lam = np.asarray( dvdy.sum( axis = 1 ) ).ravel( )
+    nR = len( lam ) // 2
+    return lam[ :nR ] + lam[ nR: ]
+
+def constant_rates( reaction ):
+    """(kf, kb) of reaction in concentration units, None when a rate is an
+    expression or is given in numbers.
+    """
+    rates = dict( [ ( p.name.lower( ), p ) for p in reaction.params ] )
+    if 'kf' not in rates or 'kb' not in rates:
+        return None
+    if rates[ 'kf' ].value is None or rates[ 'kb' ].value is None:
+        return None
+    return rates[ 'kf' ].value, rates[ 'kb' ].value
+
+def michaelis_menten( net, j ):
+    """If reaction j of net is E + S <-> ES of an enzyme E + S <-> ES -> E + P
+    in which E and ES take part in nothing else, return (index of ES -> E + P,
+    index of E, index of ES). Otherwise None.
+    """
+    r = net.reactions[ j ]
+    if len( r.substrates ) != 2 or len( r.products ) != 1 \
+            or list( r.substrate_stoich ) != [ 1, 1 ] or list( r.product_stoich ) != [ 1 ]:
+        return None
+    es = r.products[ 0 ]
+    uses = { }
+    for k, x in enumerate( net.reactions ):
+        for i in list( x.substrates ) + list( x.products ):
+            uses.setdefault( i, set( ) ).add( k )
+    for e in r.substrates:
+        others = uses.get( e, set( ) ) | uses.get( es, set( ) )
+        if len( others ) != 2:
+            continue
+        k = ( others - set( [ j ] ) ).pop( )
+        x = net.reactions[ k ]
+        rates = constant_rates( x )
+        if rates is None or rates[ 1 ] != 0.0 or list( x.substrates ) != [ es ] \
+                or list( x.substrate_stoich ) != [ 1 ] or e not in x.products:
+            continue
+        if dict( zip( x.products, x.product_stoich ) )[ e ] != 1:
+            continue
+        if net.species[ e ].buffered or net.species[ es ].buffered:
+            continue
+        return k, e, es
+    return None
+
+def find_fast( model, separation = 1e3 ):
+    """Fast reactions of compartment.Model model, fastest first.
+    """
+    ode = OdeModel( model )
+    lam = relaxation_rates( ode )
+    positive = lam[ lam > 0 ]
+    if not positive.size:
+        return [ ]
+    threshold = separation * np.median( positive )
+    fast = [ ]
+    j = 0
+    for compt, net in model.networks( ):
+        for i, r in enumerate( net.reactions ):
+            if lam[ j ] > threshold and constant_rates( r ) is not None:
+                f = FastReaction( ode.network.reactions[ j ], compt, net, i, lam[ j ] )
+                mm = michaelis_menten( net, i )
+                if mm is not None:
+                    f.kind = 'qssa'
+                    f.partner, f.enzyme, f.complex = mm
+                fast.append( f )
+            j += 1
+    fast.sort( key = lambda f : -f.rate )
+    logger_.info( '%d fast reactions (rate > %g/s)' % ( len( fast ), threshold ) )
+    return fast
+
+def initial_value( species ):
+    """(name, value) of N or conc of species; value is None when it is an
+    expression.
+    """
+    p = species.params[ 0 ]
+    return p.name, p.value
+
+def with_rates( reaction, kf, kb ):
+    params = [ ir.Parameter( p.name, p.value, p.expr ) for p in reaction.params
+            if p.name.lower( ) not in [ 'kf', 'kb' ] ]
+    params += [ ir.Parameter( 'kf', kf ), ir.Parameter( 'kb', kb ) ]
+    return ir.Reaction( reaction.name, reaction.substrates, reaction.substrate_stoich
+            , reaction.products, reaction.product_stoich, params )
+
+def substitute_qssa( net, original, f ):
+    """Network net (a copy of original) with enzyme of fast reaction f
+    replaced by a Michaelis-Menten reaction S -> P. Species and reactions
+    are found in net by name; net may have been changed already.
+    """
+    reactions = dict( [ ( r.name, k ) for k, r in enumerate( net.reactions ) ] )
+    j = reactions[ original.reactions[ f.index ].name ]
+    k = reactions[ original.reactions[ f.partner ].name ]
+    e = net.species_index[ original.species[ f.enzyme ].name ]
+    es = net.species_index[ original.species[ f.complex ].name ]
+    bind, cat = net.reactions[ j ], net.reactions[ k ]
+    kf1, kb1 = constant_rates( bind )
+    kcat = constant_rates( cat )[ 0 ]
+    s = [ i for i in bind.substrates if i != e ][ 0 ]
+    eName, eValue = initial_value( net.species[ e ] )
+    esName, esValue = initial_value( net.species[ es ] )
+    sName, sValue = initial_value( net.species[ s ] )
+    if eName != esName or None in [ eValue, esValue ]:
+        raise ValueError( 'QSSA of %s needs E and ES given as numbers in same units' % f.name )
+    km = ( kb1 + kcat ) / kf1
+    vmax = kcat * ( eValue + esValue )
+    sub = decompose.subnetwork( net
+            , [ i for i in range( len( net.species ) ) if i not in [ e, es ] ]
+            , [ x for x in range( len( net.reactions ) ) if x not in [ j, k ] ]
+            )
+    if esValue and sValue is not None and sName == esName:
+        # Substrate bound in ES is given back to S.
+        old = net.species[ s ]
+        sub.species[ sub.species_index[ old.name ] ] = ir.Species( old.name
+                , old.buffered, old.diffusion_constant
+                , [ ir.Parameter( sName, sValue + esValue ) ], old.record )
+    prds = [ ( sub.species_index[ net.species[ i ].name ], n )
+            for i, n in zip( cat.products, cat.product_stoich ) if i != e ]
+    sub.reactions.append( ir.Reaction( '%s_mm' % bind.name
+        , [ sub.species_index[ net.species[ s ].name ] ], [ 1 ]
+        , [ i for i, n in prds ], [ n for i, n in prds ]
+        , [ ir.Parameter( 'kf', expr = '%r/(%r+%s)' % ( vmax, km, net.species[ s ].name ) )
+            , ir.Parameter( 'kb', 0.0 ) ] ) )
+    for i in [ e, es ]:
+        if net.species[ i ].record:
+            logger_.warn( 'QSSA of %s removes recorded species %s' % (
+                f.name, net.species[ i ].name ) )
+    return sub
+
+def apply( model, approved, separation = 1e3 ):
+    """Reduced copy of model with substitutions of approved FastReactions
+    (returned by find_fast). model is not modified.
+    """
+    ode = OdeModel( model )
+    lam = relaxation_rates( ode )
+    target = separation * np.median( lam[ lam > 0 ] )
+    byNet = { }
+    for f in approved:
+        byNet.setdefault( id( f.network ), [ ] ).append( f )
+    reduced = ir.Model( model.name )
+    reduced.engine, reduced.simulator = model.engine, model.simulator
+    for compt in model.compartments:
+        c = decompose.copy_compartment( compt )
+        reduced.compartments.append( c )
+        for net in compt.networks:
+            fs = byNet.get( id( net ), [ ] )
+            new = decompose.subnetwork( net, range( len( net.species ) )
+                    , range( len( net.reactions ) ) )
+            for f in fs:
+                if f.kind != 'equilibrium':
+                    continue
+                kf, kb = constant_rates( net.reactions[ f.index ] )
+                scale = target / f.rate
+                new.reactions[ f.index ] = with_rates( net.reactions[ f.index ]
+                        , kf * scale, kb * scale )
+                logger_.info( 'Equilibrium: rates of %s scaled by %.3g' % ( f.name, scale ) )
+            # Remove enzymes last; it renumbers species and reactions.
+            for f in fs:
+                if f.kind == 'qssa':
+                    new = substitute_qssa( new, net, f )
+                    logger_.info( 'QSSA: %s replaced by Michaelis-Menten' % f.name )
+            c.networks.append( new )
+    return reduced
+
+def format_value( p ):
+    if p.value is None:
+        return '"%s"' % p.expr
+    return repr( p.value )
+
+def format_side( net, species, stoich ):
+    return ' + '.join( [ ( '%d%s' % ( n, net.species[ i ].name ) if n > 1
+        else net.species[ i ].name ) for i, n in zip( species, stoich ) ] )
+
+def yacml_text( model ):
+    """YACML text of compartment.Model model. Every network becomes a recipe
+    and every compartment a compartment declaration of its own.
+    """
+    lines = [ '/* Generated from model %s by reduction.py */' % model.name, '' ]
+    comptLines = [ ]
+    for compt in model.compartments:
+        decl = 'COMPT_%s' % compt.name
+        geometry = [ '%s = %r' % ( k, v ) for k, v in sorted( compt.geometry.items( ) )
+                if k != 'volume' ]
+        comptLines.append( 'compartment %s is %s [ %s ] has' % (
+            decl, compt.shape, ', '.join( geometry ) ) )
+        for net in compt.networks:
+            recipe = '%s_%s' % ( compt.name, net.name )
+            comptLines.append( '    %s %s;' % ( recipe, net.name ) )
+            lines.append( 'recipe %s has' % recipe )
+            for sp in net.species:
+                attrs = [ '%s = %s' % ( p.name, format_value( p ) ) for p in sp.params ]
+                if sp.diffusion_constant is not None:
+                    attrs.append( 'diffusion_constant = %r' % sp.diffusion_constant )
+                if sp.record:
+                    attrs.append( 'record = %s' % sp.record )
+                lines.append( '    %sspecies %s [ %s ];' % (
+                    'buffered ' if sp.buffered else '', sp.name, ', '.join( attrs ) ) )
+            for r in net.reactions:
+                params = [ '%s = %s' % ( p.name, format_value( p ) ) for p in r.params ]
+                lines.append( '    %s <- [ %s ] -> %s;' % (
+                    format_side( net, r.substrates, r.substrate_stoich )
+                    , ', '.join( params )
+                    , format_side( net, r.products, r.product_stoich ) ) )
+            lines += [ 'end', '' ]
+        comptLines += [ 'end', '' ]
+    lines += comptLines
+    lines.append( 'model %s has' % model.name )
+    for compt in model.compartments:
+        lines.append( '    %s %s is COMPT_%s;' % ( compt.type, compt.name, compt.name ) )
+    if model.engine:
+        attrs = [ '%s = %s' % ( k, v ) for k, v in sorted( ( model.simulator or { } ).items( ) ) ]
+        lines.append( '    simulator %s [ %s ];' % ( model.engine, ', '.join( attrs ) ) )
+    lines.append( 'end' )
+    return '\n'.join( lines ) + '\n'
+
+def compile_text( text, filename = None ):
+    """Flattened and propagated AST of YACML text.
+    """
+    tree = yp.parse_text( text, yp.ParserContext( filename ), 'fast' )
+    tree = astp.flatten( tree )
+    propagation.propagate( tree )
+    return tree
+
+def compare( model, reduced, sim_time, samples = 50, method = 'BDF' ):
+    """Run model and reduced with scipy for sim_time. Return the largest error
+    of a species (relative to its largest value) and the time of both runs.
+    """
+    result = [ ]
+    for m in [ model, reduced ]:
+        ode = OdeModel( m )
+        t0 = time.time( )
+        t, y = ode.run( sim_time, sim_time / samples, method )
+        result.append( ( ode.network.species, y, time.time( ) - t0 ) )
+    ( names, y, t1 ), ( rnames, ry, t2 ) = result
+    index = dict( [ ( n, i ) for i, n in enumerate( rnames ) ] )
+    err = 0.0
+    for i, n in enumerate( names ):
+        if n in index:
+            scale = np.abs( y[ i ] ).max( ) or 1.0
+            err = max( err, np.abs( y[ i ] - ry[ index[ n ] ] ).max( ) / scale )
+    return err, t1, t2
+
+def projected_speedup( model, reduced ):
+    """Ratio of the fastest relaxation rates of model and of reduced: the
+    speed-up of an explicit solver whose step is limited by it.
+    """
+    return relaxation_rates( OdeModel( model ) ).max( ) / relaxation_rates( OdeModel( reduced ) ).max( )
+
+def main( args ):
+    with open( args.model ) as f:
+        text = f.read( )
+    model = ir.build_model( compile_text( text, args.model ) )
+    fast = find_fast( model, args.separation )
+    print( '%d fast reactions:' % len( fast ) )
+    for f in fast:
+        print( '    %-40s %-12s %.3g/s' % ( f.name, f.kind, f.rate ) )
+    if not args.approve:
+        return
+    approved = fast if 'all' in args.approve else [ f for f in fast if f.name in args.approve ]
+    reduced = apply( model, approved, args.separation )
+    out = args.outfile or '%s_reduced' % model.name
+    redText = yacml_text( reduced )
+    with open( '%s.yacml' % out, 'w' ) as f:
+        f.write( redText )
+    # Reduced model is compiled from its text so that both outputs agree.
+    tree = compile_text( redText, '%s.yacml' % out )
+    with open( '%s.xml' % out, 'w' ) as f:
+        f.write( etree.tostring( tree, pretty_print = True ) )
+    reduced = ir.build_model( tree )
+    print( 'Wrote %s.yacml and %s.xml' % ( out, out ) )
+    print( 'Projected speed-up (fastest time scale): %.3g' % projected_speedup( model, reduced ) )
+    err, t1, t2 = compare( model, reduced, args.time )
+    print( 'Reference run of %g s: max relative error %.3g, %.3f s vs %.3f s' % (
+        args.time, err, t1, t2 ) )
+
+if __name__ == '__main__':
+    import argparse
+    argp = argparse.ArgumentParser( description = 'Fast reaction elimination' )
+    argp.add_argument( 'model', help = 'YACML model file' )
+    argp.add_argument( '--separation', '-s', default = 1e3, type = float
+            , help = 'A reaction this many times faster than the median is fast'
+            )
+    argp.add_argument( '--approve', '-a', action = 'append', default = [ ]
+            , help = 'Path of fast reaction to eliminate, or all; may be repeated'
+            )
+    argp.add_argument( '--time', '-t', default = 1.0, type = float
+            , help = 'Length of reference run (seconds)'
+            )
+    argp.add_argument( '--outfile', '-o', default = None
+            , help = 'Output name without extension (default <model>_reduced)'
+            )
+    main( argp.parse_args( ) )
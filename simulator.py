@@ -0,0 +1,78 @@
+"""simulator.py: 
+
+Simulator used by yacml2moose to build and run a model.
+
+A simulator is a module with the part of the MOOSE python API which the
+loader uses (interface_): classes of elements created by path, and functions
+to find, connect, delete and run them. Available simulators:
+
+    moose   MOOSE itself.
+    memory  memsim.py; records the elements and messages the loader creates
+            and runs nothing. Loading, profiling and tests of the load phase
+            work without a MOOSE build.
+
+The simulator is chosen by name with get( ), by simulator = 'memory' of
+yacml.loadModel or by YACML_SIMULATOR in environment (default moose). MOOSE is
+imported only when it is used.
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import importlib
+
+import config
+
+logger_ = config.logger_
+
+# Simulator name : module.
+backends_ = { 'moose' : 'moose', 'memory' : 'memsim' }
+
+# What the loader uses of a simulator.
+interface_ = [ 'Neutral', 'CubeMesh', 'CylMesh', 'Pool', 'BufPool', 'Reac'
+        , 'Function', 'Table2', 'Stoich', 'Ksolve', 'Gsolve', 'Dsolve', 'Streamer'
+        , 'element', 'exists', 'connect', 'delete', 'wildcardFind', 'setClock'
+        , 'reinit', 'start'
+        ]
+
+# Simulator in use, set by get( ).
+current_ = None
+
+# Modules which were checked against interface_.
+checked_ = { }
+
+def get( name = None ):
+    """Simulator module of name (default config.simulator_). It becomes the
+    simulator in use.
+    """
+    global current_
+    name = name or config.simulator_
+    if name not in backends_:
+        raise ValueError( 'Unknown simulator %s. Available: %s' % (
+            name, ', '.join( sorted( backends_ ) ) ) )
+    if name not in checked_:
+        try:
+            module = importlib.import_module( backends_[ name ] )
+        except ImportError as e:
+            raise ImportError( '%s. Use simulator memory (YACML_SIMULATOR=memory) '
+                    'to load models without MOOSE' % e )
+        missing = [ x for x in interface_ if not hasattr( module, x ) ]
+        if missing:
+            raise TypeError( 'Simulator %s does not have %s' % (
+                name, ', '.join( missing ) ) )
+        logger_.debug( 'Using simulator %s from %s' % ( name, module.__file__ ) )
+        checked_[ name ] = module
+    current_ = checked_[ name ]
+    return current_
+
+def current( ):
+    """Simulator in use; the default one when none was used yet.
+    """
+    return current_ or get( )
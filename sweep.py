@@ -0,0 +1,448 @@
+"""sweep.py: 
+
+Vectorized parameter sweeps on a propagated YACML AST.
+
+Constant propagation keeps the original expression of every element it
+reduces in the 'expr' attribute. A Sweep recompiles these expressions once and
+evaluates them over numpy arrays of parameter values, therefore all the points
+of a sweep are computed in one pass without touching the YACML text or
+re-parsing it. Only the elements which depend on a swept parameter are
+evaluated again.
+
+    import sweep
+    xml = yacml.loadModel( 'model.yacml' )
+    sw = sweep.Sweep( xml )
+    res = sw.evaluate( sweep.grid( kf = np.logspace( -1, 1, 10 ), radius = [ 1e-7, 2e-7 ] ) )
+    for i in range( len( res ) ):
+        sw.push( res, i )
+        moose.reinit( ); moose.start( 10 )
+
+Default output has the geometry which the loader gives to the mesh of a
+compartment (radius, length and volume of a cylinder, volume of a cube), so
+push sets a swept radius and the volume computed from it. Other parameters
+are only set in MOOSE when they are parameters of species or reactions; push
+raises ValueError for a field which it can not set.
+
+Parameters are named by their path below the model (compartment instance,
+chemical subnetwork, species or reaction, name) e.g. s1/recipeA/a/conc or by
+any trailing part of it e.g. a/conc or just conc. A name matches all elements
+with that path.
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import numpy as np
+from collections import OrderedDict
+
+import utils.xml
+import utils.helper as helper
+from config import logger_
+from yparser.expression import Expression
+from yparser.propagation import Symbol, SymbolTable
+
+# Parameters which are reported by default and pushed to MOOSE.
+output_names_ = [ 'kf', 'kb', 'numKf', 'numKb', 'conc', 'N' ]
+
+# Volume of compartment is computed from its geometry by the parser.
+volume_exprs_ = {
+        'cylinder' : 'pi * radius * radius * length'
+        , 'cube' : 'length * width * height'
+        }
+
+# Names of moose fields.
+moose_fields_ = { 'kf' : 'Kf', 'kb' : 'Kb', 'conc' : 'concInit', 'N' : 'nInit' }
+
+# Fields of mesh set by geometry parameters, as in yacml2moose.init_compartment.
+# Other shapes are loaded as a cube.
+mesh_fields_ = {
+        'cylinder' : { 'length' : [ 'x1' ], 'radius' : [ 'r0', 'r1' ], 'volume' : [ 'volume' ] }
+        , 'cube' : { 'volume' : [ 'volume' ] }
+        }
+
+def grid( *args, **axes ):
+    """Cartesian product of parameter values. Takes a dictionary or keyword
+    arguments of name : 1-D values and returns a dictionary of name : array,
+    all arrays with one entry per point.
+    """
+    if args:
+        axes = dict( args[0], **axes )
+    names = sorted( axes )
+    mesh = np.meshgrid( *[ np.asarray( axes[ n ], dtype = float ) for n in names ]
+            , indexing = 'ij'
+            )
+    return dict( [ ( n, m.ravel( ) ) for n, m in zip( names, mesh ) ] )
+
+def random_design( bounds, samples, seed = None ):
+    """samples points drawn uniformly from bounds, a dictionary of name :
+    (low, high).
+    """
+    rng = np.random.RandomState( seed )
+    return dict( [ ( n, rng.uniform( lo, hi, samples ) )
+        for n, ( lo, hi ) in sorted( bounds.items( ) ) ] )
+
+def latin_hypercube( bounds, samples, seed = None ):
+    """Latin hypercube design of samples points in bounds, a dictionary of
+    name : (low, high). Range of each parameter is split in samples equal
+    strata and every stratum is sampled exactly once.
+    """
+    rng = np.random.RandomState( seed )
+    design = { }
+    for n, ( lo, hi ) in sorted( bounds.items( ) ):
+        u = ( rng.permutation( samples ) + rng.uniform( size = samples ) ) / samples
+        design[ n ] = lo + u * ( hi - lo )
+    return design
+
+def find_field( xml, name ):
+    """Elements of AST xml with field name (a path below the model, see
+    Sweep.field_name). Elements of templates on the way are materialized in
+    the instance of recipe which is walked through.
+    """
+    found = [ xml.find( 'model' ) ]
+    for part in name.split( '/' ):
+        below = [ ]
+        for elem in found:
+            inTemplate = elem.tag == 'chemical_reaction_subnetwork' and 'template' in elem.attrib
+            children = utils.xml.subnetwork_children( elem ) if inTemplate else list( elem )
+            for c in children:
+                if c.attrib.get( 'name', c.attrib.get( 'id', c.tag ) ) != part:
+                    continue
+                if inTemplate:
+                    c = utils.xml.materialize( elem, c )
+                below.append( c )
+        found = below
+    return found
+
+def assign( xml, values ):
+    """Write values, a dictionary of field name : value (e.g. a row of the
+    result of Sweep.changes), into AST xml. An instance of a recipe gets its
+    own copy of only those elements of its template which are set. Raise
+    KeyError for a field which is not in xml.
+    """
+    for name, val in values.items( ):
+        elems = find_field( xml, name )
+        if not elems:
+            raise KeyError( 'No variable or parameter named %s in model' % name )
+        for elem in elems:
+            elem.text = repr( float( val ) )
+            elem.attrib[ 'is_reduced' ] = 'true'
+
+class InstanceSymbol( Symbol ):
+    """Symbol of an element as seen from an instance of a recipe, net. The
+    element is shared by all instances in the template of net until one of
+    them materializes it (see utils.xml.materialize). net is None for elements
+    which are not part of a template.
+    """
+    __slots__ = [ 'net' ]
+
+    def __init__( self, elem, net = None ):
+        Symbol.__init__( self, elem )
+        self.net = net
+
+    def path( self ):
+        names = [ ]
+        elem = self.elem
+        while elem is not None:
+            if self.net is not None and elem.getparent( ) is self.net.getparent( ) \
+                    and elem.tag == 'recipe':
+                # Template of net.
+                elem = self.net
+            names.append( elem.attrib.get( 'name', elem.attrib.get( 'id', elem.tag ) ) )
+            elem = elem.getparent( )
+        return '/'.join( reversed( names ) )
+
+class SweepTable( SymbolTable ):
+    """Symbol table of a propagated AST. Every instance of a recipe has its
+    own symbols, also of elements which are still in the template. A scope is
+    an element, or ( net, element ) for an element of the template of net.
+    Dependencies are found in original expressions of elements.
+    """
+
+    def __init__( self, root ):
+        self.root = root
+        self.scopes = { }
+        self.symbols = [ ]
+        templates = set( )
+        for net in root.iter( 'chemical_reaction_subnetwork' ):
+            if 'template' in net.attrib:
+                templates.add( utils.xml.template_of( net ) )
+        for elem in root.iter( 'variable', 'parameter', 'chemical_reaction_subnetwork' ):
+            if elem.tag == 'chemical_reaction_subnetwork':
+                if 'template' in elem.attrib:
+                    for c in utils.xml.subnetwork_children( elem ):
+                        if c.getparent( ) is not elem:
+                            for e in c.iter( 'variable', 'parameter' ):
+                                self.add( InstanceSymbol( e, elem ) )
+                continue
+            if any( [ a in templates for a in elem.iterancestors( 'recipe' ) ] ):
+                continue
+            self.add( InstanceSymbol( elem ) )
+        for sym in self.symbols:
+            self.resolve_deps( sym )
+
+    def add( self, sym ):
+        self.symbols.append( sym )
+        scope = self.defining_scope( sym.elem )
+        if scope is not None:
+            self.scopes.setdefault( self.scope_key( scope, sym.net ), { } )[ sym.name ] = sym
+
+    def scope_key( self, scope, net ):
+        if net is None or scope.getparent( ) is None:
+            return scope
+        if scope.tag == 'recipe' and scope.getparent( ) is net.getparent( ):
+            # Template of net; materialized elements have net as scope.
+            return net
+        return ( net, scope )
+
+    def lookup( self, name, scope, exclude = None, net = None ):
+        while scope is not None:
+            sym = self.scopes.get( self.scope_key( scope, net ), { } ).get( name )
+            if sym is not None and sym is not exclude:
+                return sym
+            if net is not None and self.scope_key( scope, net ) is net:
+                # Continue from net, outside of template.
+                scope, net = net, None
+            scope = scope.getparent( )
+        return None
+
+    def resolve_deps( self, sym ):
+        text = self.expression( sym )
+        if not text:
+            return
+        scope = sym.elem.getparent( )
+        if scope is not None and scope.tag == 'geometry':
+            scope = scope.getparent( )
+        for iden in set( helper.get_ids( text ) ):
+            dep = self.lookup( iden, scope, exclude = sym, net = sym.net )
+            if dep is not None:
+                sym.deps[ iden ] = dep
+
+    def expression( self, sym ):
+        elem = sym.elem
+        if 'expr' in elem.attrib:
+            return elem.attrib[ 'expr' ]
+        parent = elem.getparent( )
+        if sym.name == 'volume' and 'is_reduced' not in elem.attrib \
+                and parent is not None and parent.tag == 'geometry':
+            return volume_exprs_.get( parent.attrib.get( 'shape' ) )
+        return None
+
+class Sweep( object ):
+    """Parameter sweep over a propagated AST. Every instance of a recipe can
+    be swept on its own. The AST is not modified, except by assign, which
+    materializes only the elements of instances which it sets.
+    """
+
+    def __init__( self, xml ):
+        self.xml = xml
+        self.model = xml.find( 'model' )
+        assert self.model is not None, 'AST has no model'
+        self.table = SweepTable( xml )
+        self.order = self.table.topological_order( )
+        self.by_field = { }
+        for sym in self.table.symbols:
+            self.by_field.setdefault( self.field_name( sym ), [ ] ).append( sym )
+        self.compiled = { }
+        # Subnetwork : { declaration id : reactions }, see reaction_instances.
+        self.instances = { }
+
+    def field_name( self, sym ):
+        """Path of sym below the model element.
+        """
+        return '/'.join( sym.path( ).split( '/' )[ 2: ] )
+
+    def select( self, key ):
+        """Symbols named by key: a path below the model or a trailing part of
+        it.
+        """
+        syms = [ ]
+        for field, fsyms in self.by_field.items( ):
+            if field == key or field.endswith( '/' + key ):
+                syms += fsyms
+        if not syms:
+            raise KeyError( 'No variable or parameter named %s in model' % key )
+        return syms
+
+    def compile( self, text ):
+        code = self.compiled.get( text )
+        if code is None:
+            code = self.compiled[ text ] = Expression( text, vectorized = True )
+        return code
+
+    def outputs( self ):
+        """Default output: parameters of species and reactions, and geometry
+        of meshes.
+        """
+        return [ sym for sym in self.table.symbols if sym.elem.tag == 'parameter'
+                and ( sym.name in output_names_ or self.mesh_fields( sym ) ) ]
+
+    def mesh_fields( self, sym ):
+        """Fields of mesh set by sym, empty if it is not geometry.
+        """
+        parent = sym.elem.getparent( )
+        if parent is None or parent.tag != 'geometry':
+            return [ ]
+        shape = parent.attrib.get( 'shape' )
+        return mesh_fields_.get( shape, mesh_fields_[ 'cube' ] ).get( sym.name, [ ] )
+
+    def propagate( self, points ):
+        """Values of swept parameters and of all elements which depend on
+        them, at points.
+
+        :return Number of points and dictionary of Symbol : array (or scalar).
+        """
+        arrays = dict( [ ( k, np.asarray( v, dtype = float ) ) for k, v in points.items( ) ] )
+        npoints = max( [ a.size for a in arrays.values( ) ] + [ 1 ] )
+        for k, a in arrays.items( ):
+            if a.size not in ( 1, npoints ):
+                raise ValueError( 'Parameter %s has %d values, expected %d' % (
+                    k, a.size, npoints ) )
+
+        swept = { }
+        for key, arr in arrays.items( ):
+            for sym in self.select( key ):
+                swept[ sym ] = arr
+
+        # Values of elements which depend on a swept parameter.
+        values = { }
+        for sym in self.order:
+            if sym in swept:
+                values[ sym ] = swept[ sym ]
+                continue
+            if not any( [ d in values for d in sym.deps.values( ) ] ):
+                continue
+            mapping = { }
+            for iden, dep in sym.deps.items( ):
+                mapping[ iden ] = values.get( dep, dep.value )
+            code = self.compile( self.table.expression( sym ) )
+            if any( [ v is None for v in mapping.values( ) ] ) \
+                    or not code.names.issubset( mapping ):
+                # Depends on species or time; it stays a moose.Function.
+                logger_.debug( 'Sweep: %s is not a constant' % self.field_name( sym ) )
+                continue
+            values[ sym ] = code( mapping )
+        return npoints, values
+
+    def table_of( self, npoints, columns ):
+        result = np.zeros( npoints, dtype = [ ( f, 'f8' ) for f in columns ] )
+        for f, val in columns.items( ):
+            result[ f ] = val
+        return result
+
+    def evaluate( self, points, fields = None ):
+        """Evaluate model over points.
+
+        :param points: Dictionary of parameter name : array. Arrays must have
+            the same length (or be scalars); use grid( ) for a cartesian
+            product.
+        :param fields: Names of variables/parameters to report. Default is
+            all kf, kb, numKf, numKb, conc and N parameters and the geometry of
+            meshes.
+
+        :return Structured array with one row per point and one float field
+            per reported element, named by its path.
+        """
+        npoints, values = self.propagate( points )
+        if fields is None:
+            syms = self.outputs( )
+        else:
+            syms = sum( [ self.select( f ) for f in fields ], [ ] )
+
+        columns = OrderedDict( )
+        for sym in syms:
+            if sym in values:
+                columns[ self.field_name( sym ) ] = values[ sym ]
+            elif sym.value is not None:
+                columns[ self.field_name( sym ) ] = sym.value
+        return self.table_of( npoints, columns )
+
+    def changes( self, points ):
+        """Like evaluate, but reports exactly the swept parameters and every
+        element computed from them, e.g. volume of a swept radius. assign of a
+        row of the result gives the AST of that point.
+        """
+        npoints, values = self.propagate( points )
+        columns = OrderedDict( )
+        for sym in self.order:
+            if sym in values:
+                columns[ self.field_name( sym ) ] = values[ sym ]
+        return self.table_of( npoints, columns )
+
+    def assign( self, values ):
+        """Write values, a dictionary of field name : value (e.g. a row of the
+        result of evaluate), into the AST, see assign( ). Loading the AST
+        afterwards builds the model of that point.
+        """
+        assign( self.xml, values )
+        for name, val in values.items( ):
+            for sym in self.by_field[ name ]:
+                sym.value, sym.reduced = float( val ), True
+
+    def targets( self, sym ):
+        """MOOSE paths (relative to model) and field names set by sym. The
+        path of the parent of sym in MOOSE is its field name without the last
+        part.
+        """
+        elem, field = sym.elem, moose_fields_.get( sym.name, sym.name )
+        parent = elem.getparent( )
+        if parent is None or elem.tag != 'parameter':
+            return [ ]
+        path = self.field_name( sym ).rsplit( '/', 1 )[ 0 ]
+        if parent.tag == 'geometry':
+            compt = path.rsplit( '/', 1 )[ 0 ]
+            return [ ( compt, f ) for f in self.mesh_fields( sym ) ]
+        if parent.tag in ( 'species', 'reaction' ):
+            return [ ( path, field ) ]
+        if parent.tag == 'reaction_declaration':
+            # All reactions of subnetwork which are instances of declaration.
+            net = sym.net if sym.net is not None else parent.getparent( )
+            netPath = path.rsplit( '/', 1 )[ 0 ]
+            return [ ( '%s/%s' % ( netPath, r.attrib[ 'name' ] ), field )
+                    for r in self.reaction_instances( net ).get( parent.attrib[ 'id' ], [ ] ) ]
+        return [ ]
+
+    def reaction_instances( self, net ):
+        """Map declaration id to reactions of net which are its instances,
+        built once per net.
+        """
+        found = self.instances.get( net )
+        if found is None:
+            found = self.instances[ net ] = { }
+            for r in utils.xml.subnetwork_children( net ):
+                if r.tag == 'reaction' and 'instance_of' in r.attrib:
+                    found.setdefault( r.attrib[ 'instance_of' ], [ ] ).append( r )
+        return found
+
+    def push( self, result, index, root = None ):
+        """Set parameters of point index of result (returned by evaluate) into
+        the model already loaded in MOOSE. Call moose.reinit( ) afterwards.
+        Meshes are set before pools, as a mesh scales pools in it when its
+        volume changes.
+
+        :param root: Path of model in MOOSE, default /yacml/<model name>.
+        """
+        import simulator
+        moose = simulator.current( )
+        if root is None:
+            root = '/yacml/%s' % self.model.attrib[ 'name' ]
+        row = result[ index ]
+        meshes, others = [ ], [ ]
+        for name in result.dtype.names:
+            found = False
+            for sym in self.by_field[ name ]:
+                for path, field in self.targets( sym ):
+                    found = True
+                    dest = meshes if self.mesh_fields( sym ) else others
+                    dest.append( ( path, field, float( row[ name ] ) ) )
+            if not found:
+                raise ValueError( '%s is not a parameter of species, reaction or '
+                        'mesh; it can not be set in MOOSE' % name )
+        for path, field, value in meshes + others:
+            moose.element( '%s/%s' % ( root, path ) ).setField( field, value )
@@ -0,0 +1,336 @@
+"""sweep_runner.py: 
+
+Run a YACML model at many parameter points, each point in its own worker
+process with its own MOOSE instance.
+
+The model is parsed, flattened and propagated once. Parameter values of all
+points are computed in one pass by sweep.Sweep; a worker writes the values of
+its point into the AST, loads it into MOOSE and runs it. The vectors of all
+recorded tables are sent back and appended to one tab separated file as soon
+as the point finishes:
+
+    point  step  <parameters ...>  <tables ...>
+
+Besides the swept parameters, a worker gets every value computed from them
+(e.g. volume of a swept radius, see sweep.Sweep.changes).
+
+A manifest (manifest.json) in the output directory records the design and the
+finished and failed points. A sweep which was interrupted is continued with
+--resume; finished points are not run again. The design is taken from the
+manifest, so --param is not needed and a random or lhs design without --seed
+resumes with the same points. A worker which crashes or times out marks only
+its point as failed.
+
+Usage:
+
+    python sweep_runner.py model.yacml --param kf=0.1,1,10 --param radius=1e-7:2e-7:3
+    python sweep_runner.py model.yacml --design lhs --samples 100 --param kf=0.1:10 --jobs 8
+    python sweep_runner.py model.yacml --resume
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import traceback
+import multiprocessing
+
+import numpy as np
+import lxml.etree as etree
+
+import sweep
+import yacml
+import yacml2moose
+from config import logger_
+
+designs_ = [ 'grid', 'random', 'lhs' ]
+
+def parse_param( spec ):
+    """Parse name=v1,v2,... (list of values), name=lo:hi:n (n values from lo
+    to hi) or name=lo:hi (bounds for random and lhs designs).
+    """
+    name, _, val = spec.partition( '=' )
+    if not name or not val:
+        raise ValueError( 'Expected name=values, got %s' % spec )
+    if ':' in val:
+        fs = val.split( ':' )
+        if len( fs ) == 3:
+            return name, np.linspace( float( fs[0] ), float( fs[1] ), int( fs[2] ) )
+        if len( fs ) == 2:
+            return name, ( float( fs[0] ), float( fs[1] ) )
+        raise ValueError( 'Expected lo:hi or lo:hi:n, got %s' % val )
+    return name, np.array( [ float( x ) for x in val.split( ',' ) ] )
+
+def make_design( params, design = 'grid', samples = None, seed = None ):
+    """Dictionary of name : array with one value per point.
+
+    :param params: Dictionary of name : values (grid) or (lo, hi) (random and
+        lhs) as returned by parse_param.
+    """
+    assert design in designs_, 'Unknown design %s' % design
+    if design == 'grid':
+        for n, v in params.items( ):
+            if isinstance( v, tuple ):
+                raise ValueError( 'Grid needs values of %s, e.g. %s=lo:hi:n' % ( n, n ) )
+        return sweep.grid( params )
+
+    assert samples, 'Number of samples is required for %s design' % design
+    bounds = { }
+    for n, v in params.items( ):
+        bounds[ n ] = v if isinstance( v, tuple ) else ( min( v ), max( v ) )
+    if design == 'random':
+        return sweep.random_design( bounds, samples, seed )
+    return sweep.latin_hypercube( bounds, samples, seed )
+
+def load_point( xml_text, values, simulator = None ):
+    """Load the model with values (a row of sweep.Sweep.changes) into
+    simulator and run it. Return the LoadContext.
+    """
+    xml = etree.fromstring( xml_text )
+    sweep.assign( xml, values )
+    context = yacml2moose.LoadContext( )
+    yacml2moose.load( xml, context, propagate = False, simulator = simulator )
+    return context
+
+def run_point( xml_text, values, workdir, conn ):
+    """Body of a worker process. Load the model with values into MOOSE, run
+    it and send back vectors of recorded tables.
+    """
+    try:
+        # MOOSE writes its output files in current directory.
+        os.chdir( workdir )
+        context = load_point( xml_text, values )
+        tables = [ ( t.columnName, np.asarray( t.vector, dtype = float ) )
+                for t in context.tables ]
+        conn.send( ( True, tables ) )
+    except Exception as e:
+        conn.send( ( False, traceback.format_exc( ) ) )
+    finally:
+        conn.close( )
+
+class SweepRunner( object ):
+    """Run model file at all points of design (dictionary of name : array) and
+    collect results in outdir. When resuming, design is taken from the
+    manifest and can be None.
+    """
+
+    def __init__( self, model_file, design, outdir, jobs = None, timeout = None ):
+        self.model_file = model_file
+        self.design = None
+        if design:
+            self.set_design( design )
+        self.outdir = outdir
+        self.jobs = jobs or multiprocessing.cpu_count( )
+        self.timeout = timeout
+        self.manifest_file = os.path.join( outdir, 'manifest.json' )
+        self.result_file = os.path.join( outdir, 'results.tsv' )
+        self.manifest = None
+
+    def set_design( self, design ):
+        self.design = dict( [ ( k, np.asarray( v, dtype = float ) ) for k, v in design.items( ) ] )
+        self.names = sorted( self.design )
+        self.npoints = max( [ v.size for v in self.design.values( ) ] )
+
+    def new_manifest( self, text ):
+        return { 'model' : os.path.abspath( self.model_file )
+                , 'model_sha1' : hashlib.sha1( text.encode( 'utf-8' ) ).hexdigest( )
+                , 'design' : dict( [ ( k, v.tolist( ) ) for k, v in self.design.items( ) ] )
+                , 'points' : self.npoints
+                , 'columns' : None
+                , 'done' : [ ]
+                , 'failed' : { }
+                }
+
+    def save_manifest( self ):
+        # Write and rename so that an interrupted sweep never leaves a partial
+        # manifest behind.
+        fd, tmp = tempfile.mkstemp( dir = self.outdir, suffix = '.tmp' )
+        with os.fdopen( fd, 'w' ) as f:
+            json.dump( self.manifest, f, indent = 1 )
+        os.rename( tmp, self.manifest_file )
+
+    def load_manifest( self, text, resume ):
+        if not os.path.exists( self.manifest_file ):
+            if self.design is None:
+                raise ValueError( 'No design and no sweep to resume in %s' % self.outdir )
+            self.manifest = self.new_manifest( text )
+            return
+        if not resume:
+            raise RuntimeError( '%s exists. Use resume or another output directory'
+                    % self.manifest_file )
+        with open( self.manifest_file ) as f:
+            old = json.load( f )
+        if old[ 'model_sha1' ] != hashlib.sha1( text.encode( 'utf-8' ) ).hexdigest( ):
+            raise ValueError( 'Can not resume: model_sha1 of sweep has changed' )
+        # Points are those of the manifest; a random design can not be drawn
+        # again without its seed.
+        if self.design is not None and self.new_manifest( text )[ 'design' ] != old[ 'design' ]:
+            logger_.warn( 'Design differs from the one in %s; resuming with the latter'
+                    % self.manifest_file )
+        self.set_design( old[ 'design' ] )
+        self.manifest = old
+        # Failed points are run again.
+        for f in old[ 'failed' ].values( ):
+            shutil.rmtree( f[ 'workdir' ], ignore_errors = True )
+        self.manifest[ 'failed' ] = { }
+        self.keep_done_rows( )
+        logger_.info( 'Resuming sweep, %d of %d points are done' % (
+            len( old[ 'done' ] ), self.npoints )
+            )
+
+    def keep_done_rows( self ):
+        """Drop rows of points which are not marked done e.g. rows written just
+        before an interruption.
+        """
+        if not os.path.exists( self.result_file ):
+            return
+        done = set( [ str( i ) for i in self.manifest[ 'done' ] ] )
+        fd, tmp = tempfile.mkstemp( dir = self.outdir, suffix = '.tmp' )
+        with open( self.result_file ) as src, os.fdopen( fd, 'w' ) as dst:
+            for i, line in enumerate( src ):
+                if i == 0 or line.split( '\t', 1 )[0] in done:
+                    dst.write( line )
+        os.rename( tmp, self.result_file )
+
+    def write_rows( self, index, tables ):
+        if self.manifest[ 'columns' ] is None:
+            self.manifest[ 'columns' ] = [ name for name, _ in tables ]
+            with open( self.result_file, 'w' ) as f:
+                f.write( '\t'.join( [ 'point', 'step' ] + self.names
+                    + self.manifest[ 'columns' ] ) + '\n'
+                    )
+        vecs = dict( tables )
+        columns = self.manifest[ 'columns' ]
+        nsteps = max( [ len( v ) for v in vecs.values( ) ] + [ 0 ] )
+        params = [ repr( float( self.design[ n ][ index % self.design[ n ].size ] ) )
+                for n in self.names ]
+        with open( self.result_file, 'a' ) as f:
+            for step in range( nsteps ):
+                row = [ str( index ), str( step ) ] + params
+                for c in columns:
+                    v = vecs.get( c, [ ] )
+                    row.append( repr( float( v[ step ] ) ) if step < len( v ) else 'nan' )
+                f.write( '\t'.join( row ) + '\n' )
+
+    def finish( self, index, ok, payload, workdir ):
+        if ok:
+            self.write_rows( index, payload )
+            self.manifest[ 'done' ].append( index )
+            shutil.rmtree( workdir, ignore_errors = True )
+            logger_.info( 'Point %d finished' % index )
+        else:
+            # Keep working directory of a failed point for inspection.
+            self.manifest[ 'failed' ][ str( index ) ] = { 'error' : payload
+                    , 'workdir' : workdir }
+            logger_.warn( 'Point %d failed: %s' % ( index, payload ) )
+        self.save_manifest( )
+
+    def run( self, resume = False ):
+        """Run all points which are not done. Return the manifest.
+        """
+        if not os.path.isdir( self.outdir ):
+            os.makedirs( self.outdir )
+        with open( self.model_file ) as f:
+            text = f.read( )
+        self.load_manifest( text, resume )
+        self.save_manifest( )
+
+        xml = yacml.compile_model( self.model_file, text )
+        xmlText = etree.tostring( xml )
+        res = sweep.Sweep( xml ).changes( self.design )
+
+        done = set( self.manifest[ 'done' ] )
+        pending = [ i for i in range( self.npoints ) if i not in done ]
+        running = { }
+        logger_.info( 'Running %d points in %d processes' % ( len( pending ), self.jobs ) )
+        while pending or running:
+            while pending and len( running ) < self.jobs:
+                i = pending.pop( 0 )
+                values = dict( [ ( n, float( res[ n ][ i ] ) ) for n in res.dtype.names ] )
+                workdir = tempfile.mkdtemp( prefix = 'point%d_' % i, dir = self.outdir )
+                recv, send = multiprocessing.Pipe( False )
+                p = multiprocessing.Process( target = run_point
+                        , args = ( xmlText, values, workdir, send )
+                        )
+                p.start( )
+                send.close( )
+                running[ i ] = ( p, recv, time.time( ), workdir )
+
+            busy = True
+            for i, ( p, recv, started, workdir ) in list( running.items( ) ):
+                if recv.poll( ):
+                    try:
+                        ok, payload = recv.recv( )
+                    except EOFError:
+                        ok, payload = False, 'Worker exited with code %s' % p.exitcode
+                    p.join( )
+                elif not p.is_alive( ):
+                    if recv.poll( ):
+                        continue
+                    ok, payload = False, 'Worker exited with code %s' % p.exitcode
+                elif self.timeout and time.time( ) - started > self.timeout:
+                    p.terminate( )
+                    p.join( )
+                    ok, payload = False, 'Timed out after %s seconds' % self.timeout
+                else:
+                    continue
+                busy = False
+                recv.close( )
+                del running[ i ]
+                self.finish( i, ok, payload, workdir )
+            if busy:
+                time.sleep( 0.05 )
+
+        logger_.info( 'Sweep done: %d points done, %d failed' % (
+            len( self.manifest[ 'done' ] ), len( self.manifest[ 'failed' ] ) )
+            )
+        return self.manifest
+
+def main( args ):
+    params = dict( [ parse_param( p ) for p in args.param or [ ] ] )
+    if not params and not args.resume:
+        raise SystemExit( 'At least one --param is required' )
+    design = make_design( params, args.design, args.samples, args.seed ) if params else None
+    runner = SweepRunner( args.model, design, args.outdir, args.jobs, args.timeout )
+    manifest = runner.run( resume = args.resume )
+    print( 'Done %d of %d points, %d failed. Results are in %s' % (
+        len( manifest[ 'done' ] ), manifest[ 'points' ]
+        , len( manifest[ 'failed' ] ), runner.result_file )
+        )
+
+if __name__ == '__main__':
+    import argparse
+    argp = argparse.ArgumentParser( description = 'Parameter sweep of a YACML model' )
+    argp.add_argument( 'model', help = 'YACML model file' )
+    argp.add_argument( '--param', '-p', action = 'append'
+            , help = 'name=v1,v2,.. or name=lo:hi:n or name=lo:hi (random/lhs). '
+                'Not needed with --resume'
+            )
+    argp.add_argument( '--design', '-d', default = 'grid', choices = designs_ )
+    argp.add_argument( '--samples', '-n', default = None, type = int
+            , help = 'Number of points of random and lhs designs'
+            )
+    argp.add_argument( '--seed', default = None, type = int )
+    argp.add_argument( '--jobs', '-j', default = None, type = int
+            , help = 'Number of worker processes (default: number of cpus)'
+            )
+    argp.add_argument( '--timeout', default = None, type = float
+            , help = 'Seconds after which a point is killed'
+            )
+    argp.add_argument( '--outdir', '-o', default = 'sweep_out' )
+    argp.add_argument( '--resume', action = 'store_true'
+            , help = 'Continue the sweep in outdir'
+            )
+    main( argp.parse_args( ) )
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""soak_sessions.py: 
+
+Load many models one after another in one process with yacml.loadModel. Each
+model must get only its own species and tables, and resident memory must stay
+flat once the process has warmed up.
+
+Models are loaded into the in-memory simulator unless YACML_SIMULATOR is set,
+e.g. YACML_SIMULATOR=moose to soak MOOSE itself.
+
+Run from top-level directory:
+
+    python test/soak_sessions.py --models 1000
+
+"""
+
+import os
+import sys
+import shutil
+import resource
+import argparse
+import tempfile
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+
+os.environ.setdefault( 'YACML_SIMULATOR', 'memory' )
+
+import yacml
+import simulator
+
+def rss_mb( ):
+    """Current resident memory in MB (peak on systems without /proc).
+    """
+    try:
+        with open( '/proc/self/statm' ) as f:
+            pages = int( f.read( ).split( )[1] )
+        return pages * resource.getpagesize( ) / 1024.0 / 1024.0
+    except IOError:
+        return resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss / 1024.0
+
+def model_text( i ):
+    """Model i has its own name and i % 7 + 2 species, all recorded.
+    """
+    n = i % 7 + 2
+    lines = [ 'recipe R has' ]
+    for j in range( n ):
+        lines.append( '    species s%d [ conc = %g, record = N ];' % ( j, 1e-3 * ( i + 1 ) ) )
+    for j in range( 1, n ):
+        lines.append( '    s%d <- [ kf = 1, kb = 0.1 ] -> s%d;' % ( j - 1, j ) )
+    lines += [ 'end'
+            , 'compartment C is'
+            , '    cube [ length = 1e-6, width = 1e-6, height = 1e-6 ]'
+            , 'has'
+            , '    R net;'
+            , 'end'
+            , 'model M%d has' % i
+            , '    c is C;'
+            , '    simulator moose [ sim_time = 0.01 ];'
+            , 'end'
+            ]
+    return n, '\n'.join( lines )
+
+def main( args ):
+    workdir = tempfile.mkdtemp( prefix = 'yacml_soak_' )
+    cwd = os.getcwd( )
+    os.chdir( workdir )
+    samples = [ ]
+    try:
+        for i in range( args.models ):
+            n, text = model_text( i )
+            filename = 'm%d.yacml' % ( i % 10 )
+            with open( filename, 'w' ) as f:
+                f.write( text )
+            yacml.loadModel( filename, cache = False )
+            sim = simulator.current( )
+            tables = yacml.session_.tables
+            assert len( tables ) == n, 'Model %d has %d tables, expected %d' % ( 
+                    i, len( tables ), n )
+            pools = sim.wildcardFind( '/yacml/##[TYPE=Pool]' )
+            assert len( pools ) == n, 'Model %d has %d pools, expected %d' % ( 
+                    i, len( pools ), n )
+            assert sim.exists( '/yacml/M%d' % i )
+            assert not sim.exists( '/yacml/M%d' % ( i - 1 ) )
+            if i == args.warmup or i == args.models - 1:
+                samples.append( ( i + 1, rss_mb( ) ) )
+        yacml.session_.dispose( )
+        assert not simulator.current( ).exists( '/yacml' )
+    finally:
+        os.chdir( cwd )
+        shutil.rmtree( workdir, ignore_errors = True )
+
+    for i, rss in samples:
+        print( 'After %5d models: RSS %.1f MB' % ( i, rss ) )
+    growth = samples[-1][1] - samples[0][1]
+    assert growth < args.max_growth, 'RSS grew by %.1f MB' % growth
+    print( '[PASSED] RSS grew by %.1f MB over %d models' % ( growth, args.models ) )
+
+if __name__ == '__main__':
+    argp = argparse.ArgumentParser( description = 'Soak test of loadModel' )
+    argp.add_argument( '--models', default = 1000, type = int )
+    argp.add_argument( '--warmup', default = 100, type = int
+            , help = 'Models loaded before the first memory sample'
+            )
+    argp.add_argument( '--max_growth', default = 10.0, type = float
+            , help = 'Largest allowed growth of RSS after warmup (MB)'
+            )
+    main( argp.parse_args( ) )
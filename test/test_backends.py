@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""test_backends.py:
+
+Simulate small models with the backends which need no MOOSE (scipy, ssa).
+
+Run from top-level directory:
+
+    python test/test_backends.py
+
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+
+import numpy as np
+import yacml
+import ensemble
+
+# c and d are given by expressions.
+expr_model_ = '''
+recipe R has
+    species a [ conc = 1e-3, record = conc ];
+    species b [ conc = 0, record = conc ];
+    species c [ conc = "a + 2 * b", record = conc ];
+    species d [ conc = "1e-3 * t", record = conc ];
+    a <- [ kf = 1, kb = 0.5 ] -> b;
+    b + d <- [ kf = 10, kb = 0 ] -> c;
+end
+
+compartment C is
+    cube [ length = 1e-6, width = 1e-6, height = 1e-6 ]
+has
+    R net;
+end
+
+model EXPR has
+    c is C;
+    simulator %s [ sim_time = 5, record_dt = 1 ];
+end
+'''
+
+def in_tmpdir( text, run ):
+    """Write model text to a file in a temporary directory and return
+    run( filename ) called there.
+    """
+    cwd, tmp = os.getcwd( ), tempfile.mkdtemp( )
+    try:
+        os.chdir( tmp )
+        with open( 'model.yacml', 'w' ) as f:
+            f.write( text )
+        return run( 'model.yacml' )
+    finally:
+        os.chdir( cwd )
+        shutil.rmtree( tmp )
+
+def load( text ):
+    """Load model text and return its tables by column name.
+    """
+    in_tmpdir( text, lambda f : yacml.loadModel( f, save_output = False ) )
+    return dict( [ ( t.columnName, np.array( t.vector ) ) for t in yacml.session_.tables ] )
+
+def expect_value_error( run, *names ):
+    """run( ) must raise ValueError which mentions all names.
+    """
+    try:
+        run( )
+    except ValueError as e:
+        for n in names:
+            assert n in str( e ), ( n, str( e ) )
+        return str( e )
+    raise AssertionError( 'No ValueError' )
+
+def test_species_expressions( ):
+    tables = load( expr_model_ % 'scipy' )
+    a, b, c, d = [ tables[ 'net.%s.conc' % x ] for x in 'abcd' ]
+    assert np.allclose( c, a + 2 * b ), ( a, b, c )
+    assert np.allclose( d, 1e-3 * np.arange( len( d ) ) ), d
+    # b is consumed by d, which it could not be if d stayed 0.
+    assert b[ -1 ] < a[ 0 ] - a[ -1 ], ( a, b )
+    print( '[PASSED] species expressions with scipy' )
+
+def test_ssa_rejects_expressions( ):
+    expect_value_error( lambda : load( expr_model_ % 'ssa' ), 'c/net/c', 'c/net/d' )
+    rates = expr_model_.replace( 'kf = 1, kb = 0.5', 'kf = "0.1 * t", kb = 0.5' )
+    rates = rates.replace( '"a + 2 * b"', '0' ).replace( '"1e-3 * t"', '1e-3' )
+    expect_value_error( lambda : load( rates % 'ssa' ), 'c/net/a<-->b' )
+    # Ensemble fails before starting worker processes.
+    expect_value_error( lambda : in_tmpdir( expr_model_ % 'ssa'
+        , lambda f : ensemble.Ensemble( f, 4, jobs = 2 ).run( ) ), 'c/net/c' )
+    print( '[PASSED] ssa rejects expressions' )
+
+if __name__ == '__main__':
+    test_species_expressions( )
+    test_ssa_rejects_expressions( )
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+"""test_bench_scaling.py: 
+
+Smoke run of benchmarks/bench_scaling.py with every solver on the smallest
+size, the way it is run from the top-level directory (python -m). The moose
+solver uses the in-memory simulator (memsim.py), which needs no MOOSE.
+
+Run from top-level directory:
+
+    python test/test_bench_scaling.py
+
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+
+topDir_ = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+
+def run( solver ):
+    outdir = tempfile.mkdtemp( prefix = 'yacml_bench_test_' )
+    outfile = os.path.join( outdir, 'history.json' )
+    try:
+        subprocess.check_call( [ sys.executable, '-m', 'benchmarks.bench_scaling', 'run'
+            , '--sizes', '1,2', '--repeat', '1', '--solver', solver
+            , '--simulator', 'memory', '-o', outfile ], cwd = topDir_ )
+        with open( outfile ) as f:
+            record = json.load( f )
+    finally:
+        shutil.rmtree( outdir )
+    assert [ r[ 'size' ] for r in record[ 'results' ] ] == [ 1, 2 ], record
+    for r in record[ 'results' ]:
+        assert r[ 'stages' ].get( 'parse' ) is not None, r
+    print( '[PASSED] bench_scaling %s' % solver )
+
+def main( ):
+    for solver in [ 'moose', 'scipy', 'ssa' ]:
+        run( solver )
+
+if __name__ == '__main__':
+    main( )
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""test_memsim.py: 
+
+Load models into the in-memory simulator (memsim.py), which needs no MOOSE,
+and check the elements and messages created by the loader.
+
+Run from top-level directory:
+
+    python test/test_memsim.py
+
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+
+import yacml
+import memsim
+from yparser import expression
+from benchmarks.generator import scaling_model
+
+testDir_ = os.path.dirname( os.path.abspath( __file__ ) )
+
+def load( filename, text = None ):
+    """Load a copy of filename, or text saved as filename, in a temporary
+    working directory which is removed afterwards with the files the loader
+    writes (XML, graphviz).
+    """
+    cwd, tmp = os.getcwd( ), tempfile.mkdtemp( )
+    model = os.path.join( tmp, os.path.basename( filename ) )
+    if text is None:
+        shutil.copy( filename, model )
+    else:
+        with open( model, 'w' ) as f:
+            f.write( text )
+    try:
+        os.chdir( tmp )
+        yacml.loadModel( os.path.basename( model ), solver = 'moose'
+                , simulator = 'memory', save_output = False )
+    finally:
+        os.chdir( cwd )
+        shutil.rmtree( tmp )
+    return memsim.summary( )
+
+def test_small_reaction( ):
+    counts = load( os.path.join( testDir_, 'small_reaction.yacml' ) )
+    assert counts[ 'Pool' ] == 2, counts
+    assert counts[ 'Reac' ] == 1, counts
+    assert counts[ 'Gsolve' ] == 1, counts
+    reac = memsim.wildcardFind( '/yacml/##[TYPE=Reac]' )[ 0 ]
+    # 3a <- r_a_to_b -> 2b
+    assert len( reac.neighbors[ 'sub' ] ) == 3, reac.neighbors
+    assert len( reac.neighbors[ 'prd' ] ) == 2, reac.neighbors
+    assert reac.Kf == 10 and reac.Kb == 10
+    print( '[PASSED] small_reaction %s' % dict( counts ) )
+
+def test_generated( ):
+    counts = load( 'generated.yacml', scaling_model( 3, 5, 8, 2, 2, 0.5 ) )
+    assert counts[ 'Pool' ] == 3 * 5 * 2, counts
+    assert counts[ 'Reac' ] == 3 * 8 * 2, counts
+    assert counts[ 'messages' ] > 0, counts
+    assert counts[ 'Gsolve' ] == 1 and counts[ 'Ksolve' ] == 1, counts
+    print( '[PASSED] generated %s' % dict( counts ) )
+
+# Names which are prefixes of each other, and tau which starts with t.
+functions_model_ = '''
+recipe R has
+    species a [ conc = 1e-3 ];
+    species ab [ conc = 2e-3 ];
+    species tau [ conc = 0 ];
+    species c [ conc = "a + 2 * ab + tau", record = conc ];
+    a <- [ kf = "ab * t", kb = 1 ] -> ab;
+end
+
+compartment C is
+    cube [ length = 1e-6, width = 1e-6, height = 1e-6 ]
+has
+    R net;
+end
+
+model F has
+    c is C;
+end
+'''
+
+def test_function_expressions( ):
+    load( 'functions.yacml', functions_model_ )
+    exprs = { }
+    for f in memsim.wildcardFind( '/yacml/##[TYPE=Function]' ):
+        # Inputs x0, x1 ... of function are pools; put their names back.
+        inputs = dict( [ ( 'x' + m.dest.rsplit( '[', 1 )[ 1 ].rstrip( ']' )
+            , m.src.rsplit( '/', 1 )[ 1 ] ) for m in memsim.messages_
+            if m.dest.startswith( f.path + '/x[' ) ] )
+        exprs[ f.name ] = expression.substitute( f.expr, inputs )
+    assert exprs == { 'func_set_conc' : 'a + 2 * ab + tau', 'func_Kf' : 'ab * t' }, exprs
+    print( '[PASSED] function expressions %s' % exprs )
+
+def test_reload( ):
+    load( os.path.join( testDir_, 'small_reaction.yacml' ) )
+    yacml.session_.dispose( )
+    assert not memsim.exists( '/yacml' )
+    assert memsim.messages_ == [ ]
+    print( '[PASSED] reload' )
+
+def main( ):
+    test_small_reaction( )
+    test_generated( )
+    test_function_expressions( )
+    test_reload( )
+
+if __name__ == '__main__':
+    main( )
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+"""test_parser_backends.py: 
+
+Both parser backends must produce the same AST for every model in corpus.
+
+Run from top-level directory:
+
+    python test/test_parser_backends.py
+
+"""
+
+import os
+import sys
+import glob
+
+sys.path.insert( 0, os.path.join( os.path.dirname( __file__ ), '..' ) )
+
+import lxml.etree as etree
+import yparser.yparser as yp
+from yparser.pyparsing import ParseException
+from benchmarks.generator import generate_model
+
+testDir_ = os.path.dirname( os.path.abspath( __file__ ) )
+
+# Text which must be rejected by both backends.
+invalid_ = [ 
+        'recipe A has end pathway M has c is A; end'
+        , 'recipe A has species a [ conc = 1 ] end pathway M has c is A; end'
+        , 'recipe A has species a [ conc = .5e-3 ]; end pathway M has c is A; end'
+        , 'recipe A has species spine [ N = 1 ]; end pathway M has c is A; end'
+        , 'recipe A has a + b <- r b; end pathway M has c is A; end'
+        ]
+
+def corpus( ):
+    """List of (name, text) of all models in corpus.
+    """
+    models = [ ]
+    files = glob.glob( os.path.join( testDir_, '*.yacml' ) )
+    files += glob.glob( os.path.join( testDir_, 'corpus', '*.yacml' ) )
+    for f in sorted( files ):
+        with open( f ) as fh:
+            models.append( ( os.path.basename( f ), fh.read( ) ) )
+    for n in [ 1, 10, 100, 1000 ]:
+        models.append( ( 'generated_%d' % n, generate_model( n, 100 ) ) )
+    return models
+
+def parse_with( text, backend ):
+    return etree.tostring( yp.parse_text( text, backend = backend ) )
+
+def test_same_ast( ):
+    for name, text in corpus( ):
+        expected = parse_with( text, 'pyparsing' )
+        got = parse_with( text, 'fast' )
+        assert expected == got, 'ASTs differ for %s' % name
+        print( '[PASSED] %s' % name )
+
+def test_same_errors( ):
+    for text in invalid_:
+        for backend in yp.backends_:
+            try:
+                parse_with( text, backend )
+            except ParseException:
+                continue
+            raise AssertionError( '%s accepted invalid model %s' % ( backend, text ) )
+    print( '[PASSED] invalid models are rejected' )
+
+if __name__ == '__main__':
+    test_same_ast( )
+    test_same_errors( )
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+"""test_sweep.py: 
+
+Sweep geometry of a compartment and check the mesh in the in-memory simulator
+(memsim.py), which needs no MOOSE. Points of sweep_runner are loaded in this
+process with sweep_runner.load_point, as its workers do.
+
+Run from top-level directory:
+
+    python test/test_sweep.py
+
+"""
+
+import os
+import sys
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+
+import math
+import json
+import shutil
+import functools
+import tempfile
+import lxml.etree as etree
+
+import yacml
+import sweep
+import memsim
+import sweep_runner
+from benchmarks.generator import scaling_model
+
+testDir_ = os.path.dirname( os.path.abspath( __file__ ) )
+# Tests run in a temporary directory with a copy of model; see in_workdir.
+model_ = 'small_reaction.yacml'
+radius_ = [ 1e-7, 2e-7 ]
+
+def in_workdir( test ):
+    """Run test in a temporary working directory with a copy of model_. The
+    files written by the loader (XML, graphviz) are removed with it.
+    """
+    @functools.wraps( test )
+    def run( ):
+        cwd, tmp = os.getcwd( ), tempfile.mkdtemp( prefix = 'yacml_sweep_' )
+        shutil.copy( os.path.join( testDir_, model_ ), tmp )
+        os.chdir( tmp )
+        try:
+            return test( )
+        finally:
+            os.chdir( cwd )
+            shutil.rmtree( tmp )
+    return run
+
+def cylinder_volume( r, l ):
+    return math.pi * r * r * l
+
+def close( a, b ):
+    return abs( a - b ) <= 1e-9 * abs( b )
+
+@in_workdir
+def test_push_geometry( ):
+    xml = yacml.loadModel( model_, solver = 'moose', simulator = 'memory'
+            , save_output = False )
+    sw = sweep.Sweep( xml )
+    res = sw.evaluate( { 'radius' : radius_ } )
+    assert 's1/geometry/radius' in res.dtype.names, res.dtype.names
+    mesh = memsim.wildcardFind( '/yacml/##[TYPE=CylMesh]' )[ 0 ]
+    for i, r in enumerate( radius_ ):
+        sw.push( res, i )
+        assert mesh.r0 == mesh.r1 == r, ( mesh.r0, r )
+        assert close( mesh.volume, cylinder_volume( r, mesh.x1 ) ), mesh.volume
+    try:
+        sw.push( sw.evaluate( { 'radius' : radius_ }, fields = [ 'diffusion_length' ] ), 0 )
+    except ValueError:
+        pass
+    else:
+        assert False, 'push of a field without MOOSE target must fail'
+    print( '[PASSED] push geometry' )
+
+@in_workdir
+def test_runner_geometry( ):
+    xml = yacml.compile_model( model_, open( model_ ).read( ) )
+    xmlText = etree.tostring( xml )
+    res = sweep.Sweep( xml ).changes( { 'radius' : radius_ } )
+    assert 's1/geometry/volume' in res.dtype.names, res.dtype.names
+    for i, r in enumerate( radius_ ):
+        values = dict( [ ( n, float( res[ n ][ i ] ) ) for n in res.dtype.names ] )
+        memsim.reset( )
+        sweep_runner.load_point( xmlText, values, simulator = 'memory' )
+        mesh = memsim.wildcardFind( '/yacml/##[TYPE=CylMesh]' )[ 0 ]
+        assert mesh.r0 == r, ( mesh.r0, r )
+        assert close( mesh.volume, cylinder_volume( r, mesh.x1 ) ), mesh.volume
+    print( '[PASSED] runner geometry' )
+
+@in_workdir
+def test_copy_on_write( ):
+    # Two compartments with two instances each of recipes; a sweep of one
+    # instance copies only the touched declaration out of its template.
+    xml = yacml.compile_model( 'scaling.yacml', scaling_model( 2, 3, 4, 2, 1, 0.0 ) )
+    xmlText = etree.tostring( xml )
+    res = sweep.Sweep( xml ).changes( { 'c0/net0/r0/kf' : [ 5.0 ] } )
+    assert res.dtype.names == ( 'c0/net0/r0/kf', ), res.dtype.names
+    # Sweep does not change the AST it is given.
+    assert etree.tostring( xml ) == xmlText
+
+    values = { 'c0/net0/r0/kf' : 5.0 }
+    point = etree.fromstring( xmlText )
+    sweep.Sweep( point ).assign( values )
+    owned = dict( [ ( '%s/%s' % ( n.getparent( ).attrib[ 'name' ], n.attrib[ 'name' ] )
+        , [ c.attrib.get( 'id' ) for c in n ] ) for n in point.iter( 'chemical_reaction_subnetwork' ) ] )
+    assert owned == { 'c0/net0' : [ 'r0' ], 'c0/net1' : [ ], 'c1/net0' : [ ], 'c1/net1' : [ ] }, owned
+
+    memsim.reset( )
+    sweep_runner.load_point( xmlText, values, simulator = 'memory' )
+    reacs = dict( [ ( '/'.join( r.path.split( '/' )[ 3: ] ), r.Kf )
+        for r in memsim.wildcardFind( '/yacml/##[TYPE=Reac]' ) ] )
+    assert reacs[ 'c0/net0/s2<-->s1' ] == 5.0, reacs
+    assert reacs[ 'c1/net0/s2<-->s1' ] == 1.0, reacs
+    assert reacs[ 'c0/net1/s2<-->s1' ] == 1.0, reacs
+    memsim.reset( )
+    print( '[PASSED] copy on write' )
+
+@in_workdir
+def test_resume_random( ):
+    # Without seed a random design is drawn again on every run; resume must
+    # use the design in manifest.
+    outdir = tempfile.mkdtemp( prefix = 'yacml_sweep_' )
+    try:
+        design = sweep_runner.make_design( { 'kf' : ( 1.0, 10.0 ) }, 'random', 3 )
+        runner = sweep_runner.SweepRunner( model_, design, outdir )
+        runner.load_manifest( open( model_ ).read( ), False )
+        runner.save_manifest( )
+        other = sweep_runner.make_design( { 'kf' : ( 1.0, 10.0 ) }, 'random', 3 )
+        for d in [ other, None ]:
+            runner = sweep_runner.SweepRunner( model_, d, outdir )
+            runner.load_manifest( open( model_ ).read( ), True )
+            assert runner.design[ 'kf' ].tolist( ) == design[ 'kf' ].tolist( )
+            assert runner.npoints == 3
+    finally:
+        shutil.rmtree( outdir )
+    print( '[PASSED] resume random design' )
+
+def main( ):
+    test_push_geometry( )
+    test_runner_geometry( )
+    test_copy_on_write( )
+    test_resume_random( )
+
+if __name__ == '__main__':
+    main( )
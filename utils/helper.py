@@ -13,15 +13,13 @@ __maintainer__       = "Dilawar Singh"
 __email__            = "dilawars@ncbs.res.in"
 __status__           = "Development"
 
-import __future__
 import ast
 import re
 import math
-import moose
 
-# Bring imports from math to global namespace so that eval can use them.
-from math import *
 from config import logger_
+from collections import OrderedDict
+from yparser.expression import Expression
 
 funcs = math.__dict__.keys() + [ 'fmod', 'rand', 'rand2' ]
 
@@ -55,20 +53,81 @@ def get_ids( expr ):
     return ids
 
 
+# Compiled expressions (yparser.expression.Expression) keyed by expression
+# text, in least recently used order. The same expressions (e.g. 1e-4,
+# volume*2) appear many times in replicated recipes. A failed compilation is
+# cached as None.
+expr_cache_size_ = 10000
+expr_cache_ = OrderedDict( )
+expr_cache_stats_ = { 'hits' : 0, 'misses' : 0, 'literals' : 0 }
+
+# Numeric literals are converted without compiling them. Integers with leading
+# zeros are left to python (octal in python2).
+int_re_ = re.compile( r'[+-]?(?:0|[1-9]\d*)\s*$' )
+float_re_ = re.compile( 
+        r'[+-]?(?:(?:\d+\.\d*|\.\d+)(?:[eE][+-]?\d+)?|\d+[eE][+-]?\d+)\s*$' 
+        )
+
+def literal_value( expr ):
+    """Value of expr if it is a plain int or float literal, else None.
+    """
+    if int_re_.match( expr ):
+        return int( expr )
+    if float_re_.match( expr ):
+        return float( expr )
+    return None
+
+def compile_expr( expr ):
+    """Compiled Expression of expr (None if it does not compile), cached.
+    """
+    code = expr_cache_.pop( expr, False )
+    if code is False:
+        expr_cache_stats_[ 'misses' ] += 1
+        try:
+            code = Expression( expr )
+        except Exception as e:
+            code = None
+        if len( expr_cache_ ) >= expr_cache_size_:
+            expr_cache_.popitem( last = False )
+    else:
+        expr_cache_stats_[ 'hits' ] += 1
+    expr_cache_[ expr ] = code
+    return code
+
+def expr_cache_info( ):
+    """Hits, misses, number of literals (which bypass the cache) and size of
+    the expression cache.
+    """
+    info = dict( expr_cache_stats_ )
+    info[ 'size' ] = len( expr_cache_ )
+    return info
+
+def clear_expr_cache( ):
+    expr_cache_.clear( )
+    for k in expr_cache_stats_:
+        expr_cache_stats_[ k ] = 0
+
 ##
-# @brief Eval the expression using python. The __future__ related compile flags
-# make sure that 1/3 is reduced 0.33333 instead of 0.
+# @brief Evaluate the expression with yparser.expression; division is true
+# division so 1/3 is reduced to 0.33333 instead of 0. Numeric literals are
+# converted directly; other expressions are compiled once and cached.
 #
 # @param expr
+# @param values Optional dictionary of variable values.
 #
 # @return Reduced value as string whenever possible.
-def reduce_expr( expr ):
+def reduce_expr( expr, values = None ):
+    val = literal_value( expr )
+    if val is not None:
+        expr_cache_stats_[ 'literals' ] += 1
+        return str( val ), 'true'
+
     isReduced = 'false'
+    code = compile_expr( expr )
     try:
-        val = eval(
-                compile( expr , '<string>', 'eval',
-                    __future__.division.compiler_flag )
-                )
+        if code is None:
+            raise SyntaxError( expr )
+        val = code( values )
         isReduced = 'true'
     except Exception as e:
         # logger_.debug( 'Failed to reduce %s' % expr )
@@ -77,8 +136,11 @@ def reduce_expr( expr ):
     return str(val), isReduced
 
 def to_float( expr ):
+    val = literal_value( expr )
+    if val is not None:
+        return float( val )
     val, isReduced = reduce_expr( expr )
-    if isReduced:
+    if isReduced == 'true':
         return float(val)
     else:
         raise RuntimeError( 'Failed to convert to float : %s' % expr )
@@ -86,12 +148,12 @@ def to_float( expr ):
 def compt_info( compt ):
     """Get the compartment info as string"""
     info = ''
-    if isinstance( compt, moose.CubeMesh ):
+    if compt.className == 'CubeMesh':
         info += 'Cube\n'
         info += '\tx0, y0, z0 : %s, %s, %s\n' % (compt.x0, compt.y0, compt.z0)
         info += '\tx1, y1, z1 : %s, %s, %s\n' % (compt.x1, compt.y1, compt.z1)
         info += '\tvolume : %s' % compt.volume 
-    elif isinstance( compt, moose.CylMesh ):
+    elif compt.className == 'CylMesh':
         info += 'Cylinder:\n'
         info += '\tr0, r1 : %s, %s\n' % (compt.r0, compt.r1 )
         info += '\tx0, y0, z0 : %s, %s, %s\n' % (compt.x0, compt.y0, compt.z0 )
@@ -17,7 +17,6 @@ import re
 import numpy as np
 
 import logging
-import moose.utils as mu
 logger_ = logging.getLogger('util.testexpr')
 
 
@@ -102,9 +101,7 @@ def assert_ltl(ltl, node, molecule, time):
     startN, stopN = int(ltl.start/dt), int(ltl.stop/dt)
     data = vec[startN:stopN]
     if len(data) == 0:
-        mu.warn([ "Ignoring test"
-            , "Probably simulation time is not enough" ]
-            )
+        logger_.warning( "Ignoring test. Probably simulation time is not enough" )
         return None
 
     func = np.vectorize(ltl.test_func)
@@ -13,63 +13,92 @@ __maintainer__       = "Dilawar Singh"
 __email__            = "dilawars@ncbs.res.in"
 __status__           = "Development"
 
-import moose
+import simulator
 
-names_ = { }
-graphviz_ = []
-
-def add_to_gv( line, indent = 1 ):
-    global graphviz_
+def add_to_gv( lines, line, indent = 1 ):
     for i in range( indent ):
         line = '  ' + line
-    if line not in graphviz_:
-        graphviz_.append( line )
+    if line not in lines:
+        lines.append( line )
 
-def graphviz_text( ):
-    global graphviz_ 
-    return "\n".join( graphviz_ )
+def graphviz_text( lines ):
+    return "\n".join( lines )
 
 ##
 # @brief Generate a unique name from given moose element.
 #
-# @param path
+# @param elem
+# @param names If given, name : path of element is added to it.
 #
 # @return name
-def yacml_name( elem ):
-    global names_
-    path = elem.path
+def yacml_name( elem, names = None ):
+    return gv_name( elem.path, names )
+
+def gv_name( path, names = None ):
     p = path.replace( '[0]', '' )
     name = "_".join( p.split('/')[-2:] )
     name = name.replace( '<-', '__' )
     name = name.replace( '->', '__' )
-    names_[name] = elem.path
+    if names is not None:
+        names[name] = path
     return '"%s"' % name
 
-def init_graphviz( modelname ):
-    add_to_gv( 'digraph %s { ' % modelname, 0 )
-    add_to_gv( 'graph[ overlap=scale ];' )
+def init_graphviz( lines, modelname ):
+    add_to_gv( lines, 'digraph %s { ' % modelname, 0 )
+    add_to_gv( lines, 'graph[ overlap=scale ];' )
 
-def end_graphviz( ):
-    add_to_gv( "}", 0 );
+def end_graphviz( lines ):
+    add_to_gv( lines, "}", 0 );
     
+##
+# @brief Write network topology of model to <modelname>.dot. Lines are
+# collected per call; nothing is kept between calls.
+#
+# @param modelname
+# @param model compartment.Model. When not given, the model loaded in MOOSE is
+#   used.
+#
+# @return Dictionary of graphviz name : path of element.
+def write_graphviz( modelname, model = None ):
+    lines, names = [ ], { }
+    init_graphviz( lines, modelname )
+    if model is not None:
+        add_model( lines, names, model )
+    else:
+        add_moose_model( lines, names )
+    end_graphviz( lines )
+    dotFile = '%s.dot' % modelname
+    with open( dotFile, 'w' ) as f:
+        f.write( graphviz_text( lines ) )
+    print( '[INFO] Wrote network topology to %s' % dotFile )
+    return names
+
+def add_model( lines, names, model ):
+    edges = [ ]
+    for compt, net in model.networks( ):
+        netPath = '/yacml/%s/%s/%s' % ( model.name, compt.name, net.name )
+        for r in net.reactions:
+            rName = gv_name( '%s/%s' % ( netPath, r.name ), names )
+            add_to_gv( lines, '%s[label="", shape=rect];' % rName )
+            for i in r.substrates:
+                sName = gv_name( '%s/%s' % ( netPath, net.species[i].name ), names )
+                edges.append( '%s -> %s;' % ( rName, sName ) )
+            for i in r.products:
+                pName = gv_name( '%s/%s' % ( netPath, net.species[i].name ), names )
+                edges.append( '%s -> %s;' % ( pName, rName ) )
+    [ add_to_gv( lines, e ) for e in edges ]
 
-def write_graphviz( modelname ):
-    init_graphviz( modelname )
+def add_moose_model( lines, names ):
+    moose = simulator.current( )
     reacs = moose.wildcardFind( '/yacml/##[TYPE=Reac]' )
     zreacs = moose.wildcardFind( '/yacml/##[TYPE=ZombieReac]' )
     for r in reacs + zreacs:
-        add_to_gv( '%s[label="", shape=rect];' % ( yacml_name(r) ) )
+        add_to_gv( lines, '%s[label="", shape=rect];' % ( yacml_name(r, names) ) )
 
     for r in reacs + zreacs:
         subs = r.neighbors['sub']
         prds = r.neighbors['prd']
         for s in subs:
-            add_to_gv( '%s -> %s;' % (yacml_name(r), yacml_name(s) ) )
+            add_to_gv( lines, '%s -> %s;' % (yacml_name(r, names), yacml_name(s, names) ) )
         for p in prds:
-            add_to_gv( '%s -> %s;' % ( yacml_name(p), yacml_name(r) ) )
-
-    end_graphviz( )
-    dotFile = '%s.dot' % modelname
-    with open( dotFile, 'w' ) as f:
-        f.write( graphviz_text() )
-    print( '[INFO] Wrote network topology to %s' % dotFile )
+            add_to_gv( lines, '%s -> %s;' % ( yacml_name(p, names), yacml_name(r, names) ) )
@@ -15,6 +15,7 @@ __email__            = "dilawars@ncbs.res.in"
 __status__           = "Development"
 
 import lxml.etree as etree
+from copy import deepcopy
 
 from config import logger_
 
@@ -28,11 +29,153 @@ def get_value_from_variable_xml( root_xml, param_name ):
     assert elem, "Could not find variable named %s" % param_name 
     return float( elem[0].text )
 
-def find_reaction_instance( root_xml, rname ):
-    reacInsts =  root_xml.xpath( 'reaction_declaration[@id="%s"]' % rname )
-    if not reacInsts:
-        logger_.warn( 'I could not find a reaction declaration %s ' % rname )
+def find_reaction_instance( root_xml, rname, index = None ):
+    """Declaration of reaction rname in root_xml (a recipe or a chemical
+    subnetwork). A subnetwork which has not materialized the declaration finds
+    it in its template. Pass the DeclarationIndex of document when doing many
+    lookups.
+    """
+    template = template_of( root_xml, index )
+    if index is None:
+        index = DeclarationIndex( root_xml.getparent( ) if template is not None else root_xml )
+    try:
+        return index.find( 'reaction_declaration', rname, root_xml )
+    except NameError:
+        if template is None:
+            raise
+        return index.find( 'reaction_declaration', rname, template )
 
-    assert len( reacInsts ) == 1, 'More than one definition of %s' % rname 
-    return reacInsts[0]
+##
+# @brief Copy-on-write instances of recipes.
+#
+# A flattened compartment keeps one copy of every recipe it instantiates, the
+# template. An instance (chemical_reaction_subnetwork) refers to it by its
+# 'template' attribute and is empty until something specific to the instance
+# has to be changed. Then only the touched top-level element of template
+# (species, reaction, variable ...) is copied into the instance; the copy
+# records its position in template in 'template_index'. Templates must not be
+# modified after flattening except by constant propagation, which is the same
+# for all instances.
+def template_of( net, index = None ):
+    """Template recipe of a chemical subnetwork, None if net is not an instance
+    of a template. Pass the DeclarationIndex of compartment of net when doing
+    many lookups.
+    """
+    tid = net.attrib.get( 'template' )
+    if tid is None:
+        return None
+    if index is not None and index.root is net.getparent( ):
+        return index.find( 'recipe', tid )
+    # Templates come before the subnetworks in compartment.
+    for elem in net.getparent( ):
+        if elem.tag == 'recipe' and elem.attrib.get( 'id' ) == tid:
+            return elem
+        if elem is net:
+            break
+    raise NameError( 'Template %s of %s not found' % ( tid, net.attrib.get( 'name' ) ) )
+
+def subnetwork_children( net, index = None ):
+    """Elements of a chemical subnetwork: the materialized ones from net and
+    the rest from its template, in template order.
+    """
+    template = template_of( net, index )
+    if template is None:
+        return list( net )
+    own = dict( [ ( int( c.attrib[ 'template_index' ] ), c ) for c in net ] )
+    return [ own.get( i, c ) for i, c in enumerate( template ) ]
+
+def materialize( net, elem = None ):
+    """Give net its own copy of template element elem (all elements when elem
+    is None) and return it; the copy of an element which net already owns is
+    returned as it is. A net which owns all the elements no longer refers to
+    template.
+    """
+    template = template_of( net )
+    if template is None:
+        return elem if elem is not None else net
+    if elem is None:
+        children = subnetwork_children( net )
+        for c in list( net ):
+            net.remove( c )
+        for c in children:
+            if c.getparent( ) is template:
+                c = deepcopy( c )
+            c.attrib.pop( 'template_index', None )
+            net.append( c )
+        del net.attrib[ 'template' ]
+        return net
+
+    if elem.getparent( ) is net:
+        return elem
+    assert elem.getparent( ) is template, '%s is not in template of net' % elem.tag
+    i = template.index( elem )
+    for c in net:
+        if int( c.attrib[ 'template_index' ] ) == i:
+            # Already materialized.
+            return c
+    copy = deepcopy( elem )
+    copy.attrib[ 'template_index' ] = str( i )
+    # Keep the copies in template order.
+    for pos, c in enumerate( net ):
+        if int( c.attrib[ 'template_index' ] ) > i:
+            net.insert( pos, copy )
+            break
+    else:
+        net.append( copy )
+    return copy
+
+def materialize_all( root ):
+    """Materialize all chemical subnetworks under root and drop the templates.
+    """
+    nets = [ n for n in root.iter( 'chemical_reaction_subnetwork' )
+            if 'template' in n.attrib ]
+    templates = set( [ template_of( n ) for n in nets ] )
+    for n in nets:
+        materialize( n )
+    for t in templates:
+        t.getparent( ).remove( t )
+    return root
+
+class DeclarationIndex( object ):
+    """Map (scope, kind, id) to declaration element, built in one pass over a
+    document.
+
+    Recipes and compartments are declared at top level of document; their
+    scope is the root element. A reaction_declaration is declared in the
+    recipe or chemical subnetwork which contains it. Two declarations with the
+    same id in the same scope raise NameError when the index is built.
+    """
+
+    kinds_ = [ 'recipe', 'compartment', 'reaction_declaration' ]
+
+    def __init__( self, root ):
+        self.root = root
+        self.index = { }
+        for elem in root.iter( *self.kinds_ ):
+            scope = elem.getparent( )
+            if elem.tag != 'reaction_declaration' and scope is not root:
+                # E.g. instances of compartment in model.
+                continue
+            key = ( scope, elem.tag, elem.attrib.get( 'id' ) )
+            if key in self.index:
+                where = '%s %s' % ( scope.tag
+                        , scope.attrib.get( 'id', scope.attrib.get( 'name', '' ) ) )
+                raise NameError( 'Duplicate declaration of %s %s in %s' % (
+                    elem.tag, key[2], where.strip( ) )
+                    )
+            self.index[ key ] = elem
+
+    def find( self, kind, id, scope = None ):
+        """Declaration of kind with id in scope (default root). Raise NameError
+        if there is none.
+        """
+        if scope is None:
+            scope = self.root
+        elem = self.index.get( ( scope, kind, id ) )
+        if elem is None:
+            raise NameError( 'Could not find any %s with name %s' % ( kind, id ) )
+        return elem
+
+    def __len__( self ):
+        return len( self.index )
 
@@ -12,75 +12,299 @@ __email__            = "dilawars@ncbs.res.in"
 __status__           = "Development"
 
 
-import yacml2moose
+import os
+import sys
+import importlib
 import config
+import cache
+import profiling
 import yparser.yparser as yp
-import yparser.bnf as bnf
 import yparser.ast_processor as astp
-import yparser.pre_processor
-import moose
-import moose.utils as mu
+from yparser import propagation
 import lxml.etree as etree
 
 logger_ = config.logger_
 
+# Simulator backends by name, as in 'simulator <name> [ ... ];' of model :
+# module. Backends (and numpy, scipy, MOOSE) are imported when a model is
+# loaded, so that checking a model starts fast.
+backends_ = { 'moose' : 'yacml2moose', 'scipy' : 'yacml2scipy', 'ssa' : 'yacml2ssa' }
+
+# Stages of check( ) in order.
+check_stages_ = [ 'parse', 'flatten', 'propagate' ]
+
+def get_backend( name ):
+    """Module of simulator backend name e.g. yacml2moose for moose.
+    """
+    if name not in backends_:
+        raise ValueError( 'Unknown simulator %s. Available: %s' % ( 
+            name, ', '.join( sorted( backends_ ) ) ) )
+    return importlib.import_module( backends_[ name ] )
+
+class YacmlSession( object ):
+    """Compile YACML models and load them into MOOSE. A session owns all the
+    state of its model: the AST, the LoadContext of MOOSE loader (tables etc.)
+    and the model in MOOSE under /yacml. Nothing is shared between sessions,
+    but MOOSE has only one /yacml; dispose a session before loading another
+    model.
+
+        with yacml.YacmlSession( ) as s:
+            s.load( 'model.yacml' )
+            print( s.tables )
+
+    :param cache: Use on-disk compile cache (default when YACML_CACHE_DIR is
+        set in environment).
+
+    load( filename, profile = 'report.json' ) writes timers of stages and
+    counters of created MOOSE objects to report.json (profile = True writes
+    <filename>.perf.json); cprofile = True or a list of stages also runs
+    stages under cProfile. memory = True adds memory used by each stage to the
+    report and memory_budget = MB aborts the load with
+    profiling.MemoryBudgetError when resident memory exceeds MB. See
+    profiling.py.
+    """
+
+    def __init__( self, cache = None ):
+        if cache is None:
+            cache = 'YACML_CACHE_DIR' in os.environ
+        self.cache = cache
+        self.filename = None
+        self.xml = None
+        self.context = None
+        # Module of simulator backend of loaded model.
+        self.backend = None
+        self.disposed = False
+
+    def compile( self, filename, text = None ):
+        """Parse, flatten and propagate filename. Return the propagated AST.
+        """
+        self.filename = filename
+        if text is None:
+            with open( filename ) as f:
+                text = f.read( )
+        compileCache, key, xml = None, None, None
+        if self.cache:
+            compileCache = cache.CompileCache( )
+            key = compileCache.key( text )
+            xml = compileCache.get( key, 'propagate' )
+            profiling.count( 'cache.%s' % ( 'miss' if xml is None else 'hit' ) )
+        if xml is None:
+            xml = compile_model( filename, text, compileCache, key )
+        self.xml = xml
+        return xml
+
+    def load( self, filename, **kwargs ):
+        """Compile filename and load it into the simulator named in model
+        (moose by default) or by solver = 'moose' | 'scipy' | 'ssa'. Return the
+        propagated AST. Other kwargs are passed to load of backend e.g.
+        yacml2moose.load.
+
+        components = 'solvers' gives every independent component of model
+        (see decompose.py) its own solver; components = 'processes' runs
+        components in a pool of jobs processes.
+        """
+        assert not self.disposed, 'Session is disposed'
+        report = kwargs.pop( 'profile', config.profile_report_ )
+        cprofile = kwargs.pop( 'cprofile', None )
+        memory = kwargs.pop( 'memory', False )
+        budget = kwargs.pop( 'memory_budget', config.memory_budget_ )
+        if not ( report or memory or budget ):
+            return self.load_model( filename, **kwargs )
+        if report is True or ( memory and not report ):
+            report = '%s.perf.json' % filename
+        profiling.enable( cprofile, memory, budget )
+        try:
+            xml = self.load_model( filename, **kwargs )
+            profiling.profiler_.info.update( model = filename
+                    , solver = kwargs.get( 'solver' ) or simulator_name( xml ) )
+            if self.model is not None:
+                profiling.profiler_.info.update( 
+                        compartments = len( self.model.compartments )
+                        , species = sum( [ len( n.species ) for c, n in self.model.networks( ) ] )
+                        , reactions = sum( [ len( n.reactions ) for c, n in self.model.networks( ) ] )
+                        )
+            if report:
+                profiling.profiler_.write_report( report )
+        finally:
+            profiling.disable( )
+        return xml
+
+    def load_model( self, filename, **kwargs ):
+        """load without performance report.
+        """
+        self.reset( )
+        config.args_['input_flie'] = filename
+        xml = self.compile( filename )
+        solver = kwargs.pop( 'solver', None ) or simulator_name( xml )
+        components = kwargs.pop( 'components', None )
+        jobs = kwargs.pop( 'jobs', None )
+        self.backend = backend = get_backend( solver )
+        self.context = backend.LoadContext( )
+        if components in [ 'solvers', 'processes' ]:
+            import decompose
+        if components == 'solvers' and solver == 'moose':
+            kwargs[ 'split_components' ] = True
+        elif components == 'solvers':
+            return decompose.load( xml, backend, self.context, 1, propagate = False, **kwargs )
+        elif components == 'processes':
+            return decompose.load( xml, backend, self.context, jobs, propagate = False, **kwargs )
+        elif components is not None:
+            raise ValueError( 'Unknown components %s. Use solvers or processes' % components )
+        return backend.load( xml, self.context, propagate = False, **kwargs )
+
+    @property
+    def model( self ):
+        """compartment.Model (IR) of loaded model. It does not refer to the
+        AST; set xml to None to free the AST when it is not needed.
+        """
+        return self.context.model if self.context else None
+
+    @property
+    def tables( self ):
+        """Tables of loaded model: moose.Table2 or yacml2scipy.Table, both
+        with columnName and vector.
+        """
+        return self.context.tables if self.context else [ ]
+
+    def reset( self ):
+        """Remove the model of this session from MOOSE and forget it. The
+        session can load another model afterwards.
+        """
+        if self.backend is not None and self.backend.__name__ == 'yacml2moose':
+            self.backend.delete_model( )
+        self.filename, self.xml, self.context = None, None, None
+        self.backend = None
+
+    def dispose( self ):
+        """Release everything held by this session. It can not be used
+        afterwards.
+        """
+        self.reset( )
+        self.disposed = True
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.dispose( )
+
+def simulator_name( xml ):
+    """Name of simulator of model in AST, moose when not given.
+    """
+    sim = xml.find( 'model/simulator' )
+    if sim is None or not ( sim.text or '' ).strip( ):
+        return 'moose'
+    return sim.text.strip( )
+
+# Session of the last loadModel call.
+session_ = None
+
 def loadModel( filename, **kwargs ):
-    """Main entry function
+    """Main entry function. Return the propagated AST which was loaded.
+
+    Parsed, flattened and propagated ASTs are kept in on-disk compile cache
+    when cache = True is given (default when YACML_CACHE_DIR is set in
+    environment). A model found in cache is loaded without re-parsing.
+
+    The model loaded by previous call is removed from MOOSE first.
     """
+    global session_
+    if session_ is not None:
+        session_.dispose( )
+    session_ = YacmlSession( kwargs.pop( 'cache', None ) )
+    return session_.load( filename, **kwargs )
 
-    config.args_['input_flie'] = filename
-    xml = yp.parse( filename )
-    
-    xml0file = '%s0.xml' % filename
-    with open( xml0file , 'w' ) as f:
-        f.write( etree.tostring( xml, pretty_print = True ) )
-    logger_.info( 'Wrote xml0 to %s' % xml0file )
-
-    xml = astp.flatten( xml )
-    xml1file = '%s1.xml' % filename
-    with open( xml1file, 'w' ) as f:
-        f.write( etree.tostring( xml, pretty_print = True ) ) 
-    logger_.info( 'Wrote xml1 to %s' % xml1file )
-
-    yacml2moose.load( xml, **kwargs )
-
-# if __name__ == '__main__':
-#     import argparse
-#     # Argument parser.
-#     description = '''YACML: Yet Another Chemical Markup Language'''
-#     argp = argparse.ArgumentParser(description=description)
-#     argp.add_argument('--model_file', '-f'
-#             , required = True
-#             , type = str
-#             , help = 'Model file'
-#             )
-#     
-#     argp.add_argument('--sim_time', '-st'
-#             , metavar='variable'
-#             , default = 10.0
-#             , type = float
-#             , help = 'A generic option'
-#             )
-# 
-#     argp.add_argument('--solver', '-s'
-#             , default = 'moose'
-#             , type = str
-#             , help = "Which solver to use: moose | scipy"
-#             )
-# 
-#     argp.add_argument('--outfile', '-o'
-#             , default = None
-#             , type = str
-#             , help = "Name of the plot file"
-#             )
-# 
-#     argp.add_argument('--log', '-l'
-#             , default = 'warning'
-#             , type = str
-#             , help = 'Debug levels: [debug, info, warning, error, critical]'
-#             )
-# 
-#     class Args: pass 
-#     args = Args()
-#     argp.parse_args(namespace=args)
-#     main(vars(args))
+def compile_model( filename, text, compile_cache = None, key = None ):
+    """Parse, flatten and do constant propagation on YACML text. Stages found
+    in compile_cache are not computed again.
+    """
+    xml = None
+    if compile_cache:
+        xml = compile_cache.get( key, 'flatten' )
+
+    if xml is None:
+        if compile_cache:
+            xml = compile_cache.get( key, 'parse' )
+        if xml is None:
+            with profiling.stage( 'parse' ):
+                xml = yp.parse_text( text, yp.ParserContext( filename ) )
+            if compile_cache:
+                compile_cache.put( key, 'parse', xml )
+
+        xml0file = '%s0.xml' % filename
+        with profiling.stage( 'dump' ), open( xml0file , 'w' ) as f:
+            f.write( etree.tostring( xml, pretty_print = True ) )
+        logger_.info( 'Wrote xml0 to %s' % xml0file )
+
+        with profiling.stage( 'flatten' ):
+            xml = astp.flatten( xml )
+        xml1file = '%s1.xml' % filename
+        with profiling.stage( 'dump' ), open( xml1file, 'w' ) as f:
+            f.write( etree.tostring( xml, pretty_print = True ) ) 
+        logger_.info( 'Wrote xml1 to %s' % xml1file )
+        if compile_cache:
+            compile_cache.put( key, 'flatten', xml )
+
+    with profiling.stage( 'propagate' ):
+        propagation.propagate( xml )
+    if compile_cache:
+        compile_cache.put( key, 'propagate', xml )
+    return xml
+
+def parse_only( filename, parser = 'fast' ):
+    """Parse filename and return its AST. Nothing is written and no
+    simulator is imported.
+    """
+    with open( filename ) as f:
+        text = f.read( )
+    return yp.parse_text( text, yp.ParserContext( filename ), parser )
+
+def check( filename, stage = 'parse', parser = 'fast' ):
+    """Check that model in filename is valid up to stage (see
+    check_stages_). Return the AST of last stage; raise on errors.
+    """
+    assert stage in check_stages_, 'Unknown stage %s' % stage
+    xml = parse_only( filename, parser )
+    if stage in [ 'flatten', 'propagate' ]:
+        xml = astp.flatten( xml )
+    if stage == 'propagate':
+        propagation.propagate( xml )
+    return xml
+
+def main( args ):
+    if args.command == 'check':
+        failed = 0
+        for filename in args.model_files:
+            try:
+                check( filename, args.stage, args.parser )
+                print( '%s: OK' % filename )
+            except Exception as e:
+                print( '%s: %s' % ( filename, e ) )
+                failed += 1
+        return 1 if failed else 0
+    loadModel( args.model_file, solver = args.solver, simulator = args.simulator )
+    return 0
+
+if __name__ == '__main__':
+    import argparse
+    # Argument parser.
+    description = '''YACML: Yet Another Chemical Markup Language'''
+    argp = argparse.ArgumentParser( description = description )
+    sub = argp.add_subparsers( dest = 'command' )
+    checkp = sub.add_parser( 'check', help = 'Check models without loading them' )
+    checkp.add_argument( 'model_files', nargs = '+', help = 'Model files' )
+    checkp.add_argument( '--stage', default = 'parse', choices = check_stages_
+            , help = 'Check up to this stage'
+            )
+    checkp.add_argument( '--parser', default = 'fast', choices = yp.backends_
+            , help = 'Parser backend'
+            )
+    loadp = sub.add_parser( 'load', help = 'Load and run a model' )
+    loadp.add_argument( 'model_file', help = 'Model file' )
+    loadp.add_argument( '--solver', '-s', default = None
+            , help = "Which solver to use: moose | scipy | ssa"
+            )
+    loadp.add_argument( '--simulator', default = None
+            , help = 'Simulator of moose solver: moose | memory'
+            )
+    sys.exit( main( argp.parse_args( ) ) )
@@ -15,183 +15,131 @@ __status__           = "Development"
 
 
 import __future__
-import moose
 import re
 import ast
 import math 
 
 import config
 import lxml.etree as etree
-import moose.print_utils as pu
 import utils.xml as xml
 import utils.to_graphviz as togv
+import compartment as ir
+import profiling
+import simulator
 
 from utils import test_expr as te
 from utils import helper
-
-from collections import deque
+from yparser import propagation
+from yparser import expression
 
 logger_ = config.logger_
 
-logger_.debug( 'Using moose from %s' % moose.__file__ )
-logger_.debug( '| Version %s' % moose.__version__ )
-
-# Some more global variables such as volume of compartment, length and radius.
-globals_ = { }
-modelname_ = None
-
-# When set to true, record all function output in table.
-debugMode_ = False
-
-# Required to construct a unique name for moose.Tables
-current_chemical_subnetwork_name_ = None
+# Simulator in use (see simulator.py), set by use_simulator( ). The loader
+# calls it moose, as it has the API of MOOSE.
+moose = None
 
 moose_dict_ = { 
         'kb' : 'Kb' , 'kf' : 'Kf' 
         }
 
-# Store all moose.Table in dictionary: path : object
-tables_ = [ ]
-
-def helper_constant_propagation( text, reduced, unreduced ):
-    # Get all identifiers which can be replaced.
-    ids = helper.get_ids( text )
-    newText = text
-    for iden in ids:
-        # replace from the unreduced first.
-        if iden in unreduced:
-            logger_.debug( '|| Replacing %s' % iden )
-            newText = newText.replace( iden, unreduced[iden] )
-        elif iden in reduced:
-            logger_.debug( '|| Replacing %s' % iden )
-            newText = newText.replace( iden, reduced[iden] )
-    
-    # If no more changes are possible, return the result else call the function
-    # recusively.
-    if newText == text:
-        return text
-    else:
-        return helper_constant_propagation( newText, reduced, unreduced )
-
-def get_global_variables( elem, reduced = {}, unreduced = {} ):
-    # Get the compartwarn geometry paramters.
-    global globals_
-    while elem.getparent() is not None:
-        elem = elem.getparent()
-        ur, r = get_local_variables( elem )
-        reduced.update( r )
-        unreduced.update( ur )
-
-    reduced.update( globals_ )
-    return (unreduced, reduced) 
-
-def get_local_variables( elem ):
-    variables = {}
-    reduced, unreduced = {}, {}
-    for v in  elem.xpath( 'variable[@is_reduced="true"]' ):
-        reduced[v.attrib['name'] ] = v.text
-    for v in  elem.xpath( 'variable[@is_reduced="false"]' ):
-        unreduced[v.attrib['name'] ] = v.text
-    return (unreduced, reduced) 
-
-def replace_variable_value_from_dict( elem, var, var_dict ):
-    if var in var_dict:
-        elem.text = elem.text.replace(var, var_dict[var] )
-        elem.text, isReduced = helper.reduce_expr( elem.text ) 
-        elem.attrib[ 'is_reduced' ] = isReduced
-        return var_dict[var], True
-    else:
-        return var, False
-
-def replace_variable_value( elem, local_vars, global_vars ):
-    t = elem.text
-    allVars = local_vars + global_vars
-    for i in helper.get_ids( elem.text ):
-        # Replace from each dictionary in order, stop at first replacement.
-        for varDict in allVars:
-            if replace_variable_value_from_dict( elem, i, varDict )[1]:
-                break
-
-    if t == elem.text:
-        return elem
-    else:
-        return replace_variable_value( elem, local_vars, global_vars )
+class LoadContext( object ):
+    """State of one load of a model into MOOSE.
+    """
 
+    def __init__( self, debug = False ):
+        # Some more global variables such as volume of compartment, length and
+        # radius.
+        self.globals = { }
+        self.modelname = None
+        # When set to true, record all function output in table.
+        self.debug = debug
+        # Required to construct a unique name for moose.Table
+        self.subnetwork = None
+        # All moose.Table2 created while loading.
+        self.tables = [ ]
+        # compartment.Model which was loaded.
+        self.model = None
+        # Write recorded tables to <model name>.<format> with a moose.Streamer.
+        self.save_output = True
+        # Give every connected component (see decompose.py) its own solver.
+        self.split_components = False
+        # Name of simulator, see simulator.py. None uses the default one.
+        self.simulator = None
+
+# LoadContext of the load in progress, set by load( ) for its duration.
+context_ = None
+
+def use_simulator( name = None ):
+    """Load models into simulator name (moose or memory, see simulator.py).
+    """
+    global moose
+    moose = simulator.get( name )
+    return moose
 
-def do_constant_propagation_on_elem( elem ):
-    validElems = [ 'variable', 'reaction', 'species' ]
-    if elem.attrib.get('is_reduced', 'false') == 'true':
-        return
+def delete_model( ):
+    """Remove loaded models (/yacml) from simulator.
+    """
+    if moose is not None and moose.exists( '/yacml' ):
+        moose.delete( '/yacml' )
 
-    # Tuple of ordered and unorderd variables as dictionary
-    globalVars = get_global_variables( elem )
-    localVars = get_local_variables( elem )
-    if elem.tag in [ 'variable', 'parameter' ]:
-        # A variable may refer to another variable in its expression. It may
-        # also refer to another global variable.
-        # logger_.debug( 'Global variable  %s = %s' % ( elem.attrib['name'], globalVars ))
-        # logger_.debug( 'Local variable %s = %s' % ( elem.attrib['name'], localVars )) 
-        elem = replace_variable_value( elem, localVars, globalVars )
+def create( cls, path ):
+    """Create element of moose class cls (e.g. moose.Pool) at path. Created
+    elements are counted in performance report, see profiling.py.
+    """
+    profiling.count( 'moose.objects' )
+    profiling.count( 'moose.%s' % cls.__name__ )
+    return cls( path )
+
+def connect( src, src_field, dest, dest_field ):
+    """moose.connect which is counted in performance report.
+    """
+    profiling.count( 'moose.connect' )
+    return moose.connect( src, src_field, dest, dest_field )
 
 ##
-# @brief Do the constant propagation recursively.
+# @brief Do the constant propagation. See yparser/propagation.py.
 #
 # @param tree
 #
-# @return 
+# @return SymbolTable of tree.
 def do_constant_propagation( tree ):
-    listOfElems = []
-    queue = deque( [ tree ] )
-    while queue:
-        el = queue.popleft() 
-        listOfElems.append( el )
-        queue.extend( el )          # Append el children
-        
-    # Now pop elements at the back from the listOfElems and start propagating
-    # constant.
-    while listOfElems:
-        elem = listOfElems.pop( )
-        do_constant_propagation_on_elem( elem )
-
-def init_compartment( compt_name, geometry_xml, model ):
-    global globals_
-    geomType = geometry_xml.attrib['shape']
+    return propagation.propagate( tree )
+
+def init_compartment( compt_ir, model ):
+    geomType = compt_ir.shape
     compt, volume = None, 0.0
-    comptPath = '%s/%s' % ( model.path, compt_name )
+    comptPath = '%s/%s' % ( model.path, compt_ir.name )
+    geometry = compt_ir.geometry
     if geomType == 'cube':
-        compt = moose.CubeMesh( comptPath )
-        compt.volume = xml.get_value_from_parameter_xml( geometry_xml, 'volume' )
+        compt = create( moose.CubeMesh, comptPath )
+        compt.volume = geometry[ 'volume' ]
         volume = compt.volume
     elif geomType == 'cylinder':
-        compt = moose.CylMesh( comptPath )
+        compt = create( moose.CylMesh, comptPath )
         compt.x0, compt.y0, compt.z0 = 0, 0, 0
-        compt.x1 = xml.get_value_from_parameter_xml( geometry_xml, 'length' )
+        compt.x1 = geometry[ 'length' ]
         compt.y1, compt.z1 = compt.y0, compt.z0
-        compt.r0 = compt.r1 = xml.get_value_from_parameter_xml( geometry_xml, 'radius' )
-        volume = xml.get_value_from_parameter_xml( geometry_xml, 'volume' )
+        compt.r0 = compt.r1 = geometry[ 'radius' ]
+        volume = geometry[ 'volume' ]
         compt.volume = volume
     else:
-        compt = moose.CubeMesh( comptPath )
-        compt.volume = xml.get_value_from_parameter_xml( geometry_xml, 'volume' )
+        compt = create( moose.CubeMesh, comptPath )
+        compt.volume = geometry[ 'volume' ]
         volume = compt.volume
         logger_.warn( 'Unsupported compartment type %s. Using cube' % geomType )
     logger_.debug( '|| Added compartment\n\t %s' % helper.compt_info( compt ) )
     assert volume > 0, "Volume of compartment must be > 0.0 "
-    globals_['volume'] = volume
+    context_.globals['volume'] = volume
     return compt
 
-def load_compartent( compt_xml, model ):
-    # Load a given XML compartment into moose.
+def load_compartent( compt_ir, model ):
+    # Load a given compartment into moose.
     logger_.info( 'Loading compartment into moose' )
-    comptName = compt_xml.attrib['name']
-    geometry = compt_xml.find( 'geometry' )
-    assert geometry is not None, "Need geometry information"
-    compt = init_compartment( comptName, geometry, model )
-    return compt
+    with profiling.stage( 'compartments' ):
+        return init_compartment( compt_ir, model )
 
 def get_table_name( parent_name, name ):
-    global current_chemical_subnetwork_name_
-    return '%s.%s.%s' % ( current_chemical_subnetwork_name_, parent_name, name )
+    return '%s.%s.%s' % ( context_.subnetwork, parent_name, name )
 
 ##
 # @brief Replace other chemical species with x0, x1, x2 etc. Return the new
@@ -202,72 +150,64 @@ def get_table_name( parent_name, name ):
 #
 # @return 
 def rewrite_function_expression( expr ):
-    global globals_
-    allIds = helper.get_ids( expr )
+    globalVars = context_.globals
     replacePairs = []
-    ids = set()
-    ignoreIds = [ 't' ] + globals_.keys()
-
-    for i in allIds:
-        if i not in ignoreIds:
-            ids.add( i )
-        elif i in globals_.keys():
-            expr = expr.replace( i, str(globals_[i]) )
-
-    for i, x in enumerate(ids):
-        found, replaceWith = x, 'x%s' % i
-        expr = expr.replace( found, replaceWith )
-        replacePairs.append( (found, replaceWith ) )
-    return replacePairs, expr
+    values = { }
+
+    # Whole identifiers are replaced in one pass, so species a does not touch
+    # ab and t does not touch tau.
+    for i in helper.get_ids( expr ):
+        if i in values:
+            continue
+        if i in globalVars:
+            values[ i ] = str( globalVars[i] )
+        elif i != 't':
+            replaceWith = 'x%s' % len( replacePairs )
+            values[ i ] = replaceWith
+            replacePairs.append( ( i, replaceWith ) )
+    return replacePairs, expression.substitute( expr, values )
 
 def attach_parateter_to_reac( param, reac, chem_net_path ):
-    global debugMode_
-    fieldName = param.attrib[ 'name' ]
-    fieldName = moose_dict_.get( fieldName, fieldName )
-    if param.attrib[ 'is_reduced' ] == 'true':
-        val = helper.to_float( param.text )
+    fieldName = moose_dict_.get( param.name, param.name )
+    if param.value is not None:
+        val = param.value
         reac.setField( fieldName, val )
         logger_.debug( '|| Parameter %s.%s=%s' % (reac.path, fieldName, val))
     else:
-        f = moose.Function( '%s/func_%s' % ( reac.path, fieldName ) )
-        connections, expr = rewrite_function_expression( param.text )
+        f = create( moose.Function, '%s/func_%s' % ( reac.path, fieldName ) )
+        connections, expr = rewrite_function_expression( param.expr )
         f.x.num = len( connections )
         for i, (x, y) in enumerate( connections ):
             mooseElem = moose.element( '%s/%s' % ( chem_net_path, x ) )
             if fieldName.lower() in [ 'numkf', 'numkb' ]:
-                moose.connect( mooseElem, 'nOut', f.x[i], 'input' )
+                connect( mooseElem, 'nOut', f.x[i], 'input' )
             else:
-                moose.connect( mooseElem, 'concOut', f.x[i], 'input' )
+                connect( mooseElem, 'concOut', f.x[i], 'input' )
         f.expr = expr
         reacF = 'set' + fieldName[0].upper() + fieldName[1:]
         logger_.debug(
                 '|| Parameter (expr) %s.%s = %s' % ( reac.path, reacF, f.expr )
                 )
         logger_.debug( '|| Added connections %s' % connections )
-        moose.connect( f, 'valueOut', reac, reacF )
-        if debugMode_:
-            ft = moose.Table2( '%s/tab_%s' % ( reac.path, fieldName ) )
-            moose.connect( ft, 'requestOut', f, 'getValue' )
+        connect( f, 'valueOut', reac, reacF )
+        if context_.debug:
+            ft = create( moose.Table2, '%s/tab_%s' % ( reac.path, fieldName ) )
+            connect( ft, 'requestOut', f, 'getValue' )
             ft.columnName = get_table_name( reac.name, fieldName )
-            tables_.append( ft )
+            context_.tables.append( ft )
 
 
 def attach_table_to_species( moose_pool, field_name ):
     """Create a moose.Table to read the field_name 
     """
-    global tables_
-    global current_chemical_subnetwork_name_
     tabPath = '%s/table_%s' % (moose_pool.path, field_name) 
-    tab = moose.Table2( tabPath )
+    tab = create( moose.Table2, tabPath )
     logger_.info( 'Created %s' % tab )
-    tab.columnName = '%s.%s.%s' % ( current_chemical_subnetwork_name_
-            , moose_pool.name
-            , field_name 
-            )
+    tab.columnName = get_table_name( moose_pool.name, field_name )
     getField = 'get' + field_name[0].upper() + field_name[1:]
     try:
-        moose.connect( tab, 'requestOut', moose_pool, getField )
-        tables_.append( tab )
+        connect( tab, 'requestOut', moose_pool, getField )
+        context_.tables.append( tab )
     except Exception as e:
         logger_.warn( 'Failed to add a Table on %s.%s' % ( moose_pool.path,
             field_name )
@@ -279,16 +219,15 @@ def attach_table_to_species( moose_pool, field_name ):
 # possible, use moose.Function to set things up.
 #
 # @param pool
-# @param pool_xml
+# @param param compartment.Parameter N or conc.
 #
 # @return 
-def set_pool_conc( pool, pool_xml, compt_path ):
+def set_pool_conc( pool, param, compt_path ):
     # Set pool properties.
-    expr, isReduced = helper.reduce_expr(pool_xml.text)
-    fieldName = pool_xml.attrib['name'].lower( )
+    fieldName = param.name.lower( )
     # Make sure that things are intialized properly
-    if isReduced == 'true':
-        pool.setField( '%sInit' % fieldName, float(expr) )
+    if param.value is not None:
+        pool.setField( '%sInit' % fieldName, param.value )
         logger_.debug( 
                 '-- Set field %sInit = %s' % (
                     fieldName, pool.getField( '%sInit' % fieldName ) )
@@ -297,119 +236,105 @@ def set_pool_conc( pool, pool_xml, compt_path ):
 
     # If not reduced to a simple float value, need a function to update the
     # concentrations etc.
-    connections, expr = rewrite_function_expression( expr )
-    f = moose.Function( '%s/func_set_%s' % ( pool.path, fieldName ) )
+    connections, expr = rewrite_function_expression( param.expr )
+    f = create( moose.Function, '%s/func_set_%s' % ( pool.path, fieldName ) )
     f.expr = expr 
     f.x.num = len( connections )
     for i, (x, y) in enumerate( connections ):
         poolpath = '%s/%s' % ( compt_path, x )
         assert moose.exists( poolpath ), '%s does not exists' % poolpath
-        moose.connect( poolpath, '%sOut' % fieldName, f.x[i], 'input' )
+        connect( poolpath, '%sOut' % fieldName, f.x[i], 'input' )
         logger_.debug( 
                 '||| Connecting %s.%s to function input' % ( poolpath, fieldName )
             )
     try:
         toSet = 'set%s%s' % ( fieldName[0].upper(), fieldName[1:] )
-        moose.connect( f, 'valueOut', pool, toSet )
+        connect( f, 'valueOut', pool, toSet )
         logger_.debug( '\tSet field %s = %s' % ( toSet, f.expr) )
     except Exception as e:
         logger_.error( "I cannot use this expression on Function" )
         logger_.error( "\t The expr was %s" % expr )
         logger_.error( "\t The error was %s" % e )
 
-def load_species( species_xml, root_path ):
-    """Load a species XML into MOOSE under root_path 
+def load_species( species, root_path ):
+    """Load a compartment.Species into MOOSE under root_path 
 
          root_path is the path of recipe instantiation.
     """
-    global current_chemical_subnetwork_name_
-    speciesPath = '%s/%s' % ( root_path, species_xml.attrib['name'] )
+    speciesPath = '%s/%s' % ( root_path, species.name )
 
     # This is neccessary to construct unique names for tables.
-    current_chemical_subnetwork_name_ = root_path.split('/')[-1]
+    context_.subnetwork = root_path.split('/')[-1]
 
     assert not moose.exists( speciesPath ), 'Already exists %s' % speciesPath
-    if species_xml.attrib.get('is_buffered', 'false' ) == 'true':
-        pool = moose.BufPool( speciesPath )
+    if species.buffered:
+        pool = create( moose.BufPool, speciesPath )
     else:
-        pool = moose.Pool( speciesPath )
+        pool = create( moose.Pool, speciesPath )
 
     # Just to be safe.
     pool.nInit = 0.0
 
-    if 'diffusion_constant' in species_xml.attrib:
-        pool.diffConst = helper.to_float( species_xml.attrib['diffusion_constant'] )
+    if species.diffusion_constant is not None:
+        pool.diffConst = species.diffusion_constant
 
-    params = species_xml.xpath( 'parameter' )
-    assert params, 'Need at least N or conc field'
-    for p in params:
-        if p.attrib['name'].lower() in [ 'n', 'conc' ]:
-            set_pool_conc( pool, p, root_path )
+    for p in species.params:
+        set_pool_conc( pool, p, root_path )
 
-    recordElem = species_xml.xpath( 'variable[@name="record"]' )
-    if recordElem:
-        attach_table_to_species( pool, recordElem[0].text )
+    if species.record:
+        attach_table_to_species( pool, species.record )
 
     logger_.info( 'Created %s \n\t|| %s' % (pool, helper.pool_info(pool) ) )
-    return p
+    return pool
 
-def load_reaction( reac_xml, chem_net_path ):
-    logger_.info( 'Loading reaction %s' % reac_xml.attrib['name'] )
-    instOf  = reac_xml.attrib.get( 'instance_of', None )
-    reacPath = '%s/%s' % ( chem_net_path, reac_xml.attrib['name'] )
+def load_reaction( reac, net, chem_net_path ):
+    logger_.info( 'Loading reaction %s' % reac.name )
+    reacPath = '%s/%s' % ( chem_net_path, reac.name )
 
     assert not moose.exists( reacPath ), 'reaction already exists %s' % reacPath
-    r = moose.Reac( reacPath )
+    r = create( moose.Reac, reacPath )
 
-    for sub in reac_xml.xpath( 'substrate' ):
-        subName = sub.text
-        subPool = moose.element( '%s/%s' % (chem_net_path, subName ) ) 
-        for i in range( int( sub.attrib['stoichiometric_number']) ):
+    for i, n in zip( reac.substrates, reac.substrate_stoich ):
+        subPool = moose.element( '%s/%s' % (chem_net_path, net.species[i].name ) ) 
+        for j in range( n ):
             logger_.debug( '|| Adding subtrate %s' % subPool.path )
-            moose.connect( r, 'sub', subPool, 'reac' )
-    for prd in reac_xml.xpath( 'product' ):
-        prdName = prd.text
-        prdPool = moose.element( '%s/%s' % (chem_net_path, prdName ) ) 
-        for i in range( int( prd.attrib['stoichiometric_number']) ):
+            connect( r, 'sub', subPool, 'reac' )
+    for i, n in zip( reac.products, reac.product_stoich ):
+        prdPool = moose.element( '%s/%s' % (chem_net_path, net.species[i].name ) ) 
+        for j in range( n ):
             logger_.debug( '|| Adding product  %s' % prdPool.path )
-            moose.connect( r, 'prd', prdPool, 'reac' )
-    if instOf:
-        rInst = xml.find_reaction_instance( reac_xml.getparent(), instOf )
-        params = rInst.xpath( 'parameter' )
-    else:
-        params = reac_xml.xpath( 'parameter' )
+            connect( r, 'prd', prdPool, 'reac' )
+    [ attach_parateter_to_reac( p, r, chem_net_path ) for p in reac.params ]
+    return r
 
-    assert len(params) > 1, "Need at least kf/kb, numKf/numKb"
-    [ attach_parateter_to_reac( p, r, chem_net_path ) for p in params ]
-
-def setup_solver( compt_xml, compt ):
+def setup_solver( compt_ir, compt ):
     """Setup solver in each compartment.
 
     """
     logger_.info( "Setting up solver in compartment %s" % compt.path )
     stoichPath = '%s/stoich' % compt.path 
     assert not moose.exists( stoichPath )
-    st = moose.Stoich( stoichPath )
-    if compt_xml.attrib['type'] == "stochastic":
+    st = create( moose.Stoich, stoichPath )
+    if compt_ir.type == "stochastic":
         logger_.info( '\tAdded stochastic solver' )
-        s = moose.Gsolve( '%s/gsolve' % st.path )
+        s = create( moose.Gsolve, '%s/gsolve' % st.path )
         # This is essential otherwise the stimulus will not be computed.
         s.useClockedUpdate = True
     else:
-        s = moose.Ksolve( '%s/ksolve' % st.path )
+        s = create( moose.Ksolve, '%s/ksolve' % st.path )
         logger_.info( '\tAdded deterministic solver' )
 
     st.compartment = compt
     st.ksolve = s
 
     # Enable diffusion in compartment.
-    diffusion = compt_xml.attrib.get( "diffusion_length", 0 )
+    diffusion = compt_ir.diffusion_length
     if diffusion:
-        dsolve = moose.Dsolve( '%s/dsolve' % st.path )
+        dsolve = create( moose.Dsolve, '%s/dsolve' % st.path )
         st.dsolve = dsolve
         logger_.info( '\tEnabled diffusion in compartment' )
         try:
-            compt.diffLength = float( diffusion[0].text )
+            compt.diffLength = diffusion
             logger_.info( '\t\tdiffLength is set to %s' % compt.diffLength )
         except Exception as e:
             logger_.warn( 
@@ -422,24 +347,24 @@ def setup_solver( compt_xml, compt ):
 def setup_recorder( ):
     """Setup a moose.Streamer to store all tables into one file.
     """
-    global tables_
     assert not moose.exists( '/yacml/streamer' )
-    streamer = moose.Streamer( '/yacml/streamer' )
+    streamer = create( moose.Streamer, '/yacml/streamer' )
     logger_.debug( 'Added streamer %s' % streamer )
-    streamer.addTables( tables_ )
-    logger_.debug( '|| Tables %s' % str( tables_) )
+    streamer.addTables( context_.tables )
+    logger_.debug( '|| Tables %s' % str( context_.tables ) )
     return streamer
 
-def load_chemical_reactions_in_compartment( subnetwork, compt ):
+def load_chemical_reactions_in_compartment( net, compt ):
     logger_.info( 'Loading chemical reaction network in compartment %s' % compt )
-    netPath = '%s/%s' % ( compt.path, subnetwork.attrib['name'] )
-    moose.Neutral( netPath )
-    [ load_species( c, netPath ) for c in subnetwork.xpath('species' ) ]
-    [ load_reaction( r, netPath ) for r in subnetwork.xpath('reaction') ]
+    netPath = '%s/%s' % ( compt.path, net.name )
+    create( moose.Neutral, netPath )
+    with profiling.stage( 'species' ):
+        [ load_species( sp, netPath ) for sp in net.species ]
+    with profiling.stage( 'reactions' ):
+        [ load_reaction( r, net, netPath ) for r in net.reactions ]
 
 def print_summary( ):
-    global modelname_
-    togv.write_graphviz( modelname_ )
+    togv.write_graphviz( context_.modelname, context_.model )
     pools = moose.wildcardFind( '/yacml/##[TYPE=PoolBase]' )
     zombiePools = moose.wildcardFind( '/yacml/##[TYPE=ZombiePool]' )
     summary = ''
@@ -453,68 +378,115 @@ def print_summary( ):
     print( 'Summary : ')
     print( "=".join( [ ] * 80 ) )
     print( summary )
+    if context_.debug:
+        # analysis needs scipy, which is not required to load into MOOSE.
+        import analysis
+        net = analysis.ReactionNetwork( context_.model )
+        for m in net.moieties( net.conservation_laws( ) ):
+            logger_.info( 'Conserved moiety: %s' % m )
 
 
-def setup_run( sim_xml, streamer = None ):
-    global modelname_
-    simTime = helper.to_float( sim_xml.attrib['sim_time'] )
+def setup_run( simulator, streamer = None ):
+    """Run model with the attributes of simulator element (a dictionary).
+    """
+    simTime = helper.to_float( simulator['sim_time'] )
     logger_.info( 'Running MOOSE for %s seconds' % simTime )
-    if sim_xml.attrib.get('format') is not None:
-        format_ = sim_xml.attrib[ 'format' ]
+    if simulator.get('format') is not None:
+        format_ = simulator[ 'format' ]
     else:
         format_ = 'csv'
     if streamer is not None:
-        streamer.outfile = '%s.%s' %  ( modelname_, format_ )
+        streamer.outfile = '%s.%s' %  ( context_.modelname, format_ )
         logger_.info( 'Saving streamer file to %s' % streamer.outfile )
 
     # If plot_dt is defined, use it. Only effective on moose.Table2.
     # By default it is per 1 seconds.
-    if sim_xml.attrib.get( 'record_dt', False ):
-        moose.setClock( 18, helper.to_float( sim_xml.attrib['record_dt' ] ) )
-        logger_.debug( "|| Set dt of moose.Table2 = %s" % sim_xml.attrib['record_dt'] )
-    moose.reinit( )
+    if simulator.get( 'record_dt', False ):
+        moose.setClock( 18, helper.to_float( simulator['record_dt' ] ) )
+        logger_.debug( "|| Set dt of moose.Table2 = %s" % simulator['record_dt'] )
+    with profiling.stage( 'reinit' ):
+        moose.reinit( )
     print_summary( )
-    moose.start( simTime, 1 )
+    with profiling.stage( 'run' ):
+        moose.start( simTime, 1 )
+
+def load_xml( tree, context = None ):
+    """Load a given YACML AST in XML format (already propagated) into MOOSE,
+    with a new LoadContext by default. Return moose.Tables with data.
+    """
+    return simulate( ir.build_model( tree ), context or LoadContext( ) )
 
-def load_xml( xml ):
-    """Load a given YACML AST in XML format into MOOSE.
-    Return moose.Tables with data.
+def load_model( model_ir ):
+    """Load a compartment.Model into MOOSE. Return moose.Tables with data.
     """
+    context_.model = model_ir
+    if context_.split_components:
+        # Each independent component gets a compartment and solver of its own.
+        # decompose needs scipy, imported only here.
+        import decompose
+        model_ir = decompose.component_model( model_ir )
     # First get all the compartments and create them.
-    global tables_
-    global modelname_
-    modelname_ = xml.find('model').attrib['name']
-    moose.Neutral( '/yacml' )
-    model = moose.Neutral( '/yacml/%s' % modelname_ )
+    context_.modelname = model_ir.name
+    create( moose.Neutral, '/yacml' )
+    model = create( moose.Neutral, '/yacml/%s' % context_.modelname )
     compts = {}
-    for c in xml.xpath( '/yacml/model/compartment' ):
-        compts[c.attrib['name'] ] = compt = load_compartent( c, model )
-        for x in c.xpath( 'chemical_reaction_subnetwork' ):
-            load_chemical_reactions_in_compartment( x, compt )
-        setup_solver( c, compt )
-    st = setup_recorder( )
-
-    simulator = xml.xpath( '/yacml/model/simulator' )
-    if simulator:
-        setup_run( simulator[0], st )
-    return tables_
+    for c in model_ir.compartments:
+        compts[ c.name ] = compt = load_compartent( c, model )
+        for net in c.networks:
+            load_chemical_reactions_in_compartment( net, compt )
+        with profiling.stage( 'solver' ):
+            setup_solver( c, compt )
+    st = None
+    if context_.save_output:
+        with profiling.stage( 'recorder' ):
+            st = setup_recorder( )
+
+    if model_ir.simulator:
+        setup_run( model_ir.simulator, st )
+    return context_.tables
+
+def simulate( model_ir, context ):
+    """Load a compartment.Model into MOOSE and run it, with context as the
+    LoadContext of this load. Return moose.Tables with data.
+    """
+    global context_
+    context_ = context
+    use_simulator( context.simulator )
+    try:
+        return load_model( model_ir )
+    finally:
+        context_ = None
 
 ##
 # @brief Load yacml XML model into MOOSE.
 #
 # @param xml Input model AST in XML.
+# @param context LoadContext which collects tables etc. of this load. A new one
+#   is used by default.
+# @param kwargs debug = True records all function outputs, propagate = False
+#   skips constant propagation when xml is already propagated, save_output =
+#   False does not write recorded tables to a file, split_components = True
+#   gives every independent component of model its own solver, simulator =
+#   'memory' loads model into memsim instead of MOOSE.
 #
-# @return  Root path of model in MOOSE, /yacml.
-def load( xml, **kwargs ):
+# @return  The loaded AST.
+def load( xml, context = None, **kwargs ):
+    if context is None:
+        context = LoadContext( )
+    context.debug = kwargs.get( 'debug', context.debug )
+    context.save_output = kwargs.get( 'save_output', context.save_output )
+    context.split_components = kwargs.get( 'split_components', context.split_components )
+    context.simulator = kwargs.get( 'simulator', context.simulator )
+    logger_.info( 'Debug == %s' % context.debug )
     # Before loading AST xml into MOOSE, replace each variable by its value
     # whenever posiible.
-    global debugMode_
-    debugMode_ = kwargs.get( 'debug', False )
-    logger_.info( 'Debug == %s' % debugMode_ )
-    do_constant_propagation( xml )
-    load_xml( xml )
+    if kwargs.get( 'propagate', True ):
+        do_constant_propagation( xml )
+    with profiling.stage( 'ir' ):
+        model = ir.build_model( xml )
+    simulate( model, context )
     outfile = '/tmp/yacml.xml' 
-    with open( outfile, 'w' ) as f:
+    with profiling.stage( 'dump' ), open( outfile, 'w' ) as f:
         f.write( etree.tostring( xml, pretty_print = True ) )
     logger_.info( '[INFO] Flattened xml is written to %s' % outfile )
     return xml
@@ -0,0 +1,485 @@
+"""yacml2scipy.py: 
+
+Simulate a YACML model deterministically with scipy, without MOOSE.
+
+Selected by 'simulator scipy [ ... ];' in model. Reactions are mass-action;
+the right hand side and its sparse jacobian are computed with vectorized
+numpy/scipy.sparse operations on the matrices of analysis.ReactionNetwork and
+integrated with scipy.integrate.solve_ivp (LSODA by default). Concentrations
+are in mM and volumes in m^3, as in MOOSE.
+
+Recorded species are written to <model name>.<format> (csv or npy) in the
+columns of moose.Streamer: time and subnetwork.pool.field.
+
+A species whose conc or N is an expression of other species or time is set
+to its value at each step, as yacml2moose does with a moose.Function; it is
+not integrated.
+
+Attributes of simulator: sim_time, record_dt (default 1), format (csv or npy),
+method (any method of solve_ivp), rtol, atol and conservation. With
+conservation = reduce, species which are fixed by conservation laws (see
+analysis.ReactionNetwork.conservation_laws) are eliminated and only the
+independent ones are integrated; with conservation = outputs, the conserved
+totals are written as columns conserved.0, conserved.1 ... as well.
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import numpy as np
+import scipy.sparse as sparse
+from scipy.integrate import solve_ivp
+from collections import OrderedDict
+
+import config
+import analysis
+import profiling
+import compartment as ir
+from utils import helper
+from yparser import propagation
+from yparser.expression import Expression
+
+logger_ = config.logger_
+
+# Avogadro number as used by MOOSE.
+NA_ = 6.0221415e23
+
+# Values of conservation attribute of simulator.
+conservation_ = [ 'none', 'reduce', 'outputs' ]
+
+class Table( object ):
+    """Recorded values of a species; same fields as moose.Table2 used by
+    yacml2moose.
+    """
+
+    def __init__( self, columnName, vector = None ):
+        self.columnName = columnName
+        self.vector = vector
+
+class LoadContext( object ):
+    """State of one load of a model: the model, its OdeModel and tables.
+    """
+
+    def __init__( self, debug = False ):
+        self.debug = debug
+        self.modelname = None
+        self.model = None
+        self.ode = None
+        self.time = None
+        self.tables = [ ]
+        # Write results to <model name>.<format>.
+        self.save_output = True
+
+class RateExpression( object ):
+    """Rate of a reaction direction which is an expression of species or
+    time, evaluated at each step.
+    """
+    __slots__ = [ 'column', 'code', 'inputs', 'scale', 'num', 'volume' ]
+
+    def __init__( self, column, code, inputs, scale, num, volume ):
+        self.column = column
+        self.code = code
+        # Name in expression : index of species.
+        self.inputs = inputs
+        # Factor which converts the value to concentration units.
+        self.scale = scale
+        # Species are given as numbers (numKf, numKb) instead of conc.
+        self.num = num
+        # Volume of compartment of reaction.
+        self.volume = volume
+
+class SpeciesExpression( object ):
+    """conc or N of a species which is an expression of other species or
+    time. As with moose.Function in yacml2moose, the species is set to it at
+    each step instead of being integrated.
+    """
+    __slots__ = [ 'index', 'code', 'inputs', 'num', 'volume' ]
+
+    def __init__( self, index, code, inputs, num, volume ):
+        self.index = index
+        self.code = code
+        # Name in expression : index of species.
+        self.inputs = inputs
+        # Expression is of numbers of molecules (N) instead of conc.
+        self.num = num
+        # Volume of compartment of species.
+        self.volume = volume
+
+class OdeModel( object ):
+    """Mass-action ODEs of a compartment.Model.
+    """
+
+    def __init__( self, model ):
+        self.model = model
+        net = analysis.ReactionNetwork( model )
+        self.network = net
+        nS, nR = net.shape
+        self.species = net.species
+        self.y0 = np.zeros( nS )
+        self.buffered = np.zeros( nS, dtype = bool )
+        # Number of molecules per mM.
+        self.molecules = NA_ * net.volume
+
+        self.columns = [ ]
+        self.rate_exprs = [ ]
+        self.species_exprs = [ ]
+        k = np.zeros( 2 * nR )
+        # Volume of compartment of each (irreversible) reaction.
+        self.reaction_volume = np.zeros( 2 * nR )
+        i = 0
+        j = 0
+        for compt, subnet in model.networks( ):
+            start = i
+            for sp in subnet.species:
+                self.init_species( i, sp, subnet, compt, start )
+                if sp.record:
+                    self.columns.append( (
+                        '%s.%s.%s' % ( subnet.name, sp.name, sp.record ), i, sp.record )
+                        )
+                i += 1
+            for r in subnet.reactions:
+                self.init_rates( k, j, r, subnet, compt, i - len( subnet.species ) )
+                j += 1
+
+        N, order, _ = net.irreversible( )
+        # Buffered species and species set by expressions do not change.
+        keep = sparse.diags( ( ~self.buffered ).astype( float ) )
+        self.N = ( keep * N ).tocsr( )
+        self.k = k
+
+        # Reactant terms ordered by reaction: entry e is species rows[e] of
+        # reaction cols[e] with order orders[e].
+        order = order.tocsc( )
+        order.sort_indices( )
+        self.rows = order.indices
+        self.orders = order.data.astype( float )
+        counts = np.diff( order.indptr )
+        self.cols = np.repeat( np.arange( 2 * nR ), counts )
+        self.starts = order.indptr[ :-1 ][ counts > 0 ]
+        self.has_reactants = counts > 0
+        # Position of each term within its reaction, for the jacobian.
+        self.slot = np.arange( self.rows.size ) - np.repeat( order.indptr[ :-1 ], counts )
+        self.width = max( [ 1 ] + list( counts ) )
+        self.jac_pattern = sparse.csr_matrix( ( np.ones( self.rows.size )
+            , ( self.cols, self.rows ) ), shape = ( 2 * nR, nS ) )
+        # Set by reduce: y = projection * z + offset where z are independent
+        # species.
+        self.independent = None
+        self.projection = None
+        self.offset = None
+        self.reduced_N = None
+        self.laws = None
+        self.y0 = self.assign_species( 0.0, self.y0 )
+
+    def init_species( self, i, sp, subnet, compt, offset ):
+        self.buffered[ i ] = sp.buffered
+        for p in sp.params:
+            if p.value is None:
+                self.species_exprs.append( SpeciesExpression( i, Expression( p.expr )
+                    , self.inputs( p.expr, subnet, offset, self.species[ i ] )
+                    , p.name.lower( ) == 'n', compt.volume ) )
+                self.buffered[ i ] = True
+                logger_.debug( '|| %s of %s is %s' % ( p.name, sp.name, p.expr ) )
+            elif p.name.lower( ) == 'n':
+                self.y0[ i ] = p.value / self.molecules[ i ]
+            else:
+                self.y0[ i ] = p.value
+
+    def init_rates( self, k, j, reaction, subnet, compt, offset ):
+        """Set k[ j ] (forward) and k[ j + R ] (backward) in concentration
+        units. Rates which are expressions are evaluated while running.
+        """
+        nR = len( self.network.reactions )
+        rates = dict( [ ( p.name.lower( ), p ) for p in reaction.params ] )
+        num = 'kf' not in rates and 'numkf' in rates
+        for column, name, stoich in [ ( j, 'kf', reaction.substrate_stoich )
+                , ( j + nR, 'kb', reaction.product_stoich ) ]:
+            self.reaction_volume[ column ] = compt.volume
+            p = rates.get( ( 'num' if num else '' ) + name )
+            if p is None:
+                continue
+            scale = 1.0
+            if num:
+                # numKf is per molecule; convert to conc units.
+                order = int( stoich.sum( ) )
+                scale = ( NA_ * compt.volume ) ** ( order - 1 )
+            if p.value is not None:
+                k[ column ] = p.value * scale
+                continue
+            code = Expression( p.expr )
+            inputs = self.inputs( p.expr, subnet, offset, 'rate of %s' %
+                    self.network.reactions[ j ] )
+            self.rate_exprs.append( 
+                    RateExpression( column, code, inputs, scale, num, compt.volume )
+                    )
+            logger_.debug( '|| Rate %s of %s is %s' % ( name, reaction.name, p.expr ) )
+
+    def inputs( self, expr, subnet, offset, what ):
+        """Name in expr : index of species, for species of subnet whose first
+        species has index offset. t and volume are given when evaluated.
+        """
+        inputs = { }
+        for x in Expression( expr ).names:
+            if x in subnet.species_index:
+                inputs[ x ] = offset + subnet.species_index[ x ]
+            elif x not in [ 't', 'volume' ]:
+                raise NameError( 'Unknown name %s in %s of %s' % ( x, expr, what ) )
+        return inputs
+
+    def assign_species( self, t, y ):
+        """y with species which are set by expressions evaluated at time t,
+        in order of declaration.
+        """
+        if not self.species_exprs:
+            return y
+        y = y.copy( )
+        for e in self.species_exprs:
+            values = { 't' : t, 'volume' : e.volume }
+            for x, i in e.inputs.items( ):
+                values[ x ] = y[ i ] * self.molecules[ i ] if e.num else y[ i ]
+            value = e.code( values )
+            y[ e.index ] = value / self.molecules[ e.index ] if e.num else value
+        return y
+
+    def rates( self, t, y ):
+        """Rate constants at time t and concentrations y.
+        """
+        if not self.rate_exprs:
+            return self.k
+        k = self.k.copy( )
+        for e in self.rate_exprs:
+            values = { 't' : t, 'volume' : e.volume }
+            for x, i in e.inputs.items( ):
+                values[ x ] = y[ i ] * self.molecules[ i ] if e.num else y[ i ]
+            k[ e.column ] = e.code( values ) * e.scale
+        return k
+
+    def terms( self, y ):
+        return np.power( y[ self.rows ], self.orders )
+
+    def velocity( self, t, y ):
+        """Rate of each (irreversible) reaction.
+        """
+        v = self.rates( t, y ).copy( )
+        if self.starts.size:
+            v[ self.has_reactants ] *= np.multiply.reduceat( self.terms( y ), self.starts )
+        return v
+
+    def rhs( self, t, y ):
+        return self.N.dot( self.velocity( t, self.assign_species( t, y ) ) )
+
+    def velocity_jacobian( self, t, y ):
+        """Sparse derivatives of velocity (reactions x species). Rates which
+        are expressions of species are taken as constant.
+        """
+        k = self.rates( t, y )
+        terms = self.terms( y )
+        # Reactant terms of each reaction side by side, padded with 1.
+        padded = np.ones( ( len( self.k ), self.width ) )
+        padded[ self.cols, self.slot ] = terms
+        others = np.empty_like( terms )
+        for s in range( self.width ):
+            sel = self.slot == s
+            p = padded.copy( )
+            p[ :, s ] = 1.0
+            others[ sel ] = np.prod( p[ self.cols[ sel ] ], axis = 1 )
+        deriv = self.orders * np.power( y[ self.rows ], self.orders - 1 )
+        dv = k[ self.cols ] * deriv * others
+        return sparse.csr_matrix( ( dv, ( self.cols, self.rows ) )
+                , shape = self.jac_pattern.shape )
+
+    def jacobian( self, t, y ):
+        """Sparse jacobian of rhs. Species which are set by expressions are
+        taken as constant.
+        """
+        y = self.assign_species( t, y )
+        return ( self.N * self.velocity_jacobian( t, y ) ).tocsc( )
+
+    def conservation_laws( self ):
+        """Conservation laws of model (laws x species, CSR), computed once.
+        """
+        if self.laws is None:
+            self.laws = self.network.conservation_laws( )
+        return self.laws
+
+    def totals( self, y ):
+        """Conserved totals of concentrations y (species x ...).
+        """
+        return self.conservation_laws( ).dot( y )
+
+    def reduce( self ):
+        """Eliminate one species per conservation law: y = projection * z +
+        offset where z are the independent species. Of each law the species
+        with the largest initial concentration is eliminated; computing a
+        small species as a difference of large ones loses precision. Return
+        number of species eliminated.
+        """
+        L = self.conservation_laws( )
+        nS = len( self.y0 )
+        rows = [ dict( zip( L.getrow( k ).indices, L.getrow( k ).data ) )
+                for k in range( L.shape[ 0 ] ) ]
+        order = list( np.argsort( -self.y0, kind = 'mergesort' ) )
+        rref = analysis.integer_rref( rows, order )
+        dependent = set( [ col for col, r in rref ] )
+        self.independent = np.array( [ i for i in range( nS ) if i not in dependent ], dtype = int )
+        column = dict( [ ( i, k ) for k, i in enumerate( self.independent ) ] )
+        nI = len( self.independent )
+        pr, pc, pv = list( self.independent ), list( range( nI ) ), [ 1.0 ] * nI
+        self.offset = np.zeros( nS )
+        for col, r in rref:
+            p = float( r[ col ] )
+            self.offset[ col ] = sum( [ v * self.y0[ i ] for i, v in r.items( ) ] ) / p
+            for i, v in r.items( ):
+                if i != col:
+                    pr.append( col )
+                    pc.append( column[ i ] )
+                    pv.append( - v / p )
+        self.projection = sparse.csr_matrix( ( pv, ( pr, pc ) )
+                , shape = ( nS, len( self.independent ) ) )
+        self.reduced_N = self.N[ self.independent ]
+        logger_.info( 'Eliminated %d of %d species by conservation laws' % ( 
+            len( dependent ), nS ) )
+        return len( dependent )
+
+    def full_state( self, z ):
+        return self.projection.dot( z ) + ( self.offset if z.ndim == 1 else self.offset[ :, None ] )
+
+    def reduced_rhs( self, t, z ):
+        return self.reduced_N.dot( self.velocity( t, self.full_state( z ) ) )
+
+    def reduced_jacobian( self, t, z ):
+        y = self.full_state( z )
+        J = self.jacobian( t, y ).tocsr( )[ self.independent ]
+        return ( J * self.projection ).tocsc( )
+
+    def run( self, sim_time, dt = 1.0, method = 'LSODA', **options ):
+        """Integrate from 0 to sim_time and return times and concentrations
+        (species x times) sampled every dt. After reduce( ) only the
+        independent species are integrated.
+        """
+        times = sample_times( sim_time, dt )
+        if self.projection is None:
+            rhs, jac, y0 = self.rhs, self.jacobian, self.y0
+        else:
+            rhs, jac, y0 = self.reduced_rhs, self.reduced_jacobian, self.y0[ self.independent ]
+        if method in [ 'BDF', 'Radau' ]:
+            options.setdefault( 'jac', jac )
+        elif method == 'LSODA':
+            # LSODA takes only a dense jacobian; use BDF for large models.
+            options.setdefault( 'jac', lambda t, y: jac( t, y ).toarray( ) )
+        res = solve_ivp( rhs, ( 0.0, sim_time ), y0, method = method
+                , t_eval = times, **options )
+        if not res.success:
+            raise RuntimeError( 'Integration failed: %s' % res.message )
+        y = res.y if self.projection is None else self.full_state( res.y )
+        if self.species_exprs:
+            y = np.column_stack( [ self.assign_species( t, y[ :, c ] )
+                for c, t in enumerate( res.t ) ] ) if len( res.t ) else y
+        return res.t, y
+
+    def tables( self, y ):
+        """Recorded values in columns of moose.Streamer.
+        """
+        tables = OrderedDict( )
+        for name, i, field in self.columns:
+            if field.lower( ) == 'n':
+                tables[ name ] = y[ i ] * self.molecules[ i ]
+            else:
+                tables[ name ] = y[ i ]
+        return tables
+
+def sample_times( sim_time, dt ):
+    """Times 0, dt, 2 dt ... up to sim_time at which results are recorded.
+    """
+    times = np.arange( 0.0, sim_time + 0.5 * dt, dt )
+    return times[ times <= sim_time ]
+
+def write_output( filename, times, tables, format = 'csv' ):
+    """Write times and tables (column name : vector) to filename.
+    """
+    names = [ 'time' ] + list( tables.keys( ) )
+    data = np.vstack( [ times ] + [ tables[ n ] for n in names[ 1: ] ] ).T
+    if format == 'npy':
+        rec = np.zeros( len( times ), dtype = [ ( n, 'f8' ) for n in names ] )
+        for i, n in enumerate( names ):
+            rec[ n ] = data[ :, i ]
+        np.save( filename, rec )
+    else:
+        np.savetxt( filename, data, delimiter = ',', header = ','.join( names )
+                , comments = '' )
+    logger_.info( 'Saved results to %s' % filename )
+
+def simulate( model, context ):
+    """Run the ODEs of model with attributes of its simulator.
+    """
+    sim = model.simulator or { }
+    with profiling.stage( 'solver' ):
+        ode = OdeModel( model )
+    context.ode = ode
+    if any( [ c.type == 'stochastic' for c in model.compartments ] ):
+        logger_.warn( 'scipy backend is deterministic; stochastic compartments '
+                'are integrated as ODEs. Use simulator ssa to simulate them' )
+    options = { }
+    for k in [ 'rtol', 'atol' ]:
+        if k in sim:
+            options[ k ] = helper.to_float( sim[ k ] )
+    simTime = helper.to_float( sim.get( 'sim_time', '1' ) )
+    dt = helper.to_float( sim.get( 'record_dt', '1' ) )
+    method = sim.get( 'method', 'LSODA' ).strip( '"\'' )
+    conservation = sim.get( 'conservation', 'none' ).strip( '"\'' )
+    if conservation not in conservation_:
+        raise ValueError( 'Unknown conservation %s. Available: %s' % ( 
+            conservation, ', '.join( conservation_ ) ) )
+    if conservation != 'none' and ode.species_exprs:
+        raise ValueError( 'conservation = %s can not be used with species set by '
+                'expressions: %s' % ( conservation, ', '.join( [
+                    ode.species[ e.index ] for e in ode.species_exprs ] ) ) )
+    if conservation != 'none':
+        L = ode.conservation_laws( )
+        for k, m in enumerate( ode.network.moieties( L ) ):
+            logger_.info( 'Conserved %d: %s' % ( k, m ) )
+    if conservation == 'reduce':
+        ode.reduce( )
+    logger_.info( 'Running scipy (%s) for %s seconds' % ( method, simTime ) )
+    with profiling.stage( 'run' ):
+        times, y = ode.run( simTime, dt, method, **options )
+    tables = ode.tables( y )
+    if conservation == 'outputs':
+        for k, total in enumerate( ode.totals( y ) ):
+            tables[ 'conserved.%d' % k ] = total
+    context.time = times
+    context.tables = [ Table( n, v ) for n, v in tables.items( ) ]
+    format_ = sim.get( 'format', 'csv' ).strip( '"\'' )
+    if context.save_output:
+        write_output( '%s.%s' % ( model.name, format_ ), times, tables, format_ )
+    return context.tables
+
+##
+# @brief Simulate yacml XML model with scipy.
+#
+# @param xml Input model AST in XML.
+# @param context LoadContext which collects results. A new one is used by
+#   default.
+# @param kwargs propagate = False skips constant propagation when xml is
+#   already propagated, save_output = False does not write results to a file.
+#
+# @return  The loaded AST.
+def load( xml, context = None, **kwargs ):
+    if context is None:
+        context = LoadContext( )
+    context.debug = kwargs.get( 'debug', context.debug )
+    context.save_output = kwargs.get( 'save_output', context.save_output )
+    if kwargs.get( 'propagate', True ):
+        propagation.propagate( xml )
+    with profiling.stage( 'ir' ):
+        context.model = ir.build_model( xml )
+    context.modelname = context.model.name
+    simulate( context.model, context )
+    return xml
@@ -0,0 +1,387 @@
+"""yacml2ssa.py: 
+
+Stochastic simulation of a YACML model without MOOSE.
+
+Selected by 'simulator ssa [ ... ];' in model; all compartments are then
+simulated stochastically, in numbers of molecules. Three engines share one
+StochasticModel:
+
+    ssa         Gillespie's direct method. After a reaction fires only the
+                propensities of reactions which depend on the changed species
+                are recomputed (reaction dependency graph).
+    tau         Adaptive tau-leaping (Cao, Gillespie and Petzold 2006). Steps
+                in which few reactions are expected fall back to exact SSA
+                steps.
+    batch       Many independent replicates advanced together as numpy arrays
+                of shape replicates x species, with either of the above.
+
+Propensity of a reaction with rate numKf (rates in concentration units are
+converted with the volume of compartment) is numKf times, for each
+substrate, n (n-1) ... (n-s+1) where s is its stoichiometric number; this is
+the convention of moose.Gsolve. Rates and species which are expressions are
+not supported; such models are rejected with a ValueError before simulating.
+
+Attributes of simulator: sim_time, record_dt (default 1), method (ssa or
+tau), replicates (default 1), seed, epsilon (tau-leaping error bound, default
+0.03) and format (csv or npy). Results of replicates are written one after
+the other with a replicate column.
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import numpy as np
+import scipy.sparse as sparse
+from collections import OrderedDict
+
+import config
+import profiling
+import compartment as ir
+from utils import helper
+from yparser import propagation
+from yacml2scipy import NA_, OdeModel, Table, LoadContext, sample_times, write_output
+
+logger_ = config.logger_
+
+methods_ = [ 'ssa', 'tau' ]
+
+rates_ = [ 'kf', 'kb', 'numkf', 'numkb' ]
+
+# A leap in which fewer reactions than this are expected is replaced by an
+# exact SSA step.
+exact_threshold_ = 10.0
+
+def expressions( model ):
+    """Names of reactions whose rates are expressions and of species whose
+    conc or N is an expression, in model (compartment.Model).
+    """
+    reactions, species = [ ], [ ]
+    for compt, net in model.networks( ):
+        prefix = '%s/%s/' % ( compt.name, net.name )
+        for r in net.reactions:
+            if any( [ p.value is None for p in r.params
+                if p.name.lower( ) in rates_ ] ):
+                reactions.append( prefix + r.name )
+        for s in net.species:
+            if any( [ p.value is None for p in s.params ] ):
+                species.append( prefix + s.name )
+    return reactions, species
+
+def check_model( model ):
+    """Raise ValueError if model has rates or species which are expressions.
+    """
+    reactions, species = expressions( model )
+    if reactions:
+        raise ValueError( 'Rates which are expressions are not supported by the '
+                'stochastic backend; reactions: %s' % ', '.join( reactions ) )
+    if species:
+        raise ValueError( 'Species given by expressions are not supported by the '
+                'stochastic backend; species: %s' % ', '.join( species ) )
+
+class StochasticModel( object ):
+    """Reactions of a compartment.Model in numbers of molecules. Every
+    reaction is split in forward and backward reactions.
+    """
+
+    def __init__( self, model, seed = None ):
+        check_model( model )
+        ode = OdeModel( model )
+        self.model = model
+        self.species = ode.species
+        self.columns = ode.columns
+        self.molecules = ode.molecules
+        self.x0 = np.round( ode.y0 * ode.molecules )
+        self.N = ode.N
+        nS, nR = self.N.shape
+        self.rng = np.random.RandomState( seed )
+
+        # Reactant terms, as in OdeModel.
+        self.rows, self.cols = ode.rows, ode.cols
+        self.orders = ode.orders.astype( int )
+        self.starts, self.has_reactants = ode.starts, ode.has_reactants
+        self.max_order = self.orders.max( ) if self.orders.size else 0
+
+        # Stochastic rate constants from rates in concentration units.
+        order = np.bincount( self.cols, weights = self.orders, minlength = nR )
+        self.c = ode.k / ( NA_ * ode.reaction_volume ) ** ( order - 1 )
+
+        # Change of species when reaction j fires.
+        Nc = self.N.tocsc( )
+        self.change = [ ( Nc.indices[ Nc.indptr[j]:Nc.indptr[j+1] ]
+            , Nc.data[ Nc.indptr[j]:Nc.indptr[j+1] ] ) for j in range( nR ) ]
+        # Reactants of reaction j as (species, stoichiometric number).
+        self.reactants = [ [ ] for j in range( nR ) ]
+        for i, j, s in zip( self.rows, self.cols, self.orders ):
+            self.reactants[ j ].append( ( i, s ) )
+
+        # Dependency graph: reaction j changes the propensity of reactions in
+        # row j of depends.
+        pattern = sparse.csr_matrix( ( np.ones( self.rows.size ), ( self.rows, self.cols ) )
+                , shape = ( nS, nR ) )
+        changed = abs( self.N ).sign( )
+        self.depends = ( changed.T * pattern ).tocsr( )
+
+        # For tau selection: squared stoichiometry and the highest order of
+        # reaction (g_i of Cao et al.) in which a species is a reactant.
+        self.N2 = self.N.multiply( self.N ).tocsr( )
+        self.hor = np.zeros( nS )
+        self.dimer = np.zeros( nS, dtype = bool )
+        np.maximum.at( self.hor, self.rows, order[ self.cols ] )
+        self.dimer[ self.rows[ ( self.orders >= 2 ) & ( order[ self.cols ] == 2 ) ] ] = True
+        self.is_reactant = self.hor > 0
+
+    def propensities( self, x ):
+        """Propensities of all reactions at state x (species, or replicates x
+        species).
+        """
+        n = x[ ..., self.rows ]
+        f = np.ones( n.shape )
+        for m in range( self.max_order ):
+            f *= np.where( self.orders > m, np.maximum( n - m, 0 ), 1 )
+        a = np.empty( x.shape[ :-1 ] + self.c.shape )
+        a[ ... ] = self.c
+        if self.starts.size:
+            a[ ..., self.has_reactants ] *= np.multiply.reduceat( f, self.starts, axis = -1 )
+        return a
+
+    def propensity_of( self, x, reactions ):
+        """Propensities of some reactions at state x.
+        """
+        a = self.c[ reactions ].copy( )
+        for k, j in enumerate( reactions ):
+            for i, s in self.reactants[ j ]:
+                n = x[ i ]
+                for m in range( s ):
+                    a[ k ] *= max( n - m, 0 )
+        return a
+
+    def choose( self, a, a0 ):
+        """Index of reaction which fires, for each row of a.
+        """
+        r = self.rng.random_sample( np.shape( a0 ) ) * a0
+        j = ( np.cumsum( a, axis = -1 ) <= r[ ..., None ] ).sum( axis = -1 )
+        return np.minimum( j, a.shape[ -1 ] - 1 )
+
+    def waiting_time( self, a0 ):
+        u = 1.0 - self.rng.random_sample( np.shape( a0 ) )
+        with np.errstate( divide = 'ignore' ):
+            return -np.log( u ) / a0
+
+    def leap_size( self, x, a, epsilon ):
+        """Largest tau for which propensities change by about epsilon
+        (relative) at state x, rows of x being replicates.
+        """
+        mu = self.N.dot( a.T ).T
+        sigma2 = self.N2.dot( a.T ).T
+        g = np.where( self.dimer & ( x > 1 ), 2.0 + 1.0 / np.maximum( x - 1, 1 ), self.hor )
+        g = np.where( self.is_reactant, g, 1.0 )
+        bound = np.maximum( epsilon * x / g, 1.0 )
+        with np.errstate( divide = 'ignore', invalid = 'ignore' ):
+            tau = np.minimum( bound / np.abs( mu ), bound ** 2 / sigma2 )
+        tau = np.where( self.is_reactant & np.isfinite( tau ), tau, np.inf )
+        return tau.min( axis = -1 )
+
+    def ssa( self, sim_time, dt = 1.0 ):
+        """One trajectory by the direct method. Return times and numbers of
+        molecules (species x times).
+        """
+        times = sample_times( sim_time, dt )
+        out = np.empty( ( len( self.species ), len( times ) ) )
+        x = self.x0.copy( )
+        a = self.propensities( x )
+        t, k = 0.0, 0
+        indptr, indices = self.depends.indptr, self.depends.indices
+        while k < len( times ):
+            a0 = a.sum( )
+            tNext = t + self.waiting_time( a0 ) if a0 > 0 else np.inf
+            while k < len( times ) and times[ k ] < tNext:
+                out[ :, k ] = x
+                k += 1
+            if k == len( times ):
+                break
+            j = self.choose( a, a0 )
+            idx, delta = self.change[ j ]
+            x[ idx ] += delta
+            dep = indices[ indptr[ j ]:indptr[ j + 1 ] ]
+            a[ dep ] = self.propensity_of( x, dep )
+            t = tNext
+        return times, out
+
+    def tau_leap( self, sim_time, dt = 1.0, epsilon = 0.03 ):
+        """One trajectory by adaptive tau-leaping.
+        """
+        times, out = self.batch( 1, sim_time, dt, 'tau', epsilon )
+        return times, out[ 0 ]
+
+    def batch( self, replicates, sim_time, dt = 1.0, method = 'ssa', epsilon = 0.03 ):
+        """Advance replicates independent trajectories together. Return
+        times and numbers of molecules (replicates x species x times).
+        """
+        assert method in methods_, 'Unknown method %s' % method
+        times = sample_times( sim_time, dt )
+        nT = len( times )
+        x = np.tile( self.x0, ( replicates, 1 ) )
+        out = np.empty( ( replicates, len( self.species ), nT ) )
+        t = np.zeros( replicates )
+        k = np.zeros( replicates, dtype = int )
+        Nt = self.N.T.toarray( )
+        while True:
+            if method == 'tau':
+                # State at t holds for samples at or before t.
+                record( out, x, times, t, k, np.arange( replicates ), 'right' )
+            idx = np.nonzero( k < nT )[ 0 ]
+            if not idx.size:
+                break
+            xi = x[ idx ]
+            a = self.propensities( xi )
+            a0 = a.sum( axis = 1 )
+            tNext = t[ idx ] + self.waiting_time( a0 )
+            if method == 'ssa':
+                # State holds until the next reaction.
+                record( out, xi, times, tNext, k, idx, 'left' )
+                fire = np.isfinite( tNext ) & ( k[ idx ] < nT )
+                j = self.choose( a[ fire ], a0[ fire ] )
+                x[ idx[ fire ] ] += Nt[ j ]
+                t[ idx ] = tNext
+                continue
+
+            # Land exactly on the next sample time.
+            nextSample = times[ k[ idx ] ]
+            tau = np.minimum( self.leap_size( xi, a, epsilon ), nextSample - t[ idx ] )
+            exact = tau * a0 < exact_threshold_
+            # Exact steps; no reaction before the next sample when it is late.
+            late = exact & ( tNext > nextSample )
+            fire = exact & ~late
+            t[ idx[ late ] ] = nextSample[ late ]
+            if fire.any( ):
+                j = self.choose( a[ fire ], a0[ fire ] )
+                x[ idx[ fire ] ] += Nt[ j ]
+                t[ idx[ fire ] ] = tNext[ fire ]
+            leap = np.nonzero( ~exact )[ 0 ]
+            while leap.size:
+                counts = self.rng.poisson( a[ leap ] * tau[ leap, None ] )
+                xNew = xi[ leap ] + counts.dot( Nt )
+                ok = ( xNew >= 0 ).all( axis = 1 )
+                x[ idx[ leap[ ok ] ] ] = xNew[ ok ]
+                t[ idx[ leap[ ok ] ] ] += tau[ leap[ ok ] ]
+                # Negative numbers: halve tau and try again.
+                leap = leap[ ~ok ]
+                tau[ leap ] /= 2.0
+        return times, out
+
+    def tables( self, x ):
+        """Recorded values in columns of moose.Streamer from numbers of
+        molecules (... x species x times).
+        """
+        tables = OrderedDict( )
+        for name, i, field in self.columns:
+            if field.lower( ) == 'n':
+                tables[ name ] = x[ ..., i, : ]
+            else:
+                tables[ name ] = x[ ..., i, : ] / self.molecules[ i ]
+        return tables
+
+def record( out, x, times, until, k, rows, side ):
+    """Copy rows of state x into samples k[ rows ] ... of out which are
+    before until (side = 'left') or not after it (side = 'right').
+    """
+    end = np.searchsorted( times, until, side = side )
+    n = np.maximum( end - k[ rows ], 0 )
+    if not n.any( ):
+        return
+    which = np.repeat( np.arange( len( rows ) ), n )
+    offset = np.arange( n.sum( ) ) - np.repeat( np.cumsum( n ) - n, n )
+    samples = k[ rows ][ which ] + offset
+    out[ rows[ which ], :, samples ] = x[ which ]
+    k[ rows ] += n
+
+def write_replicates( filename, times, tables, format = 'csv' ):
+    """Write tables of replicates (column : replicates x times) one after the
+    other, with a replicate column.
+    """
+    reps = list( tables.values( ) )[ 0 ].shape[ 0 ] if tables else 1
+    cols = OrderedDict( [ ( 'replicate', np.repeat( np.arange( reps ), len( times ) ) ) ] )
+    for n, v in tables.items( ):
+        cols[ n ] = v.ravel( )
+    write_output( filename, np.tile( times, reps ), cols, format )
+
+def settings( model ):
+    """Attributes of simulator of model: dictionary with sim_time, record_dt,
+    method, epsilon, replicates, seed (None when not given) and format. Raise
+    ValueError if model can not be simulated stochastically.
+    """
+    check_model( model )
+    sim = model.simulator or { }
+    seed = sim.get( 'seed' )
+    method = sim.get( 'method', 'ssa' ).strip( '"\'' )
+    if method not in methods_:
+        raise ValueError( 'Unknown method %s of simulator ssa. Available: %s' % (
+            method, ', '.join( methods_ ) ) )
+    return { 'sim_time' : helper.to_float( sim.get( 'sim_time', '1' ) )
+            , 'record_dt' : helper.to_float( sim.get( 'record_dt', '1' ) )
+            , 'method' : method
+            , 'epsilon' : helper.to_float( sim.get( 'epsilon', '0.03' ) )
+            , 'replicates' : int( helper.to_float( sim.get( 'replicates', '1' ) ) )
+            , 'seed' : int( helper.to_float( seed ) ) if seed else None
+            , 'format' : sim.get( 'format', 'csv' ).strip( '"\'' )
+            }
+
+def simulate( model, context ):
+    """Run model stochastically with attributes of its simulator.
+    """
+    opts = settings( model )
+    with profiling.stage( 'solver' ):
+        sm = StochasticModel( model, opts[ 'seed' ] )
+    context.ode = sm
+    simTime, dt = opts[ 'sim_time' ], opts[ 'record_dt' ]
+    method, replicates = opts[ 'method' ], opts[ 'replicates' ]
+    logger_.info( 'Running %d %s replicates for %s seconds' % ( replicates, method, simTime ) )
+    with profiling.stage( 'run' ):
+        if replicates == 1 and method == 'ssa':
+            times, x = sm.ssa( simTime, dt )
+        elif replicates == 1:
+            times, x = sm.tau_leap( simTime, dt, opts[ 'epsilon' ] )
+        else:
+            times, x = sm.batch( replicates, simTime, dt, method, opts[ 'epsilon' ] )
+
+    tables = sm.tables( x )
+    context.time = times
+    context.tables = [ Table( n, v ) for n, v in tables.items( ) ]
+    if not context.save_output:
+        return context.tables
+    filename = '%s.%s' % ( model.name, opts[ 'format' ] )
+    if replicates == 1:
+        write_output( filename, times, tables, opts[ 'format' ] )
+    else:
+        write_replicates( filename, times, tables, opts[ 'format' ] )
+    return context.tables
+
+##
+# @brief Simulate yacml XML model stochastically.
+#
+# @param xml Input model AST in XML.
+# @param context yacml2scipy.LoadContext which collects results. A new one is
+#   used by default.
+# @param kwargs propagate = False skips constant propagation when xml is
+#   already propagated, save_output = False does not write results to a file.
+#
+# @return  The loaded AST.
+def load( xml, context = None, **kwargs ):
+    if context is None:
+        context = LoadContext( )
+    context.debug = kwargs.get( 'debug', context.debug )
+    context.save_output = kwargs.get( 'save_output', context.save_output )
+    if kwargs.get( 'propagate', True ):
+        propagation.propagate( xml )
+    with profiling.stage( 'ir' ):
+        context.model = ir.build_model( xml )
+    context.modelname = context.model.name
+    simulate( context.model, context )
+    return xml
@@ -16,37 +16,28 @@ __status__           = "Development"
 import lxml.etree as etree
 from copy import deepcopy
 from config import logger_
-
-flattenedAST_ = etree.Element( 'yacml' )
-
-def find_recipe( doc, recipe_id ):
-    recipe = doc.xpath( '/yacml/recipe[@id="%s"]' % recipe_id )
-    if not recipe:
-        msg = 'Could not find any recipe with name %s' % recipe_id 
-        msg +=  '\n\tI cannot continue ' 
-        raise NameError( msg )
-    assert len(recipe) == 1, "Found more the 1 recipe with id %s" % recipe_id
-    return recipe[0]
-
-def find_reaction( rootXML, reaction_id ):
-    rXML = rootXML.xpath( '//reaction_declaration[@id="%s"]' % reaction_id )
-    if not rXML:
-        msg = 'Could not find any reaction with name %s' % reaction_id
-        msg +=  '\t I cannot continue ' 
-        raise NameError( msg )
-    assert len( rXML ) == 1, 'Found more the 1 reaction with id %s' % reaction_id
-    return rXML[0]
-
-def find_compartment( rootXML, compt_id ):
-    cXML = rootXML.xpath( 'compartment[@id="%s"]' % compt_id )
-    if not cXML:
-        msg = 'Could not find any compartment with name %s' % compt_id
-        msg +=  '\n\t I cannot continue ' 
-        raise NameError( msg )
-
-    assert len( cXML ) == 1, 'Found more the 1 compartment with id %s' % compt_id
+import utils.helper as helper
+import utils.xml as xml
+from . import expression
+
+# Lookups go through utils.xml.DeclarationIndex. Build the index of a
+# document once and pass it when resolving many instances.
+def find_recipe( doc, recipe_id, index = None ):
+    if index is None:
+        index = xml.DeclarationIndex( doc.getroottree( ).getroot( ) )
+    return index.find( 'recipe', recipe_id )
+
+def find_reaction( rootXML, reaction_id, index = None ):
+    if index is None:
+        index = xml.DeclarationIndex( rootXML )
+    return index.find( 'reaction_declaration', reaction_id, rootXML )
+
+def find_compartment( rootXML, compt_id, index = None ):
+    if index is None:
+        index = xml.DeclarationIndex( rootXML )
+    cXML = index.find( 'compartment', compt_id )
     logger_.debug( 'Found declaration of compartment with type %s' % compt_id )
-    return cXML[0]
+    return cXML
 
 def replace_all( from_list, reduce_list ):
     somethingToReplace = False
@@ -54,14 +45,10 @@ def replace_all( from_list, reduce_list ):
         r = from_list.pop()
         rName = r.attrib['name']
         for var in reduce_list:
-            if rName in var.text:
+            if rName in helper.get_ids( var.text ):
                 somethingToReplace = True
-                var.text = var.text.replace( rName, r.text )
-                try:
-                    var.text = str( eval( var.text ) )
-                    var.attrib['is_reduced'] = 'true' 
-                except Exception as e:
-                    pass
+                var.text = expression.substitute( var.text, { rName : r.text } )
+                var.text, var.attrib['is_reduced'] = helper.reduce_expr( var.text )
     return somethingToReplace
 
 def replace_local_variables( recipe_xml, doc, others = [] ):
@@ -90,12 +77,18 @@ def flatten_compartment_expression( compt_xml ):
 #
 # @param comptXML
 # @param doc
+# @param index DeclarationIndex of doc.
+# @param flat Element to which flattened compartment is appended.
 #
-# @return 
-def flatten_compartment( comptXML, doc ):
-    global flattenedAST_
-
-    flattenComptXML = etree.SubElement( flattenedAST_, 'compartment' )
+# @return Flattened compartment.
+def flatten_compartment( comptXML, doc, index = None, flat = None ):
+    if index is None:
+        index = xml.DeclarationIndex( doc )
+
+    if flat is None:
+        flattenComptXML = etree.Element( 'compartment' )
+    else:
+        flattenComptXML = etree.SubElement( flat, 'compartment' )
     # Attach the attributes.
     for atb in comptXML.attrib:
         flattenComptXML.attrib[ atb ] = comptXML.attrib[ atb ]
@@ -108,17 +101,26 @@ def flatten_compartment( comptXML, doc ):
     for varXML in comptXML.xpath( 'variable' ):
         flattenComptXML.append( deepcopy( varXML ) )
 
-    # Fix the recipe instances.
+    # Fix the recipe instances. Each recipe is copied once into compartment as
+    # template; instances refer to it and are materialized only when changed.
+    # See utils.xml.materialize.
     recipeInsts = comptXML.findall( 'recipe_instance' )
+    templates = { }
     for recipeI in recipeInsts:
-        logger_.info( 'Replacing recipe instance of %s' % recipeI.text )
         instOf = recipeI.attrib['instance_of']
-        recipe = find_recipe( doc, instOf )
+        if instOf not in templates:
+            templates[ instOf ] = deepcopy( find_recipe( doc, instOf, index ) )
+            flattenComptXML.append( templates[ instOf ] )
+
+    for recipeI in recipeInsts:
+        logger_.debug( 'Adding recipe instance %s' % recipeI.text )
+        instOf = recipeI.attrib['instance_of']
         netXML = etree.SubElement( flattenComptXML, 'chemical_reaction_subnetwork' )
         netXML.attrib['type'] = instOf
         netXML.attrib['name'] = recipeI.text
-        [ netXML.append( deepcopy(c) ) for c in recipe ]
+        netXML.attrib['template'] = instOf
         # flatten_compartment_expression( flattenComptXML )
+    return flattenComptXML
 
 ##
 # @brief Flatten the declaration of recipe. Replace all the local variables.
@@ -127,38 +129,50 @@ def flatten_compartment( comptXML, doc ):
 # @param doc
 #
 # @return 
-def flatten_recipe( recipeXML, doc ):
+def flatten_recipe( recipeXML, doc, index = None ):
+    if index is None:
+        index = xml.DeclarationIndex( doc )
     replace_local_variables( recipeXML, doc )
     reactionInstances = recipeXML.xpath( '//reaction[@instance_of]' )
     for reac in reactionInstances:
         instOf = reac.attrib['instance_of']
-        rXML = find_reaction( recipeXML, instOf )
+        rXML = find_reaction( recipeXML, instOf, index )
         [ reac.append( deepcopy( elem ) ) for elem in rXML ]
 
 ##
 # @brief Flatten a given model XML element.
 #
 # @param model_xml
+# @param ast
+# @param flat Element which holds the flattened compartments.
 #
 # @return XML element representing model.
-def flatten_model( model_xml, ast ):
-    global flattenedAST_
+def flatten_model( model_xml, ast, flat ):
     yacmlXML = etree.Element( 'yacml' )
     modelXML = etree.SubElement( yacmlXML, 'model' )
     for atb in model_xml.attrib:
         modelXML.attrib[atb] = model_xml.attrib[ atb ]
 
-    # The compartments are flattened and stored in flattenedAST_ 
+    # The compartments are flattened and stored in flat.
+    comptIndex = xml.DeclarationIndex( flat )
+    declAttribs = { }
     for compt in model_xml.xpath( 'compartment_instance' ):
         instName = compt.text
         instOf = compt.attrib['instance_of']
-        comptInst = find_compartment( flattenedAST_, instOf )
+        comptInst = find_compartment( flat, instOf, comptIndex )
+        # The first instance takes the flattened compartment, others copy it.
+        if instOf not in declAttribs:
+            declAttribs[ instOf ] = dict( comptInst.attrib )
+        else:
+            comptInst = deepcopy( comptInst )
+            comptInst.attrib.clear( )
+            comptInst.attrib.update( declAttribs[ instOf ] )
         comptInst.attrib.update( compt.attrib )
         # Add/update old attributes which may not be relevant to declaration 
         comptInst.attrib['name'] = instName
         comptInst.attrib['instance_of'] = comptInst.attrib['id']
         # Note: Don't delete 'id' attrib from dictionary
-        modelXML.append( deepcopy( comptInst ) )
+        modelXML.append( comptInst )
 
     for sim in model_xml.xpath( 'simulator' ):
         modelXML.append( deepcopy( sim ) )
@@ -174,15 +188,18 @@ def flatten_model( model_xml, ast ):
 #
 # @return modified AST. Structure of AST does not change at all.
 def flatten( ast ):
-    global flattenedAST_
+    # Flattened compartments are kept here until they are instantiated in
+    # model. Nothing is shared between calls.
+    flat = etree.Element( 'yacml' )
     # Rewrite AST.
     # recipes = ast.xpath( '/yacml/recipe' )
     # [ flatten_recipe( r, ast ) for r in recipes ]
+    index = xml.DeclarationIndex( ast )
     compts = ast.xpath( '/yacml/compartment' )
-    [ flatten_compartment( c, ast ) for c in compts ]
+    [ flatten_compartment( c, ast, index, flat ) for c in compts ]
 
     # And finally flatten the model. This is the last 
     model = ast.find( 'model' )
-    flattenModel = flatten_model( model, ast )
+    flattenModel = flatten_model( model, ast, flat )
 
     return flattenModel
@@ -1,6 +1,7 @@
 """yacml_bnf.py: 
 
-BNFC grammar of YACML.
+Parse actions of YACML grammar. Both parsers build the AST with them: the
+pyparsing grammar (grammar.py) and the hand-written parser (rdparser.py).
 
 """
     
@@ -21,14 +22,11 @@ import utils.helper as helper
 import utils.xml as xml
 
 from collections import defaultdict
-from copy import deepcopy
 from config import logger_
-from .pyparsing import *
 
-# Function to generate graph.
-xml_ = etree.Element( 'yacml' )
-
-globals_ = {}
+# ParserContext of the parse in progress. It owns the output AST and is set by
+# yparser.parse_text for the duration of a parse.
+context_ = None
 
 reac_params_ = [ 'kf', 'kb', 'numkf', 'numkb', 'km' ]
 
@@ -44,7 +42,7 @@ def add_variable( tokens, **kwargs):
     return var
 
 def add_species( tokens, **kwargs ):
-    print tokens
+    logger_.debug( 'Adding species %s' % tokens[2] )
     sp = etree.Element( 'species' )
     sp.attrib['name'] = tokens[2]
     attribs = tokens[3]
@@ -68,7 +66,6 @@ def add_recipe( tokens, **kwargs):
     for x in tokens:
         if isinstance(x, etree._Element ):
             recipe.append( x )
-    xml_.append( recipe )
     return recipe
 
 def add_reaction_declaration( tokens, **kwargs ):
@@ -119,21 +116,20 @@ def add_reaction_instantiation( tokens, **kwargs ):
     return reac
 
 def add_recipe_instance( tokens, **kwargs ):
-    print( '[INFO] Adding an instance of reaction.' )
+    logger_.debug( 'Adding an instance of recipe %s' % tokens[0] )
     recipeInst = etree.Element( 'recipe_instance' )
     recipeInst.attrib['instance_of'] = tokens[0]
     recipeInst.text = tokens[1]
     return recipeInst
 
 def add_model( tokens, **kwargs ):
-    global xml_
     logger_.info( 'Adding model ' )
     modelXml = etree.Element( 'model' )
     modelXml.attrib[ 'name' ] = tokens[1]
     for t in tokens[2:]:
         if isinstance(t, etree._Element ):
             modelXml.append( t )
-    xml_.append( modelXml )
+    return modelXml
 
 def add_compartment_instance( tokens, **kwargs ):
     instXml = etree.Element( 'compartment_instance' )
@@ -195,178 +191,35 @@ def add_geometry( tokens, **kwargs ):
 #
 # @return 
 def add_compartment( tokens, **kwargs ):
-    global xml_
-    print( '[INFO] Adding compartment %s' % tokens )
+    logger_.debug( 'Adding compartment %s' % tokens[1] )
     compt = etree.Element( 'compartment' )
     compt.attrib['id'] = tokens[1]
-    compt.append( deepcopy( tokens[2] ) ) 
+    # Elements are created by parse actions for this compartment only, so they
+    # are moved rather than copied.
+    compt.append( tokens[2] ) 
     # And append rest of the xml/
     for x in tokens[3:]:
         if isinstance( x, etree._Element ):
-            compt.append( deepcopy( x ) )
-    xml_.append( compt )
+            compt.append( x )
     return compt
 
 ##
-# @brief Main parser function 
+# @brief Main parser function. Collects recipes, compartments and model into
+# the AST owned by current parser context (or a fresh AST when there is none).
+# The statement level parse actions do not touch any global state; this keeps
+# them safe under packrat memoization where a cached action result is reused
+# instead of re-running the action.
 #
 # @param tokens. List of tokens.
 # @param kwargs. Dictionary of arguments.
 #
 # @return Return the AST in XML.
 def parser_main( tokens, **kwargs ):
-    global xml_
-    print tokens
-    return xml_
-
-
-# YACML BNF.
-COMPARTMENT = Keyword("compartment")
-RECIPE_BEGIN = Keyword( "recipe" )
-MODEL = Keyword( "model" ) | Keyword( "pathway" )
-HAS = Keyword("has").suppress()
-IS = Keyword( "is" ).suppress()
-SPECIES = Keyword( "species" ) | Keyword( "pool" ) | Keyword( "enzyme" )
-REACTION = Keyword( "reaction" ) | Keyword( "reac" ) | Keyword( "enz_reac" )
-GEOMETRY = Keyword("cylinder") | Keyword( "cube" ) | Keyword( "spine" )
-VAR = Keyword( "variable" ) 
-CONST = Keyword( "const" ) 
-BUFFERED = Keyword( "buffered" ).setParseAction( lambda x: 'true' )
-END = Keyword("end").suppress()
-SIMULATOR = Keyword( "simulator" )
-STOCHASTIC = Keyword( "stochastic" )
-DETERMINISTIC = Keyword( "deterministic" ) | Keyword( "well-mixed" )
-DIFFUSIVE = Keyword( "diffusive" )
-NONDIFFUSIVE = Keyword( "non-diffusive")
-
-anyKeyword = COMPARTMENT | RECIPE_BEGIN | MODEL \
-        | HAS | IS | SPECIES | REACTION \
-        | GEOMETRY | VAR | CONST | BUFFERED | END \
-        | DETERMINISTIC \
-        | DIFFUSIVE | SIMULATOR | NONDIFFUSIVE
-
-# literals.
-pEOS = Literal( ";" ).suppress()
-LBRAC = Literal("[").suppress()
-RBRAC = Literal("]").suppress()
-LCBRAC = Literal("{").suppress()
-RCBRAC = Literal("}").suppress()
-EQUAL = Literal('=').suppress()
-RREAC = Literal( "->" ).suppress()
-LREAC = Literal( "<-" ).suppress()
-
-anyLiteral = pEOS | LBRAC | RREAC | LCBRAC | RCBRAC | EQUAL | RREAC | LREAC
-
-pIdentifier = pyparsing_common.identifier
-# Make sure no keyword is matched as identifier.
-pIdentifier.ignore( anyKeyword )
-
-# Delimited list or separated list.
-delimitedList_ = lambda x, y: delimitedList( x, y ) + Optional( y ).suppress()
-
-pComptName = pIdentifier
-pSpeciesName = pIdentifier
-pNumVal = pyparsing_common.numeric \
-        | pyparsing_common.integer \
-        | pyparsing_common.number | Regex( r'\.\d+' )
-pNumVal.setParseAction( lambda x: str(x[0]) )
-
-# Parser for key = value expression.
-pValue = pNumVal | pIdentifier | quotedString 
-quotedString.setParseAction( lambda x: (''.join(x)).replace('"', '') )
-
-pKeyVals = Group( pIdentifier + EQUAL + pValue )
-
-pKeyValList = LBRAC + Group( delimitedList_( pKeyVals, "," )) + RBRAC
-pSpeciesExpr = Optional(BUFFERED, 'false') + SPECIES + pSpeciesName +  pKeyValList + pEOS
-pSpeciesExpr.setParseAction( add_species )
-
-# Species name with stoichiometry coefficient e.g 2a + 3b 
-pStoichNumber = Optional(Word(nums), '1') 
-pSpeciesNameWithStoichCoeff = Group( pStoichNumber + pSpeciesName )
-
-# Expression for reactions.
-pSubstrasteList = Group( delimitedList_( pSpeciesNameWithStoichCoeff, '+' ) )
-pProductList = Group( delimitedList_( pSpeciesNameWithStoichCoeff, '+' ) )
-
-# Reactions. Parses expressions like the following.
-#
-#       a + b <- kf = 10, kb = 1e-2 -> 2c + 9d,
-# Or,
-#       reaction rA [ kf = 10, kb = 1e-2 ]
-#       a + b <- rA -> 2c + 9d 
-#
-# Both of the above expressions are equivalent and should have same AST tree in
-# final model.
-pReacName = pIdentifier
-pReacDecl = REACTION + pReacName + pKeyValList + pEOS
-pReac = pReacName | pKeyValList 
-pReacInst = pSubstrasteList + LREAC + pReac + RREAC + pProductList + pEOS
-
-pReacDecl.setParseAction( add_reaction_declaration )
-pReacInst.setParseAction( add_reaction_instantiation )
-
-pReacExpr = pReacDecl | pReacInst
-
-pTypeExpr = CONST | VAR
-pVariableExpr = ( Optional(pTypeExpr, 'variable') + pKeyVals) + pEOS
-pVariableExpr.setParseAction( add_variable )
-
-# Name of the recipe
-pRecipeName = pIdentifier
-
-# Recipe instantiation expression
-pRecipeType = pIdentifier 
-pRecipeInstExpr = pRecipeType + pRecipeName + pEOS
-pRecipeInstExpr.setParseAction( add_recipe_instance )
-
-# Geometry of compartment.
-pGeometry = GEOMETRY + Optional( pKeyValList, [] )
-pGeometry.setParseAction( add_geometry )
-
-# Valid YAXML expression
-pYACMLExpr = pSpeciesExpr | pReacExpr | pVariableExpr | pRecipeInstExpr
-
-##
-# @brief Compartment can have reactions, species, or instance of other recipe.
-# Compartment also have solver, geometry and diffusion.
-pCompartmentBody = OneOrMore( pYACMLExpr )
-pCompartment = COMPARTMENT + pComptName + IS + pGeometry +  HAS + pCompartmentBody + END
-pCompartment.setParseAction( add_compartment )
-
-# Recipe 
-pRecipeBody = OneOrMore( pYACMLExpr )
-pRecipe =  RECIPE_BEGIN + pRecipeName + HAS  + pRecipeBody + END 
-pRecipe.setParseAction( add_recipe )
-
-# Model
-# A model can have list of compartments instances. Solver, runtime and other
-# information. It can also have plot list but it should not be a part of YACML.
-
-pSimulatorName = pIdentifier
-pSimulator = SIMULATOR + pSimulatorName + Optional( pKeyValList ) + pEOS
-pSimulator.setParseAction( add_simulator )
-
-pComptType = pIdentifier 
-pComptInstName = pIdentifier 
-pComptNature = STOCHASTIC | DETERMINISTIC
-pComptInst =  Optional( pComptNature, "deterministic" ) \
-        + pComptInstName + IS + pComptType \
-        + Optional( pKeyValList, [] ) + pEOS
-
-pComptInst.setParseAction( add_compartment_instance )
-
-pModelName = pIdentifier
-pModelStmt = ( pComptInst | pSimulator )
-
-pModel = MODEL + pModelName + HAS +  OneOrMore( pModelStmt ) + END
-pModel.setParseAction( add_model )
-
-# There must be one and only one model statement in each file. Each model must
-# have at least one compartment. Each compartment must have at least one recipe.
-yacmlBNF_ = OneOrMore( pRecipe | pCompartment ) + pModel
-
-# yacmlBNF_ = OneOrMore( pCompartment )
-yacmlBNF_.setParseAction( parser_main )
-yacmlBNF_.ignore( javaStyleComment )
-#yacmlBNF_.setDebug( )
+    if context_ is not None:
+        root = context_.xml
+    else:
+        root = etree.Element( 'yacml' )
+    for x in tokens:
+        if isinstance( x, etree._Element ):
+            root.append( x )
+    return root
@@ -1,6 +1,15 @@
 """expression.py: 
 
     Function on expression.
+
+    Expression( text ) compiles an arithmetic expression once into a tree of
+    python closures. Evaluating it takes a mapping of variable values; no
+    string substitution and no re-parsing is done. Only arithmetic,
+    comparisons, conditionals and a whitelisted set of math functions are
+    allowed, unlike eval which can call anything in scope.
+
+    Expression( text, vectorized = True ) evaluates the same expression over
+    numpy arrays of values.
 """
     
 __author__           = "Dilawar Singh"
@@ -13,6 +22,11 @@ __email__            = "dilawars@ncbs.res.in"
 __status__           = "Development"
 
 import re
+import ast
+import math
+import numbers
+import operator
+from functools import reduce
 
 def get_ids(expr):
     ids = re.findall(r'(?P<id>[_a-zA-Z]\w*)', expr)
@@ -33,3 +47,215 @@ def replace_possible_subexpr(expr, constants, ids):
                 expr = expr.replace(i, replaceWith)
     return expr
 
+
+# Functions which can be called from an expression.
+functions_ = dict( [ ( k, getattr( math, k ) ) for k in [
+    'acos', 'asin', 'atan', 'atan2', 'ceil', 'cos', 'cosh', 'degrees', 'exp'
+    , 'fabs', 'floor', 'fmod', 'hypot', 'log', 'log10', 'pow', 'radians'
+    , 'sin', 'sinh', 'sqrt', 'tan', 'tanh' 
+    ] ] )
+functions_.update( abs = abs, min = min, max = max, round = round )
+
+# numpy versions of functions_, built when first needed.
+vector_functions_ = None
+
+def vector_functions( ):
+    global vector_functions_
+    if vector_functions_ is None:
+        import numpy as np
+        names = { 'acos' : 'arccos', 'asin' : 'arcsin', 'atan' : 'arctan'
+                , 'atan2' : 'arctan2', 'pow' : 'power', 'abs' : 'absolute' }
+        vector_functions_ = dict( [ 
+            ( k, getattr( np, names.get( k, k ) ) ) for k in functions_ 
+            if k not in ( 'min', 'max', 'round' ) 
+            ] )
+        vector_functions_.update( 
+                min = lambda *args: reduce( np.minimum, args )
+                , max = lambda *args: reduce( np.maximum, args )
+                , round = np.round 
+                )
+    return vector_functions_
+
+# Constants; a variable with the same name in the mapping takes precedence.
+constants_ = { 'pi' : math.pi, 'e' : math.e }
+
+binary_ops_ = { 
+        ast.Add : operator.add, ast.Sub : operator.sub
+        , ast.Mult : operator.mul, ast.Div : operator.truediv
+        , ast.FloorDiv : operator.floordiv, ast.Mod : operator.mod
+        , ast.Pow : operator.pow
+        }
+
+unary_ops_ = { 
+        ast.UAdd : operator.pos, ast.USub : operator.neg
+        , ast.Not : operator.not_ 
+        }
+
+compare_ops_ = { 
+        ast.Eq : operator.eq, ast.NotEq : operator.ne, ast.Lt : operator.lt
+        , ast.LtE : operator.le, ast.Gt : operator.gt, ast.GtE : operator.ge 
+        }
+
+# An identifier which is not part of a number (1e5) or an attribute (a.b).
+identifier_re_ = re.compile( r'(?<![\w.])[A-Za-z_]\w*' )
+
+def substitute( expr, values ):
+    """Replace whole identifiers in expr by their value in dictionary values.
+    Unlike str.replace, replacing k does not touch kf.
+    """
+    def repl( m ):
+        return values.get( m.group( ), m.group( ) )
+    return identifier_re_.sub( repl, expr )
+
+class Expression( object ):
+    """A compiled expression.
+
+    >>> e = Expression( 'kf * 2 / volume' )
+    >>> sorted( e.names )
+    ['kf', 'volume']
+    >>> e( { 'kf' : 1.0, 'volume' : 4 } )
+    0.5
+
+    Division is always true division. Evaluating with a missing variable
+    raises NameError. An expression which is not allowed raises SyntaxError
+    when it is compiled.
+
+    When vectorized is true, values may be numpy arrays: functions are numpy
+    ufuncs, and comparisons, and/or and if-else work elementwise.
+    """
+
+    def __init__( self, text, vectorized = False ):
+        self.text = text
+        self.vectorized = vectorized
+        self.functions = functions_
+        if vectorized:
+            import numpy
+            self.np = numpy
+            self.functions = vector_functions( )
+        # Names of variables used in expression (functions and constants are
+        # not included).
+        self.names = set( )
+        try:
+            tree = ast.parse( text.strip( ), mode = 'eval' )
+        except SyntaxError as e:
+            raise SyntaxError( 'Invalid expression %r: %s' % ( text, e ) )
+        self._func = self.build( tree.body )
+
+    def __call__( self, values = None ):
+        if values is None:
+            values = { }
+        try:
+            return self._func( values )
+        except KeyError as e:
+            raise NameError( 'name %s is not defined in %r' % ( e, self.text ) )
+
+    def __repr__( self ):
+        return 'Expression(%r)' % self.text
+
+    def unsupported( self, node ):
+        raise SyntaxError( 'Unsupported %s in expression %r' % ( 
+            type( node ).__name__, self.text )
+            )
+
+    def build( self, node ):
+        """Turn an ast node into a function of variable mapping.
+        """
+        build = self.build
+        # Python 3 parses numbers, strings, True and False as Constant.
+        if type( node ).__name__ in ( 'Num', 'Str', 'Constant', 'NameConstant' ):
+            val = getattr( node, 'value', getattr( node, 'n', getattr( node, 's', None ) ) )
+            if not isinstance( val, ( numbers.Real, str ) ):
+                self.unsupported( node )
+            return lambda v: val
+
+        if isinstance( node, ast.Name ):
+            name = node.id
+            if name in ( 'True', 'False' ):
+                val = name == 'True'
+                return lambda v: val
+            if name in constants_:
+                val = constants_[ name ]
+                return lambda v: v.get( name, val )
+            self.names.add( name )
+            return lambda v: v[ name ]
+
+        if isinstance( node, ast.BinOp ):
+            op = binary_ops_.get( type( node.op ) ) or self.unsupported( node.op )
+            left, right = build( node.left ), build( node.right )
+            return lambda v: op( left( v ), right( v ) )
+
+        if isinstance( node, ast.UnaryOp ):
+            op = unary_ops_.get( type( node.op ) ) or self.unsupported( node.op )
+            if self.vectorized and isinstance( node.op, ast.Not ):
+                op = self.np.logical_not
+            operand = build( node.operand )
+            return lambda v: op( operand( v ) )
+
+        if isinstance( node, ast.Compare ):
+            ops = [ compare_ops_.get( type( o ) ) or self.unsupported( o ) 
+                    for o in node.ops ]
+            args = [ build( node.left ) ] + [ build( x ) for x in node.comparators ]
+            def compare( v ):
+                left = args[0]( v )
+                for op, arg in zip( ops, args[1:] ):
+                    right = arg( v )
+                    if not op( left, right ):
+                        return False
+                    left = right
+                return True
+            if self.vectorized:
+                logical_and = self.np.logical_and
+                def compare( v ):
+                    vals = [ arg( v ) for arg in args ]
+                    return reduce( logical_and, [ op( a, b ) for op, a, b in 
+                        zip( ops, vals, vals[1:] ) ] )
+            return compare
+
+        if isinstance( node, ast.BoolOp ):
+            args = [ build( x ) for x in node.values ]
+            if self.vectorized:
+                op = self.np.logical_or
+                if isinstance( node.op, ast.And ):
+                    op = self.np.logical_and
+                return lambda v: reduce( op, [ arg( v ) for arg in args ] )
+            if isinstance( node.op, ast.And ):
+                def and_( v ):
+                    for arg in args:
+                        val = arg( v )
+                        if not val:
+                            return val
+                    return val
+                return and_
+            def or_( v ):
+                for arg in args:
+                    val = arg( v )
+                    if val:
+                        return val
+                return val
+            return or_
+
+        if isinstance( node, ast.IfExp ):
+            test, body, orelse = build( node.test ), build( node.body ), build( node.orelse )
+            if self.vectorized:
+                where = self.np.where
+                return lambda v: where( test( v ), body( v ), orelse( v ) )
+            return lambda v: body( v ) if test( v ) else orelse( v )
+
+        if isinstance( node, ast.Call ):
+            if not isinstance( node.func, ast.Name ) or node.func.id not in functions_:
+                raise SyntaxError( 'Function %s is not allowed in expression %r' % (
+                    getattr( node.func, 'id', '?' ), self.text )
+                    )
+            if node.keywords or getattr( node, 'starargs', None ) \
+                    or getattr( node, 'kwargs', None ):
+                self.unsupported( node )
+            func = self.functions[ node.func.id ]
+            args = [ build( x ) for x in node.args ]
+            return lambda v: func( *[ arg( v ) for arg in args ] )
+
+        self.unsupported( node )
+
+def evaluate( text, values = None ):
+    """Compile and evaluate text in one go.
+    """
+    return Expression( text )( values )
@@ -0,0 +1,173 @@
+"""grammar.py: 
+
+BNF grammar of YACML in pyparsing. The grammar is built when this module is
+imported; yparser imports it on the first parse with the pyparsing backend.
+Parse actions are in bnf.py.
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+from .pyparsing import *
+from .bnf import add_compartment, add_compartment_instance, add_geometry \
+        , add_model, add_reaction_declaration, add_reaction_instantiation \
+        , add_recipe, add_recipe_instance, add_simulator \
+        , add_species, add_variable, parser_main
+
+# YACML BNF.
+COMPARTMENT = Keyword("compartment")
+RECIPE_BEGIN = Keyword( "recipe" )
+MODEL = Keyword( "model" ) | Keyword( "pathway" )
+HAS = Keyword("has").suppress()
+IS = Keyword( "is" ).suppress()
+SPECIES = Keyword( "species" ) | Keyword( "pool" ) | Keyword( "enzyme" )
+REACTION = Keyword( "reaction" ) | Keyword( "reac" ) | Keyword( "enz_reac" )
+GEOMETRY = Keyword("cylinder") | Keyword( "cube" ) | Keyword( "spine" )
+VAR = Keyword( "variable" ) 
+CONST = Keyword( "const" ) 
+BUFFERED = Keyword( "buffered" ).setParseAction( lambda x: 'true' )
+END = Keyword("end").suppress()
+SIMULATOR = Keyword( "simulator" )
+STOCHASTIC = Keyword( "stochastic" )
+DETERMINISTIC = Keyword( "deterministic" ) | Keyword( "well-mixed" )
+DIFFUSIVE = Keyword( "diffusive" )
+NONDIFFUSIVE = Keyword( "non-diffusive")
+
+anyKeyword = COMPARTMENT | RECIPE_BEGIN | MODEL \
+        | HAS | IS | SPECIES | REACTION \
+        | GEOMETRY | VAR | CONST | BUFFERED | END \
+        | DETERMINISTIC \
+        | DIFFUSIVE | SIMULATOR | NONDIFFUSIVE
+
+# literals.
+pEOS = Literal( ";" ).suppress()
+LBRAC = Literal("[").suppress()
+RBRAC = Literal("]").suppress()
+LCBRAC = Literal("{").suppress()
+RCBRAC = Literal("}").suppress()
+EQUAL = Literal('=').suppress()
+RREAC = Literal( "->" ).suppress()
+LREAC = Literal( "<-" ).suppress()
+
+anyLiteral = pEOS | LBRAC | RREAC | LCBRAC | RCBRAC | EQUAL | RREAC | LREAC
+
+pIdentifier = pyparsing_common.identifier
+# Make sure no keyword is matched as identifier.
+pIdentifier.ignore( anyKeyword )
+
+# Delimited list or separated list.
+delimitedList_ = lambda x, y: delimitedList( x, y ) + Optional( y ).suppress()
+
+pComptName = pIdentifier
+pSpeciesName = pIdentifier
+pNumVal = pyparsing_common.numeric \
+        | pyparsing_common.integer \
+        | pyparsing_common.number | Regex( r'\.\d+' )
+pNumVal.setParseAction( lambda x: str(x[0]) )
+
+# Parser for key = value expression.
+pValue = pNumVal | pIdentifier | quotedString 
+quotedString.setParseAction( lambda x: (''.join(x)).replace('"', '') )
+
+pKeyVals = Group( pIdentifier + EQUAL + pValue )
+
+pKeyValList = LBRAC + Group( delimitedList_( pKeyVals, "," )) + RBRAC
+pSpeciesExpr = Optional(BUFFERED, 'false') + SPECIES + pSpeciesName +  pKeyValList + pEOS
+pSpeciesExpr.setParseAction( add_species )
+
+# Species name with stoichiometry coefficient e.g 2a + 3b 
+pStoichNumber = Optional(Word(nums), '1') 
+pSpeciesNameWithStoichCoeff = Group( pStoichNumber + pSpeciesName )
+
+# Expression for reactions.
+pSubstrasteList = Group( delimitedList_( pSpeciesNameWithStoichCoeff, '+' ) )
+pProductList = Group( delimitedList_( pSpeciesNameWithStoichCoeff, '+' ) )
+
+# Reactions. Parses expressions like the following.
+#
+#       a + b <- kf = 10, kb = 1e-2 -> 2c + 9d,
+# Or,
+#       reaction rA [ kf = 10, kb = 1e-2 ]
+#       a + b <- rA -> 2c + 9d 
+#
+# Both of the above expressions are equivalent and should have same AST tree in
+# final model.
+pReacName = pIdentifier
+pReacDecl = REACTION + pReacName + pKeyValList + pEOS
+pReac = pReacName | pKeyValList 
+pReacInst = pSubstrasteList + LREAC + pReac + RREAC + pProductList + pEOS
+
+pReacDecl.setParseAction( add_reaction_declaration )
+pReacInst.setParseAction( add_reaction_instantiation )
+
+pReacExpr = pReacDecl | pReacInst
+
+pTypeExpr = CONST | VAR
+pVariableExpr = ( Optional(pTypeExpr, 'variable') + pKeyVals) + pEOS
+pVariableExpr.setParseAction( add_variable )
+
+# Name of the recipe
+pRecipeName = pIdentifier
+
+# Recipe instantiation expression
+pRecipeType = pIdentifier 
+pRecipeInstExpr = pRecipeType + pRecipeName + pEOS
+pRecipeInstExpr.setParseAction( add_recipe_instance )
+
+# Geometry of compartment.
+pGeometry = GEOMETRY + Optional( pKeyValList, [] )
+pGeometry.setParseAction( add_geometry )
+
+# Valid YAXML expression
+pYACMLExpr = pSpeciesExpr | pReacExpr | pVariableExpr | pRecipeInstExpr
+
+##
+# @brief Compartment can have reactions, species, or instance of other recipe.
+# Compartment also have solver, geometry and diffusion.
+pCompartmentBody = OneOrMore( pYACMLExpr )
+pCompartment = COMPARTMENT + pComptName + IS + pGeometry +  HAS + pCompartmentBody + END
+pCompartment.setParseAction( add_compartment )
+
+# Recipe 
+pRecipeBody = OneOrMore( pYACMLExpr )
+pRecipe =  RECIPE_BEGIN + pRecipeName + HAS  + pRecipeBody + END 
+pRecipe.setParseAction( add_recipe )
+
+# Model
+# A model can have list of compartments instances. Solver, runtime and other
+# information. It can also have plot list but it should not be a part of YACML.
+
+pSimulatorName = pIdentifier
+pSimulator = SIMULATOR + pSimulatorName + Optional( pKeyValList ) + pEOS
+pSimulator.setParseAction( add_simulator )
+
+pComptType = pIdentifier 
+pComptInstName = pIdentifier 
+pComptNature = STOCHASTIC | DETERMINISTIC
+pComptInst =  Optional( pComptNature, "deterministic" ) \
+        + pComptInstName + IS + pComptType \
+        + Optional( pKeyValList, [] ) + pEOS
+
+pComptInst.setParseAction( add_compartment_instance )
+
+pModelName = pIdentifier
+pModelStmt = ( pComptInst | pSimulator )
+
+pModel = MODEL + pModelName + HAS +  OneOrMore( pModelStmt ) + END
+pModel.setParseAction( add_model )
+
+# There must be one and only one model statement in each file. Each model must
+# have at least one compartment. Each compartment must have at least one recipe.
+yacmlBNF_ = OneOrMore( pRecipe | pCompartment ) + pModel
+
+# yacmlBNF_ = OneOrMore( pCompartment )
+yacmlBNF_.setParseAction( parser_main )
+yacmlBNF_.ignore( javaStyleComment )
+#yacmlBNF_.setDebug( )
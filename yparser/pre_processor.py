@@ -19,7 +19,7 @@ import re
 import parser
 import ast
 import networkx as nx
-from math import *
+from math import pi
 
 # These are the keys which will/might have a complicated expression on them.
 keys_with_expressions_ = [ 'kf', 'kb', 'numKf', 'numKb', 'N', 'conc',
@@ -50,7 +50,7 @@ def pre_process_node( node, network ):
     attrs = network.node[node]
     for k, v in attrs.items():
         try:
-            attrs[key] = eval(v)
+            attrs[k] = expression.evaluate(v)
         except Exception as e:
             logger_.debug("Expression %s is not a simple python expression" % v)
             continue 
@@ -63,7 +63,7 @@ def reduce_expr( expr ):
     :param expr: String, Expression to be reduced.
     """
     try:
-        newExpr = str( eval( expr ) )
+        newExpr = str( expression.evaluate( expr ) )
         return newExpr, True
     except NameError as e:
         return expr, False
@@ -251,8 +251,8 @@ def compute_volume( network ):
     global globals_
     if 'geometry' in globals_:
         if globals_['geometry'] == 'cylinder':
-            r = eval(globals_['radius'])
-            l = eval(globals_['length'])
+            r = expression.evaluate(globals_['radius'])
+            l = expression.evaluate(globals_['length'])
             globals_['volume'] = str( pi * r * r * l )
         else:
             msg = 'For geometry %s, you must assign a volume' % globals_['geometry']
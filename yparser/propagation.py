@@ -0,0 +1,203 @@
+"""propagation.py: 
+
+Constant propagation on flattened YACML AST.
+
+Every variable and parameter element of the AST is a node of a dependency
+graph. Names used in an expression are resolved lexically: a variable is
+visible in the element which contains it and in all elements below it. The
+innermost definition wins. Geometry parameters (length, radius, volume etc.)
+are visible in the whole compartment.
+
+Nodes are evaluated once in topological order, therefore a value is always
+computed after the values it depends on. An expression is compiled once (see
+yparser.expression) and evaluated with the values of its dependencies; no
+text is substituted. Names which can not be resolved (species names, time t
+etc.) are substituted textually instead and such expressions are not reduced;
+they are later turned into moose.Function.
+
+The original expression of an element is kept in its 'expr' attribute when
+its text is changed.
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import utils.helper as helper
+import utils.xml as xml
+from config import logger_
+from .expression import substitute
+
+class Symbol( object ):
+    """A variable or parameter element and its dependencies.
+    """
+    __slots__ = [ 'elem', 'name', 'deps', 'reduced', 'value' ]
+
+    def __init__( self, elem ):
+        self.elem = elem
+        self.name = elem.attrib.get( 'name' )
+        # Map of identifier in expression to Symbol which defines it.
+        self.deps = { }
+        self.reduced = elem.attrib.get( 'is_reduced', 'false' ) == 'true'
+        # Numeric value if text is a number, else None.
+        self.value = None
+        if elem.text:
+            self.value = helper.literal_value( elem.text )
+
+    def path( self ):
+        """Human readable location of this symbol e.g. s1/recipeA/a/conc.
+        """
+        names = [ ]
+        elem = self.elem
+        while elem is not None:
+            names.append( elem.attrib.get( 'name', elem.attrib.get( 'id', elem.tag ) ) )
+            elem = elem.getparent( )
+        return '/'.join( reversed( names ) )
+
+class SymbolTable( object ):
+    """Scoped symbol table of an AST, built in one pass.
+    """
+
+    def __init__( self, root ):
+        self.root = root
+        # scope element -> { name : Symbol }
+        self.scopes = { }
+        self.symbols = [ ]
+        for elem in root.iter( 'variable', 'parameter' ):
+            sym = Symbol( elem )
+            self.symbols.append( sym )
+            scope = self.defining_scope( elem )
+            if scope is not None:
+                self.scopes.setdefault( scope, { } )[ sym.name ] = sym
+
+        for sym in self.symbols:
+            self.resolve_deps( sym )
+
+    def defining_scope( self, elem ):
+        """Scope in which elem defines its name. Parameters define a name only
+        when they are part of geometry.
+        """
+        parent = elem.getparent( )
+        if elem.tag == 'variable':
+            return parent
+        if parent is not None and parent.tag == 'geometry':
+            return parent.getparent( )
+        return None
+
+    def lookup( self, name, scope, exclude = None ):
+        """Find the innermost Symbol named name visible in scope. Names which
+        an instance of a recipe has not materialized are found in its
+        template.
+        """
+        while scope is not None:
+            sym = self.scopes.get( scope, { } ).get( name )
+            if sym is not None and sym is not exclude:
+                return sym
+            if 'template' in scope.attrib:
+                sym = self.scopes.get( xml.template_of( scope ), { } ).get( name )
+                if sym is not None and sym is not exclude:
+                    return sym
+            scope = scope.getparent( )
+        return None
+
+    def expression( self, sym ):
+        """Text in which dependencies of sym are looked for, None if sym does
+        not need to be evaluated.
+        """
+        if sym.reduced:
+            return None
+        return sym.elem.text
+
+    def resolve_deps( self, sym ):
+        text = self.expression( sym )
+        if not text:
+            return
+        # Lookup starts from the parent of element. A variable which uses its
+        # own name refers to the definition in an outer scope.
+        scope = sym.elem.getparent( )
+        if scope is not None and scope.tag == 'geometry':
+            scope = scope.getparent( )
+        for iden in set( helper.get_ids( text ) ):
+            dep = self.lookup( iden, scope, exclude = sym )
+            if dep is not None:
+                sym.deps[ iden ] = dep
+
+    def topological_order( self ):
+        """Symbols ordered such that each symbol comes after its dependencies.
+        Raise ValueError if dependencies are cyclic.
+        """
+        order, state = [ ], { }
+        # state: 1 = on the stack, 2 = done.
+        for start in self.symbols:
+            if start in state:
+                continue
+            stack = [ ( start, iter( start.deps.values( ) ) ) ]
+            state[ start ] = 1
+            while stack:
+                sym, deps = stack[-1]
+                for dep in deps:
+                    if dep not in state:
+                        state[ dep ] = 1
+                        stack.append( ( dep, iter( dep.deps.values( ) ) ) )
+                        break
+                    if state[ dep ] == 1:
+                        cycle = [ s for s, _ in stack ]
+                        cycle = cycle[ cycle.index( dep ): ] + [ dep ]
+                        raise ValueError(
+                                'Cyclic dependency between variables: %s' %
+                                ' -> '.join( [ s.path( ) for s in cycle ] )
+                                )
+                else:
+                    state[ sym ] = 2
+                    order.append( sym )
+                    stack.pop( )
+        return order
+
+def replacement_text( sym ):
+    text = sym.elem.text
+    if sym.reduced:
+        return '(%s)' % text if text.startswith( '-' ) else text
+    return '(%s)' % text
+
+def evaluate( sym ):
+    """Evaluate expression of sym with the values of its dependencies. If some
+    name has no value, substitute the text of dependencies into expression
+    instead. Dependencies must be evaluated already.
+    """
+    if not sym.deps:
+        return
+    elem = sym.elem
+    elem.attrib[ 'expr' ] = elem.text
+    code = helper.compile_expr( elem.text )
+    values = dict( [ ( k, d.value ) for k, d in sym.deps.items( ) ] )
+    if code is not None and code.names.issubset( values ) \
+            and None not in values.values( ):
+        try:
+            sym.value = code( values )
+            elem.text, elem.attrib[ 'is_reduced' ] = str( sym.value ), 'true'
+            sym.reduced = True
+        except Exception as e:
+            logger_.debug( 'Failed to evaluate %s: %s' % ( elem.text, e ) )
+
+    if not sym.reduced:
+        texts = dict( [ ( k, replacement_text( d ) ) for k, d in sym.deps.items( ) ] )
+        text = substitute( elem.text, texts )
+        elem.text, elem.attrib[ 'is_reduced' ] = helper.reduce_expr( text )
+        sym.reduced = elem.attrib[ 'is_reduced' ] == 'true'
+        if sym.reduced:
+            sym.value = helper.literal_value( elem.text )
+    logger_.debug( '|| %s = %s' % ( sym.path( ), elem.text ) )
+
+def propagate( root ):
+    """Do constant propagation on AST in place. Return the SymbolTable.
+    """
+    table = SymbolTable( root )
+    for sym in table.topological_order( ):
+        evaluate( sym )
+    return table
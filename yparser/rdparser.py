@@ -0,0 +1,348 @@
+"""rdparser.py: 
+
+Hand-written parser for YACML. It implements the grammar defined in bnf.py
+with a regular expression tokenizer and a recursive descent parser. Tokens are
+handed to the same add_* functions which pyparsing calls as parse actions,
+therefore both parsers produce the same AST.
+
+This parser does not backtrack: one token of lookahead (two for statements
+which begin with an identifier) decides every alternative.
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import re
+
+from . import bnf
+
+# Whitespace and comments (both C and C++ style) between tokens.
+skip_re_ = re.compile( r'(?:\s+|//(?:\\\n|[^\n])*|/\*(?:[^*]|\*(?!/))*\*/)*' )
+
+token_re_ = re.compile( r'''
+      (?P<num>\d+(?:[eE][+-]?\d+|\.\d*(?:[eE][+-]?\d+)?)?)
+    | (?P<dotnum>\.\d+)
+    | (?P<word>well-mixed|non-diffusive|[A-Za-z_]\w*)
+    | (?P<str>"(?:[^"\n\r\\]|""|\\(?:[^x]|x[0-9a-fA-F]+))*"
+        |'(?:[^'\n\r\\]|''|\\(?:[^x]|x[0-9a-fA-F]+))*')
+    | (?P<op><-|->|[;\[\]{}=+,-])
+    ''', re.VERBOSE )
+
+digits_re_ = re.compile( r'\d+' )
+
+species_kw_ = set( [ 'species', 'pool', 'enzyme' ] )
+reaction_kw_ = set( [ 'reaction', 'reac', 'enz_reac' ] )
+geometry_kw_ = set( [ 'cylinder', 'cube', 'spine' ] )
+model_kw_ = set( [ 'model', 'pathway' ] )
+nature_kw_ = set( [ 'stochastic', 'deterministic', 'well-mixed' ] )
+
+# Words which can not be used as identifiers (anyKeyword in bnf.py).
+reserved_ = species_kw_ | reaction_kw_ | geometry_kw_ | model_kw_ | set( [
+    'compartment', 'recipe', 'has', 'is', 'variable', 'const', 'buffered'
+    , 'end', 'deterministic', 'well-mixed', 'diffusive', 'simulator'
+    , 'non-diffusive' ] )
+
+class Token( object ):
+    __slots__ = [ 'kind', 'text', 'loc' ]
+
+    def __init__( self, kind, text, loc ):
+        self.kind, self.text, self.loc = kind, text, loc
+
+    def __repr__( self ):
+        return '%s(%r)' % ( self.kind, self.text )
+
+eof_ = 'eof'
+
+class Parser( object ):
+    """Recursive descent parser for one YACML text. Tokens are read on demand
+    so that stoichiometric coefficients (e.g. 2e3 which is 2 of species e3)
+    can be scanned differently from numbers.
+    """
+
+    def __init__( self, text ):
+        self.text = text
+        self.pos = 0
+        self.tok = None
+        self.advance( )
+
+    # Tokenizer.
+    def advance( self ):
+        """Read next token starting at self.pos into self.tok.
+        """
+        text = self.text
+        pos = skip_re_.match( text, self.pos ).end( )
+        if pos >= len( text ):
+            self.tok = Token( eof_, '', pos )
+            self.pos = pos
+            return
+        m = token_re_.match( text, pos )
+        if m is None:
+            self.error( 'Unexpected character %r' % text[pos], pos )
+        self.tok = Token( m.lastgroup, m.group( ), pos )
+        self.pos = m.end( )
+
+    def error( self, msg, loc = None ):
+        if loc is None:
+            loc = self.tok.loc
+        # Same error as pyparsing backend; pyparsing is imported only here.
+        from .pyparsing import ParseException
+        raise ParseException( self.text, loc, msg )
+
+    def take( self ):
+        tok = self.tok
+        self.advance( )
+        return tok
+
+    def peek_after( self ):
+        """Token after the current one, without consuming anything.
+        """
+        pos, tok = self.pos, self.tok
+        self.advance( )
+        nextTok = self.tok
+        self.pos, self.tok = pos, tok
+        return nextTok
+
+    def at( self, text ):
+        return self.tok.kind in ( 'op', 'word' ) and self.tok.text == text
+
+    def at_word( self, words ):
+        return self.tok.kind == 'word' and self.tok.text in words
+
+    def expect( self, text ):
+        if not self.at( text ):
+            self.error( 'Expected "%s"' % text )
+        return self.take( ).text
+
+    def expect_word( self, words, what ):
+        if not self.at_word( words ):
+            self.error( 'Expected %s' % what )
+        return self.take( ).text
+
+    def identifier( self ):
+        if self.tok.kind != 'word' or self.tok.text in reserved_:
+            self.error( 'Expected identifier' )
+        return self.take( ).text
+
+    def is_identifier( self, tok ):
+        return tok.kind == 'word' and tok.text not in reserved_
+
+    # Values and key-value lists.
+    def number( self, sign = '' ):
+        text = sign + self.take( ).text
+        if '.' in text or 'e' in text or 'E' in text:
+            return str( float( text ) )
+        return str( int( text ) )
+
+    def value( self ):
+        tok = self.tok
+        if tok.kind == 'num':
+            return self.number( )
+        if tok.kind == 'op' and tok.text in '+-':
+            # Sign is part of number only when it is attached to it.
+            nextTok = self.peek_after( )
+            if nextTok.kind == 'num' and nextTok.loc == tok.loc + 1:
+                self.take( )
+                return self.number( tok.text )
+        if tok.kind == 'dotnum':
+            return self.take( ).text
+        if tok.kind == 'str':
+            return self.take( ).text.replace( '"', '' )
+        if self.is_identifier( tok ):
+            return self.take( ).text
+        self.error( 'Expected a value' )
+
+    def key_val_list( self ):
+        self.expect( '[' )
+        pairs = [ ]
+        while True:
+            key = self.identifier( )
+            self.expect( '=' )
+            pairs.append( [ key, self.value( ) ] )
+            if not self.at( ',' ):
+                break
+            self.take( )
+            if self.at( ']' ):
+                break
+        self.expect( ']' )
+        return pairs
+
+    # Statements inside recipe and compartment.
+    def species_with_coeff( self ):
+        """A species name with optional stoichiometric coefficient e.g. 2a.
+        Coefficient is scanned from source text; a num token would read 2e3
+        as a number.
+        """
+        coeff = '1'
+        if self.tok.kind == 'num':
+            m = digits_re_.match( self.text, self.tok.loc )
+            coeff = m.group( )
+            self.pos = m.end( )
+            self.advance( )
+        return [ coeff, self.identifier( ) ]
+
+    def species_list( self, stop ):
+        items = [ self.species_with_coeff( ) ]
+        while self.at( '+' ):
+            self.take( )
+            if self.at( stop ):
+                break
+            items.append( self.species_with_coeff( ) )
+        return items
+
+    def species( self ):
+        buffered = 'false'
+        if self.at( 'buffered' ):
+            self.take( )
+            buffered = 'true'
+        kw = self.expect_word( species_kw_, 'species' )
+        name = self.identifier( )
+        kvs = self.key_val_list( )
+        self.expect( ';' )
+        return bnf.add_species( [ buffered, kw, name, kvs ] )
+
+    def reaction_declaration( self ):
+        kw = self.take( ).text
+        name = self.identifier( )
+        kvs = self.key_val_list( )
+        self.expect( ';' )
+        return bnf.add_reaction_declaration( [ kw, name, kvs ] )
+
+    def reaction_instantiation( self ):
+        subs = self.species_list( '<-' )
+        self.expect( '<-' )
+        if self.at( '[' ):
+            reac = self.key_val_list( )
+        else:
+            reac = self.identifier( )
+        self.expect( '->' )
+        prds = self.species_list( ';' )
+        self.expect( ';' )
+        return bnf.add_reaction_instantiation( [ subs, reac, prds ] )
+
+    def variable( self ):
+        kind = 'variable'
+        if self.at_word( ( 'const', 'variable' ) ):
+            kind = self.take( ).text
+        key = self.identifier( )
+        self.expect( '=' )
+        val = self.value( )
+        self.expect( ';' )
+        return bnf.add_variable( [ kind, [ key, val ] ] )
+
+    def recipe_instance( self ):
+        recipeType = self.identifier( )
+        name = self.identifier( )
+        self.expect( ';' )
+        return bnf.add_recipe_instance( [ recipeType, name ] )
+
+    def statement( self ):
+        tok = self.tok
+        if tok.kind == 'word':
+            if tok.text == 'buffered' or tok.text in species_kw_:
+                return self.species( )
+            if tok.text in reaction_kw_:
+                return self.reaction_declaration( )
+            if tok.text in ( 'const', 'variable' ):
+                return self.variable( )
+            nextTok = self.peek_after( )
+            if nextTok.kind == 'op' and nextTok.text in ( '+', '<-' ):
+                return self.reaction_instantiation( )
+            if nextTok.kind == 'op' and nextTok.text == '=':
+                return self.variable( )
+            return self.recipe_instance( )
+        if tok.kind == 'num':
+            return self.reaction_instantiation( )
+        self.error( 'Expected a species, reaction, variable or recipe instance' )
+
+    def body( self ):
+        elems = [ self.statement( ) ]
+        while not self.at( 'end' ):
+            elems.append( self.statement( ) )
+        self.take( )
+        return elems
+
+    # Top level declarations.
+    def geometry( self ):
+        shape = self.expect_word( geometry_kw_, 'geometry' )
+        kvs = self.key_val_list( ) if self.at( '[' ) else [ ]
+        return bnf.add_geometry( [ shape, kvs ] )
+
+    def compartment( self ):
+        kw = self.take( ).text
+        name = self.identifier( )
+        self.expect( 'is' )
+        geom = self.geometry( )
+        self.expect( 'has' )
+        return bnf.add_compartment( [ kw, name, geom ] + self.body( ) )
+
+    def recipe( self ):
+        kw = self.take( ).text
+        name = self.identifier( )
+        self.expect( 'has' )
+        return bnf.add_recipe( [ kw, name ] + self.body( ) )
+
+    def simulator( self ):
+        tokens = [ self.take( ).text, self.identifier( ) ]
+        if self.at( '[' ):
+            tokens.append( self.key_val_list( ) )
+        self.expect( ';' )
+        return bnf.add_simulator( tokens )
+
+    def compartment_instance( self ):
+        nature = 'deterministic'
+        if self.at_word( nature_kw_ ):
+            nature = self.take( ).text
+        name = self.identifier( )
+        self.expect( 'is' )
+        comptType = self.identifier( )
+        kvs = self.key_val_list( ) if self.at( '[' ) else [ ]
+        self.expect( ';' )
+        return bnf.add_compartment_instance( [ nature, name, comptType, kvs ] )
+
+    def model( self ):
+        kw = self.expect_word( model_kw_, 'model or pathway' )
+        name = self.identifier( )
+        self.expect( 'has' )
+        stmts = [ ]
+        while True:
+            if self.at( 'simulator' ):
+                stmts.append( self.simulator( ) )
+            else:
+                stmts.append( self.compartment_instance( ) )
+            if self.at( 'end' ):
+                break
+        self.take( )
+        return bnf.add_model( [ kw, name ] + stmts )
+
+    def document( self ):
+        """One or more recipes or compartments followed by a model. Like
+        pyparsing grammar, text after the model is not looked at.
+        """
+        elems = [ ]
+        while True:
+            if self.at( 'recipe' ):
+                elems.append( self.recipe( ) )
+            elif self.at( 'compartment' ):
+                elems.append( self.compartment( ) )
+            else:
+                break
+        if not elems:
+            self.error( 'Expected a recipe or compartment' )
+        elems.append( self.model( ) )
+        return elems
+
+def parse_text( text, root ):
+    """Parse YACML text and append its recipes, compartments and model to
+    root. Unlike the pyparsing grammar this parser has no global state and may
+    run in many threads at once.
+    """
+    for elem in Parser( text ).document( ):
+        root.append( elem )
+    return root
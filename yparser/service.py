@@ -0,0 +1,65 @@
+"""service.py: 
+
+Parse many YACML files in parallel using a pool of processes.
+
+"""
+    
+__author__           = "Dilawar Singh"
+__copyright__        = "Copyright 2016, Dilawar Singh"
+__credits__          = ["NCBS Bangalore"]
+__license__          = "GNU GPL"
+__version__          = "1.0.0"
+__maintainer__       = "Dilawar Singh"
+__email__            = "dilawars@ncbs.res.in"
+__status__           = "Development"
+
+import multiprocessing
+import lxml.etree as etree
+
+from . import yparser as yp
+from config import logger_
+
+def parse_to_string( filename ):
+    """Parse a file in worker process. lxml elements can not be pickled so AST
+    is sent back as string.
+    """
+    try:
+        return etree.tostring( yp.parse( filename ) )
+    except Exception as e:
+        # pyparsing exceptions can not be unpickled in parent process.
+        raise RuntimeError( 'Failed to parse %s: %s' % ( filename, e ) )
+
+class ParseService( object ):
+    """A pool of worker processes which parse YACML files.
+
+        with ParseService( jobs = 4 ) as service:
+            asts = service.parse( filenames )
+    """
+
+    def __init__( self, jobs = None ):
+        self.jobs = jobs
+        self.pool = multiprocessing.Pool( jobs )
+
+    def parse( self, filenames ):
+        """Parse filenames and return list of ASTs in the same order.
+        """
+        logger_.info( 'Parsing %d files' % len( filenames ) )
+        results = self.pool.map( parse_to_string, filenames )
+        return [ etree.fromstring( x ) for x in results ]
+
+    def close( self ):
+        self.pool.close( )
+        self.pool.join( )
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.close( )
+
+def parse_files( filenames, jobs = None ):
+    """Parse filenames in a pool of jobs processes. Return list of ASTs in
+    input order.
+    """
+    with ParseService( jobs ) as service:
+        return service.parse( filenames )
@@ -15,14 +15,117 @@ __status__           = "Development"
 
 
 import bnf 
+import rdparser
 from config import logger_
-import pylab
 import lxml.etree as etree
 
-def parse_text( text ):
-    pass
+import os
+import threading
+from collections import deque
 
-def parse( filename ):
+# Default number of (expression, location) results kept by packrat parser.
+packrat_cache_size_ = 4096
+
+class PackratCache( dict ):
+    """Bounded memo table for pyparsing packrat mode.
+
+    pyparsing keeps its memo table in a plain dict which grows with the size of
+    input. This dict forgets the oldest entry once it holds more than `size`
+    entries. Backtracking in YACML grammar is local to a statement, so old
+    entries are rarely useful anyway. Lookups are plain dict lookups.
+    """
+
+    def __init__( self, size ):
+        dict.__init__( self )
+        self.size = size
+        self._keys = deque( )
+
+    def __setitem__( self, key, value ):
+        if key not in self:
+            self._keys.append( key )
+            if len( self._keys ) > self.size:
+                dict.__delitem__( self, self._keys.popleft( ) )
+        dict.__setitem__( self, key, value )
+
+    def clear( self ):
+        dict.clear( self )
+        self._keys.clear( )
+
+def enable_memoization( cache_size = None ):
+    """Enable packrat (memoized) parsing with a bounded cache.
+
+    :param cache_size: Maximum number of cached parse results. Default is
+        packrat_cache_size_.
+    """
+    from .pyparsing import ParserElement
+    if cache_size is None:
+        cache_size = packrat_cache_size_
+    assert cache_size > 0, "Cache size must be > 0"
+    ParserElement._exprArgCache = PackratCache( cache_size )
+    ParserElement.enablePackrat( )
+    logger_.debug( 'Enabled packrat parsing, cache size %s' % cache_size )
+
+def disable_memoization( ):
+    """Switch back to plain (non-memoized) parsing.
+    """
+    from .pyparsing import ParserElement
+    ParserElement._packratEnabled = False
+    ParserElement._parse = ParserElement._parseNoCache
+    ParserElement._exprArgCache = { }
+
+# Parser backend: 'pyparsing' uses the grammar in grammar.py, 'fast' uses the
+# hand-written recursive descent parser in rdparser.py. Both produce the same
+# AST. pyparsing and the grammar are imported on first use.
+backends_ = [ 'pyparsing', 'fast' ]
+backend_ = os.environ.get( 'YACML_PARSER', 'pyparsing' )
+
+def set_backend( name ):
+    global backend_
+    assert name in backends_, 'Unknown parser backend %s' % name
+    backend_ = name
+
+# pyparsing keeps global state while parsing: the packrat memo table and the
+# arity probing of parse actions. Parsing with the pyparsing grammar is
+# therefore serialised; it is pure python and would hold the GIL anyway. Use
+# yparser.service to parse files in parallel.
+parse_lock_ = threading.Lock( )
+
+class ParserContext( object ):
+    """State of one parse. It owns the output AST.
+    """
+
+    def __init__( self, filename = None ):
+        self.filename = filename
+        self.xml = etree.Element( 'yacml' )
+
+def parse_text( text, context = None, backend = None ):
+    """Parse YACML text and return its AST in XML.
+
+    Each call returns an independent AST; it is safe to call from many
+    threads.
+
+    :param text: YACML model as string.
+    :param context: ParserContext to use. A new one is created by default.
+    :param backend: 'pyparsing' or 'fast'. Default is backend_.
+    """
+    if context is None:
+        context = ParserContext( )
+    backend = backend or backend_
+    if backend == 'fast':
+        return rdparser.parse_text( text, context.xml )
+
+    assert backend == 'pyparsing', 'Unknown parser backend %s' % backend
+    from . import grammar
+    with parse_lock_:
+        bnf.context_ = context
+        try:
+            grammar.yacmlBNF_.parseString( text )
+        finally:
+            bnf.context_ = None
+    return context.xml
+
+def parse( filename, backend = None ):
     print( '[INFO] Parsing %s' % filename )
-    data = bnf.yacmlBNF_.parseFile( filename )
-    return data[0]
+    with open( filename ) as f:
+        text = f.read( )
+    return parse_text( text, ParserContext( filename ), backend )